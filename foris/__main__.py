@@ -1,13 +1,23 @@
-import argparse
-import bottle
-import logging
-import os
-import re
-import typing
+import sys
 
-from foris import __version__
-from foris.state import current_state
-from foris.backend import Backend
+from foris import profiling
+from foris.profiling import profiler
+
+if "--profile-startup" in sys.argv:
+    # the profiler has to be started before the remaining imports to measure them
+    profiler.start()
+
+import argparse  # noqa: E402
+import bottle  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import typing  # noqa: E402
+
+from foris import __version__  # noqa: E402
+from foris.state import current_state  # noqa: E402
+from foris.backend import Backend  # noqa: E402
+from foris.utils.servers import PreforkServer, ThreadingWSGIServer  # noqa: E402
 
 
 def get_arg_parser():
@@ -24,7 +34,52 @@ def get_arg_parser():
     group.add_argument(
         "--session-timeout", type=int, default=900, help="session timeout (in seconds)"
     )
-    group.add_argument("-s", "--server", choices=["wsgiref", "flup", "cgi"], default="wsgiref")
+    group.add_argument(
+        "-s",
+        "--server",
+        choices=["wsgiref", "threaded", "prefork", "flup", "cgi"],
+        default="wsgiref",
+        help="threaded - request per thread, prefork - requests processed in worker processes",
+    )
+    group.add_argument(
+        "--workers", type=int, default=2, help="number of worker processes (prefork server only)"
+    )
+    group.add_argument(
+        "--worker-threads",
+        action="store_true",
+        help="process requests in threads within each worker (prefork server only)",
+    )
+    group.add_argument(
+        "--session-store",
+        choices=["ubus", "sqlite", "cookie"],
+        default="ubus",
+        help="where the sessions are stored (websocket authorization requires ubus)",
+    )
+    group.add_argument(
+        "--session-db",
+        default="/tmp/foris-sessions.db",
+        help="path to session database (sqlite session store only)",
+    )
+    group.add_argument(
+        "--session-secret-file",
+        type=lambda x: read_secret_file(x),
+        default=None,
+        help="path to file with the secret used to sign the sessions (cookie session store) "
+        "and CSRF tokens (hmac CSRF mode)",
+    )
+    group.add_argument(
+        "--csrf-mode",
+        choices=["session", "hmac"],
+        default="session",
+        help="session - random CSRF token is stored in the session, "
+        "hmac - token is derived from the session id (no session access needed)",
+    )
+    group.add_argument(
+        "--csrf-bucket",
+        type=int,
+        default=0,
+        help="CSRF tokens expire after 1-2 buckets (in seconds, hmac CSRF mode only, 0=never)",
+    )
     group.add_argument("-d", "--debug", action="store_true")
     group.add_argument(
         "--noauth",
@@ -32,6 +87,35 @@ def get_arg_parser():
         help="disable authentication (available only in debug mode)",
     )
     parser.add_argument("-R", "--routes", action="store_true", help="print routes and exit")
+    parser.add_argument(
+        "--build-static-manifest",
+        action="store_true",
+        help="write digests of the static files of foris and its plugins and exit",
+    )
+    parser.add_argument(
+        "--fingerprint-static",
+        action="store_true",
+        help="also create copies of the static files with the digest in their names "
+        "(used with --build-static-manifest)",
+    )
+    parser.add_argument(
+        "--compress-static",
+        action="store_true",
+        help="also create precompressed (.gz, .br) variants of the static files "
+        "(used with --build-static-manifest)",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="prepare the application, print durations of the startup phases and imports "
+        "and peak RSS and exit",
+    )
+    parser.add_argument(
+        "--startup-baseline",
+        default=None,
+        help="json file with a startup profile to compare with (used with --profile-startup, "
+        "the file is created when it doesn't exist, regressions lead to non-zero exit code)",
+    )
     group.add_argument(
         "-S",
         "--static",
@@ -66,6 +150,16 @@ def get_arg_parser():
         help="sets which controller on the messages bus should be configured (8 bytes in hex)",
     )
     group.add_argument("--bus-socket", default="/var/run/ubus/ubus.sock", help="message bus socket path")
+    group.add_argument(
+        "--bus-notifications-socket",
+        default="/tmp/foris-controller-notifications.soc",
+        help="message bus notifications socket path (unix-socket bus only)",
+    )
+    group.add_argument(
+        "--no-listener",
+        action="store_true",
+        help="don't listen to backend notifications (data are reloaded on every request)",
+    )
     group.add_argument(
         "--ws-port", default=0, help="websocket server port - insecure (0=autodetect)", type=int
     )
@@ -96,9 +190,23 @@ def get_arg_parser():
 
 
 def main():
+    profiler.mark("imports")
+
     parser = get_arg_parser()
     args = parser.parse_args()
 
+    if args.csrf_mode == "hmac" and args.session_store == "cookie":
+        # cookie session id changes whenever the session data change
+        parser.error("hmac CSRF mode can't be used with cookie session store")
+
+    if args.session_store == "cookie" and not args.session_secret_file:
+        # sessions signed by a random secret would be lost on restart (or after each cgi request)
+        parser.error("cookie session store requires --session-secret-file")
+
+    if args.csrf_mode == "hmac" and not args.session_secret_file:
+        # tokens signed by a random secret wouldn't survive a restart (or a cgi request)
+        parser.error("hmac CSRF mode requires --session-secret-file")
+
     # setup logging
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
     logger = logging.getLogger("foris")
@@ -109,6 +217,12 @@ def main():
 
     logger.debug("Version %s", __version__)
 
+    if args.build_static_manifest:
+        from foris.utils.static_manifest import build_manifests
+
+        build_manifests(args.fingerprint_static, args.compress_static)
+        return True
+
     # try to include sentry (if installed)
     try:
         import sentry_sdk
@@ -124,18 +238,19 @@ def main():
         pass
 
     # set backend
-    if args.message_bus in ["ubus", "unix-socket"]:
-        current_state.set_backend(Backend(args.message_bus, path=args.bus_socket))
-    elif args.message_bus == "mqtt":
-        current_state.set_backend(
-            Backend(
-                args.message_bus,
-                host=args.mqtt_host,
-                port=args.mqtt_port,
-                credentials=args.mqtt_passwd_file,
-                controller_id=args.mqtt_controller_id,
+    with profiler.phase("backend"):
+        if args.message_bus in ["ubus", "unix-socket"]:
+            current_state.set_backend(Backend(args.message_bus, path=args.bus_socket))
+        elif args.message_bus == "mqtt":
+            current_state.set_backend(
+                Backend(
+                    args.message_bus,
+                    host=args.mqtt_host,
+                    port=args.mqtt_port,
+                    credentials=args.mqtt_passwd_file,
+                    controller_id=args.mqtt_controller_id,
+                )
             )
-        )
 
     # update websocket
     current_state.set_websocket(args.ws_port, args.ws_path, args.wss_port, args.wss_path)
@@ -143,17 +258,70 @@ def main():
     current_state.set_assets_path(args.assets)
 
     if args.app == "config":
-        from foris.config_app import prepare_config_app
+        with profiler.phase("app"):
+            from foris.config_app import prepare_config_app
 
-        main_app = prepare_config_app(args)
+            main_app = prepare_config_app(args)
 
     if args.routes:
         # routes should be printed and we can safely exit
         return True
 
+    if args.profile_startup:
+        return report_startup_profile(args.startup_baseline)
+
+    def start_listener():
+        listener = current_state.backend.start_listener(args.bus_notifications_socket)
+        listener.add_handler(current_state.handle_notification)
+        if args.app == "config":
+            from foris.config_handlers import updater
+
+            listener.add_handler(updater.handle_notification)
+
+    # sessions can be cached only when all requests are processed within this process
+    # (several flup processes can be spawned by the web server)
+    if args.session_store == "ubus" and args.server in ["wsgiref", "threaded"]:
+        from foris.ubus.sessions import session_cache
+
+        session_cache.enable()
+
+    # cgi process handles only a single request so there is nothing to keep up-to-date
+    # prefork workers start their own listeners (threads are not preserved by fork)
+    if not args.no_listener and args.server not in ["cgi", "prefork"]:
+        start_listener()
+
+    def post_fork():
+        # connections can't be shared with the parent process
+        if "ubus" in [args.session_store, args.message_bus]:
+            from foris.ubus import reconnect as reconnect_ubus
+
+            reconnect_ubus()
+        current_state.backend.after_fork()
+        if not args.no_listener:
+            start_listener()
+
     # run the right server
     if args.server == "wsgiref":
         bottle.run(app=main_app, host=args.host, port=args.port, debug=args.debug)
+    elif args.server == "threaded":
+        bottle.run(
+            app=main_app,
+            host=args.host,
+            port=args.port,
+            debug=args.debug,
+            server_class=ThreadingWSGIServer,
+        )
+    elif args.server == "prefork":
+        bottle.run(
+            app=main_app,
+            server=PreforkServer,
+            host=args.host,
+            port=args.port,
+            debug=args.debug,
+            workers=args.workers,
+            threads=args.worker_threads,
+            post_fork=post_fork,
+        )
     elif args.server == "flup":
         # bindAddress is None - FCGI process must be spawned by the server
         bottle.run(app=main_app, server="flup", debug=args.debug, bindAddress=None)
@@ -161,6 +329,35 @@ def main():
         bottle.run(app=main_app, server="cgi", debug=args.debug)
 
 
+def report_startup_profile(baseline_path: typing.Optional[str]) -> bool:
+    """ Prints the startup profile and compares it with the baseline
+
+    Exits with non-zero status when a regression is found.
+    """
+    profiler.stop()
+    print(profiler.report())
+    if not baseline_path:
+        return True
+
+    regressions = profiling.check_baseline(baseline_path, profiler.to_dict())
+    if regressions is None:
+        print("\nBaseline written to '%s'." % baseline_path)
+    elif regressions:
+        print("\nRegressions against '%s':" % baseline_path)
+        print("\n".join("  %s" % e for e in regressions))
+        sys.exit(1)
+    else:
+        print("\nNo regressions against '%s'." % baseline_path)
+    return True
+
+
+def read_secret_file(path: str) -> bytes:
+    """ Returns secret stored in a file
+    """
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+
 def read_passwd_file(path: str) -> typing.Tuple[str]:
     """ Returns username and password from passwd file
     """
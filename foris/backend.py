@@ -14,11 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import json
 import logging
+import multiprocessing
+import queue
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 from foris_client.buses.base import ControllerError
 
+from foris.state import current_state
+from foris.utils.caches import BackendCache
+from foris.utils import timing
+from foris.utils.metrics import metrics
+
 logger = logging.getLogger("foris.backend")
 
 
@@ -29,45 +41,297 @@ class ExceptionInBackend(Exception):
         self.remote_description = remote_description
 
 
+class BackendUnavailable(Exception):
+    """ Raised when the backend is considered to be unreachable (see CircuitBreaker)
+    """
+
+    def __init__(self, module, action):
+        super(BackendUnavailable, self).__init__(
+            "Backend is unavailable (%s.%s not sent)" % (module, action)
+        )
+        self.module = module
+        self.action = action
+
+
+class BackendBusy(RuntimeError):
+    """ Raised when the connection to the backend is used by another request for too long
+        (the backend itself might be reachable)
+    """
+
+
+# messages of RuntimeError raised by python-ubus when the backend is unreachable
+# (missing method is reported as "Method not found")
+UBUS_TRANSPORT_ERRORS = (
+    "Failed to find object",
+    "Not found",
+    "Request timed out",
+    "Connection failed",
+)
+
+
+def _is_transport_error(error):
+    message = str(error)
+    if "Method not found" in message:
+        return False
+    return any(e in message for e in UBUS_TRANSPORT_ERRORS)
+
+
+class CircuitBreaker(object):
+    """ Stops sending requests to the backend after several consecutive failures
+        so the requests don't have to wait for the timeout while the backend is down
+
+        While the circuit is open a probe is periodically performed in the background.
+        The circuit gets closed again as soon as the probe succeeds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, probe, failure_threshold=3, probe_interval=5):
+        """
+        :param probe: function which raises an exception when the backend is unreachable
+        :type probe: callable
+        :param failure_threshold: number of consecutive failures which opens the circuit
+        :param probe_interval: time between two probes (in seconds)
+        """
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self.state == CircuitBreaker.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CircuitBreaker.CLOSED:
+                logger.warning("Backend is reachable again.")
+            self.state = CircuitBreaker.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state != CircuitBreaker.CLOSED or self.failures < self.failure_threshold:
+                return
+            self.state = CircuitBreaker.OPEN
+
+        logger.error("Backend is unreachable (%d failures in a row).", self.failures)
+        thread = threading.Thread(target=self._probe_loop, name="foris-backend-probe")
+        thread.daemon = True
+        thread.start()
+
+    def _probe_loop(self):
+        while not self.closed:
+            time.sleep(self.probe_interval)
+            self.state = CircuitBreaker.HALF_OPEN
+            try:
+                self.probe()
+            except BackendBusy as e:
+                logger.debug("Backend probe skipped. (%s)", e)
+                self.state = CircuitBreaker.OPEN
+            except Exception as e:
+                logger.debug("Backend probe failed. (%s)", e)
+                self.state = CircuitBreaker.OPEN
+            else:
+                self.record_success()
+
+
 class Backend(object):
     DEFAULT_TIMEOUT = 30000  # in ms
+    READ_TIMEOUT = 10000  # in ms (get_* actions)
+    ACTION_TIMEOUTS = {  # in ms
+        ("maintain", "generate_backup"): 120000,
+        ("maintain", "restore_backup"): 120000,
+        ("maintain", "reboot"): 60000,
+    }
+    MAX_PARALLEL_REQUESTS = 4
+
+    # request which is used to check whether unreachable backend is back
+    PROBE_REQUEST = ("web", "get_data")
+    PROBE_TIMEOUT = 2000  # in ms
+
+    # time to live (in seconds) of cached get_* responses for each module
+    # responses of modules which are not listed here are not cached
+    CACHE_TTLS = {
+        "dns": 60,
+        "guest": 60,
+        "lan": 10,
+        "networks": 60,
+        "remote": 60,
+        "router_notifications": 60,
+        "updater": 10,
+        "wan": 60,
+        "wifi": 60,
+    }
+    # get_* actions which return volatile data
+    CACHE_EXCLUDED = [("wan", "get_wan_status")]
+    CACHE_MAX_SIZE = 256 * 1024  # in bytes
+    # modules which settings could be affected by an update of other module
+    CACHE_DEPENDENCIES = {"networks": ["wan", "lan", "guest", "wifi"]}
 
     def __init__(self, name, **kwargs):
         self.name = name
         self.controller_id = None
 
-        if name == "ubus":
+        if name in ["ubus", "unix-socket"]:
+            self.path = kwargs["path"]
+
+        elif name == "mqtt":
+            self.host = kwargs["host"]
+            self.port = kwargs["port"]
+            self.credentials = kwargs["credentials"]
+            self.controller_id = kwargs["controller_id"]
+
+        # created lazily so that forked worker processes don't share the connection
+        self._instance = None
+        self.cache = BackendCache("backend", self.CACHE_TTLS, self.CACHE_MAX_SIZE)
+        self.listener = None
+        self.circuit_breaker = CircuitBreaker(self._probe)
+        self._instance_lock = self._create_instance_lock()
+
+        # senders used by the worker threads of perform_many() (one per thread)
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # idle senders which can be used by concurrently processed requests
+        self._senders = []
+        self._senders_lock = threading.Lock()
+
+    def after_fork(self):
+        """ Drops connections and threads inherited from the parent process
+            (should be called in a forked worker process)
+        """
+        self._instance = None
+        self._instance_lock = self._create_instance_lock()
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._senders = []
+        self._senders_lock = threading.Lock()
+        self.listener = None
+        self.cache.invalidate()
+        self.circuit_breaker = CircuitBreaker(self._probe)
+
+    def _create_sender(self):
+        if self.name == "ubus":
             from foris_client.buses.ubus import UbusSender
 
-            self.path = kwargs["path"]
-            self._instance = UbusSender(kwargs["path"], default_timeout=self.DEFAULT_TIMEOUT)
+            return UbusSender(self.path, default_timeout=self.DEFAULT_TIMEOUT)
 
-        elif name == "unix-socket":
+        elif self.name == "unix-socket":
             from foris_client.buses.unix_socket import UnixSocketSender
 
-            self.path = kwargs["path"]
-            self._instance = UnixSocketSender(kwargs["path"], default_timeout=self.DEFAULT_TIMEOUT)
+            return UnixSocketSender(self.path, default_timeout=self.DEFAULT_TIMEOUT)
 
-        elif name == "mqtt":
+        elif self.name == "mqtt":
             from foris_client.buses.mqtt import MqttSender
 
-            self.host = kwargs["host"]
-            self.port = kwargs["port"]
-            self.credentials = kwargs["credentials"]
-            self.controller_id = kwargs["controller_id"]
-            self._instance = MqttSender(
-                kwargs["host"],
-                kwargs["port"],
+            return MqttSender(
+                self.host,
+                self.port,
                 default_timeout=self.DEFAULT_TIMEOUT,
-                credentials=kwargs["credentials"],
+                credentials=self.credentials,
             )
 
+    def _create_instance_lock(self):
+        if self.name == "ubus":
+            # python-ubus uses a single connection per process which is also used
+            # by the ubus sessions, so the calls have to be serialized by the same lock
+            from foris.ubus import lock
+
+            return lock
+
+        return threading.Lock()
+
+    def start_listener(self, notifications_path=None):
+        """ Starts to listen to the notifications of the backend. Cached responses
+            are kept until a notification of the corresponding module arrives.
+
+        :param notifications_path: path to notifications socket (unix-socket bus only)
+        :type notifications_path: str
+        :returns: started listener
+        :rtype: BackendListener
+        """
+        self.listener = BackendListener(self, notifications_path)
+        self.listener.add_handler(self._handle_notification)
+        self.listener.start()
+        return self.listener
+
+    @property
+    def listening(self):
+        return self.listener is not None and self.listener.listening
+
+    def _handle_notification(self, module):
+        if module is None:
+            # notifications could have been missed
+            self.cache.invalidate()
+        else:
+            self.invalidate_cache(module)
+
+    @property
+    def supports_parallel_requests(self):
+        """ ubus client library uses a single connection per process,
+            so the requests can't be sent through it in parallel
+        """
+        return self.name in ["unix-socket", "mqtt"]
+
+    def _get_instance(self):
+        if self._instance is None:
+            self._instance = self._create_sender()
+        return self._instance
+
+    @contextlib.contextmanager
+    def _acquire_sender(self):
+        """ Obtains a sender which is not used by any other thread
+        """
+        with self._senders_lock:
+            sender = self._senders.pop() if self._senders else None
+        if sender is None:
+            sender = self._create_sender()
+        try:
+            yield sender
+        finally:
+            with self._senders_lock:
+                self._senders.append(sender)
+
+    def _get_thread_sender(self):
+        sender = getattr(self._local, "sender", None)
+        if sender is None:
+            sender = self._create_sender()
+            self._local.sender = sender
+        return sender
+
+    @contextlib.contextmanager
+    def _acquire_thread_sender(self):
+        yield self._get_thread_sender()
+
+    @contextlib.contextmanager
+    def _acquire_instance(self):
+        """ Obtains the shared sender (requests are sent through it one after another)
+        """
+        with self._instance_lock:
+            yield self._get_instance()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.MAX_PARALLEL_REQUESTS, thread_name_prefix="foris-backend"
+                )
+            return self._executor
+
     def __repr__(self):
         if self.name in ["unix-socket", "ubus"]:
-            return "%s('%s')" % (type(self._instance).__name__, self.path)
+            return "%s('%s')" % (type(self._get_instance()).__name__, self.path)
         elif self.name == "mqtt":
-            return "%s('%s:%d')" % (type(self._instance).__name__, self.host, self.port)
-        return "%s" % type(self._instance).__name__
+            return "%s('%s:%d')" % (type(self._get_instance()).__name__, self.host, self.port)
+        return "%s" % type(self._get_instance()).__name__
 
     def perform(
         self, module, action, data=None, raise_exception_on_failure=True, controller_id=None
@@ -78,13 +342,155 @@ class Backend(object):
         :rtype: NoneType or dict
         :raises ExceptionInBackend: When command failed and raise_exception_on_failure is True
         """
+        if self.supports_parallel_requests:
+            # don't block the requests which are processed concurrently
+            acquire_sender = self._acquire_sender
+        else:
+            acquire_sender = self._acquire_instance
+
+        return self._perform(
+            acquire_sender, module, action, data, raise_exception_on_failure, controller_id
+        )
+
+    def perform_many(self, requests, raise_exception_on_failure=True, controller_id=None):
+        """ Perform several backend actions at once
+
+        The requests are sent in parallel (using a separate connection per worker thread)
+        when the message bus allows it. Otherwise they are sent one after another.
+
+        :param requests: list of (module, action) or (module, action, data) tuples
+        :type requests: list
+        :returns: list of responses in the same order as the requests (None on error)
+        :rtype: list
+        :raises ExceptionInBackend: When any command failed and raise_exception_on_failure is True
+                                    (the first failed request in order is reported)
+        """
+        requests = [(e[0], e[1], e[2] if len(e) > 2 else None) for e in requests]
+
+        if len(requests) < 2 or not self.supports_parallel_requests:
+            return [
+                self.perform(module, action, data, raise_exception_on_failure, controller_id)
+                for module, action, data in requests
+            ]
+
+        timings = timing.current()
+
+        def worker(module, action, data):
+            with timing.use(timings):
+                return self._perform(
+                    self._acquire_thread_sender,
+                    module,
+                    action,
+                    data,
+                    raise_exception_on_failure,
+                    controller_id,
+                )
+
+        executor = self._get_executor()
+        futures = [executor.submit(worker, *request) for request in requests]
+
+        # wait for all the requests to finish before an exception is propagated
+        results = []
+        error = None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(None)
+                error = error or e
+
+        if error:
+            raise error
+
+        return results
+
+    def _probe(self):
+        module, action = self.PROBE_REQUEST
+        if self.supports_parallel_requests:
+            sender = self._get_thread_sender()
+            sender.send(module, action, None, timeout=self.PROBE_TIMEOUT)
+            return
+
+        # don't wait for the requests which were sent before the circuit was opened
+        if not self._instance_lock.acquire(timeout=self.PROBE_TIMEOUT / 1000):
+            raise BackendBusy("Backend connection is busy.")
+        try:
+            self._get_instance().send(module, action, None, timeout=self.PROBE_TIMEOUT)
+        finally:
+            self._instance_lock.release()
+
+    def get_timeout(self, module, action):
+        """ Returns timeout of the backend request (in ms)
+        """
+        timeout = self.ACTION_TIMEOUTS.get((module, action))
+        if timeout:
+            return timeout
+        return self.READ_TIMEOUT if action.startswith("get_") else self.DEFAULT_TIMEOUT
+
+    def _is_cacheable(self, module, action):
+        return (
+            action.startswith("get_")
+            and self.cache.is_cached_module(module)
+            and (module, action) not in self.CACHE_EXCLUDED
+        )
+
+    @staticmethod
+    def _is_read_only(action):
+        return action.startswith("get") or action in ["list", "check"]
+
+    def invalidate_cache(self, module):
+        """ Drops cached responses which could be affected by an update of the module
+        """
+        if module == "maintain":
+            # e.g. restored backup
+            self.cache.invalidate()
+            return
+
+        self.cache.invalidate(module)
+        for dependent in self.CACHE_DEPENDENCIES.get(module, []):
+            self.cache.invalidate(dependent)
+
+    def _perform(
+        self, acquire_sender, module, action, data, raise_exception_on_failure, controller_id
+    ):
+        """ Sends the request unless it is cached or the backend is unavailable
+
+        :param acquire_sender: context manager factory which provides the sender
+                               (it is entered only when the request is really sent)
+        """
+        controller_id = controller_id or self.controller_id
+
+        cache_key = None
+        if self._is_cacheable(module, action):
+            cache_key = (controller_id, module, action, json.dumps(data, sort_keys=True))
+            hit, response = self.cache.get(cache_key)
+            if hit:
+                return response
+
+        labels = (("module", module), ("action", action))
+        if not self.circuit_breaker.closed:
+            logger.error("Backend is unavailable. Request %s.%s not sent.", module, action)
+            metrics.inc("foris_backend_errors_total", labels)
+            raise BackendUnavailable(module, action)
+
         response = None
         start_time = time.time()
         try:
-            response = self._instance.send(
-                module, action, data, controller_id=controller_id or self.controller_id
-            )
+            with acquire_sender() as sender:
+                response = sender.send(
+                    module,
+                    action,
+                    data,
+                    timeout=self.get_timeout(module, action),
+                    controller_id=controller_id,
+                )
+            self.circuit_breaker.record_success()
+            if cache_key and response is not None:
+                self.cache.set(cache_key, module, response)
         except ControllerError as e:
+            # backend is reachable, the request itself failed
+            self.circuit_breaker.record_success()
+            metrics.inc("foris_backend_errors_total", labels)
             logger.error("Exception in backend occured.")
             if raise_exception_on_failure:
                 error = e.errors[0]  # right now we are dealing only with the first error
@@ -92,17 +498,167 @@ class Backend(object):
                 if data is not None:
                     msg["data"] = data
                 raise ExceptionInBackend(msg, error["stacktrace"], error["description"])
+        except BackendBusy as e:
+            # the connection is used by someone else, the backend might be reachable
+            metrics.inc("foris_backend_errors_total", labels)
+            logger.error("Backend connection is busy. Request %s.%s not sent.", module, action)
+            if raise_exception_on_failure:
+                raise e
         except RuntimeError as e:
             # This may occure when e.g. calling function is not present in backend
+            # (i.e. backend is reachable) or when the backend doesn't respond (python-ubus)
+            if _is_transport_error(e):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            metrics.inc("foris_backend_errors_total", labels)
             logger.error("RuntimeError occured during the communication with backend.")
             if raise_exception_on_failure:
                 raise e
         except Exception as e:
+            self.circuit_breaker.record_failure()
+            metrics.inc("foris_backend_errors_total", labels)
             logger.error("Exception occured during the communication with backend. (%s)", e)
             raise e
         finally:
-            logger.debug(
-                "Query took %f: %s.%s - %s", time.time() - start_time, module, action, data
-            )
+            if not self._is_read_only(action):
+                # even a failed request could change something
+                self.invalidate_cache(module)
+                # the next request (e.g. a redirect after POST) usually arrives before
+                # the notification, so web data are outdated right away
+                current_state.handle_notification(module)
+            duration = time.time() - start_time
+            metrics.observe("foris_backend_request_seconds", labels, duration)
+            timing.record("backend", duration, "%s.%s" % (module, action))
+            logger.debug("Query took %f: %s.%s - %s", duration, module, action, data)
 
         return response
+
+
+def _create_listener(name, handler, **kwargs):
+    if name == "ubus":
+        from foris_client.buses.ubus import UbusListener
+
+        return UbusListener(kwargs["path"], handler)
+
+    elif name == "unix-socket":
+        from foris_client.buses.unix_socket import UnixSocketListener
+
+        return UnixSocketListener(kwargs["notifications_path"], handler)
+
+    elif name == "mqtt":
+        from foris_client.buses.mqtt import MqttListener
+
+        return MqttListener(
+            kwargs["host"], kwargs["port"], handler, credentials=kwargs["credentials"]
+        )
+
+
+def _listen(messages, reconnect_delay, name, controller_id, **kwargs):
+    """ Forwards notifications of the backend to the messages queue
+
+    This runs in a thread of the foris process or in a separate process for the buses
+    which can't listen and send requests within a single process (see BackendListener).
+    """
+
+    def handler(msg, notification_controller_id):
+        if controller_id and notification_controller_id != controller_id:
+            return
+        messages.put(("notification", msg["module"]))
+
+    while True:
+        try:
+            listener = _create_listener(name, handler, **kwargs)
+            messages.put(("connected", None))
+            listener.listen()
+        except Exception as e:
+            logger.warning("Listening to backend notifications failed. (%s)", e)
+        messages.put(("disconnected", None))
+        time.sleep(reconnect_delay)
+
+
+class BackendListener(object):
+    """ Listens to the notifications of the backend and calls the handlers
+        with the name of the module which sent the notification
+
+        Handlers are called with None when the notifications could have been missed
+        (listener (re)connected), so all the data should be considered outdated.
+    """
+
+    RECONNECT_DELAY = 5  # in seconds
+    # ubus client library can't listen and send requests within a single process
+    PROCESS_BUSES = ["ubus"]
+
+    def __init__(self, backend, notifications_path=None):
+        self.listening = False
+        self.handlers = []
+
+        self._listen_kwargs = {"name": backend.name, "controller_id": backend.controller_id}
+        if backend.name in ["ubus", "unix-socket"]:
+            self._listen_kwargs["path"] = backend.path
+            self._listen_kwargs["notifications_path"] = notifications_path
+        elif backend.name == "mqtt":
+            self._listen_kwargs["host"] = backend.host
+            self._listen_kwargs["port"] = backend.port
+            self._listen_kwargs["credentials"] = backend.credentials
+
+        if backend.name in self.PROCESS_BUSES:
+            self._context = multiprocessing.get_context("spawn")
+            self._messages = self._context.Queue()
+        else:
+            self._context = None
+            self._messages = queue.Queue()
+        self._worker = None
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def start(self):
+        self._start_worker()
+        thread = threading.Thread(target=self._dispatch, name="foris-backend-listener")
+        thread.daemon = True
+        thread.start()
+
+    def _start_worker(self):
+        """ Starts to listen in a thread (or in a separate process, see PROCESS_BUSES)
+        """
+        worker_class = self._context.Process if self._context else threading.Thread
+        self._worker = worker_class(
+            target=_listen,
+            args=(self._messages, self.RECONNECT_DELAY),
+            kwargs=self._listen_kwargs,
+            name="foris-backend-notifications",
+        )
+        self._worker.daemon = True
+        self._worker.start()
+        if self._context:
+            logger.debug("Backend listener started (pid %d).", self._worker.pid)
+        else:
+            logger.debug("Backend listener started.")
+
+    def _dispatch(self):
+        while True:
+            try:
+                kind, module = self._messages.get(timeout=self.RECONNECT_DELAY)
+            except queue.Empty:
+                if not self._worker.is_alive():
+                    logger.warning("Backend listener died. Restarting.")
+                    self.listening = False
+                    self._start_worker()
+                continue
+
+            if kind == "disconnected":
+                self.listening = False
+                continue
+
+            if kind == "connected":
+                logger.debug("Backend listener connected.")
+                self.listening = True
+            else:
+                logger.debug("Backend notification received from '%s'.", module)
+
+            for handler in self.handlers:
+                try:
+                    handler(module)
+                except Exception:
+                    logger.exception("Failed to handle notification of '%s'.", module)
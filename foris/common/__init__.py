@@ -18,6 +18,7 @@
 import bottle
 import json
 import logging
+import mimetypes
 import os
 import re
 
@@ -26,9 +27,18 @@ from functools import wraps
 from foris import BASE_DIR
 from foris.utils import redirect_unauthenticated, is_safe_redirect, login_required, check_password
 from foris.middleware.bottle_csrf import update_csrf_token, CSRFValidationError, CSRFPlugin
-from foris.utils.routing import reverse
+from foris.utils.dynamic_assets import assets_dir
+from foris.utils.routing import (
+    get_plugin_static_dir,
+    get_root_script_name,
+    reverse,
+    static_encodings,
+    static_manifest_md5,
+)
+from foris.utils.static_manifest import ENCODINGS
 from foris.utils.translators import translations, set_current_language
 from foris.utils.bottle_stuff import clickjacking_protection, clear_lazy_cache, disable_caching
+from foris.utils.metrics import metrics, MetricsPlugin
 from foris.state import current_state
 
 
@@ -90,6 +100,81 @@ def change_lang(lang):
         raise bottle.HTTPError(404, "Language '%s' is not available." % lang)
 
 
+def _accepted_encodings():
+    res = set()
+    for item in bottle.request.get_header("Accept-Encoding", "").split(","):
+        encoding, _, params = item.partition(";")
+        match = re.match(r"\s*q\s*=\s*([0-9.]+)", params)
+        try:
+            if match and float(match.group(1)) == 0:
+                continue
+        except ValueError:
+            continue
+        res.add(encoding.strip().lower())
+    return res
+
+
+def _etag_matches(etag):
+    check = bottle.request.get_header("If-None-Match")
+    if not check:
+        return False
+    tags = [e.strip() for e in check.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+def static_response(filename, fs_root, url_path):
+    """ Serves a static file
+
+    Precompressed variant (e.g. screen.css.gz) is used when the client accepts it.
+    ETag is derived from the content digest (see foris.utils.static_manifest) so that
+    conditional requests are answered without touching the file. Paths outside of
+    fs_root are rejected before anything else is done with them.
+
+    :param filename: path relative to fs_root
+    :param fs_root: directory with the static files
+    :param url_path: path of the file within the url space (e.g. static/css/screen.css)
+    :return: http response
+    """
+    root = os.path.join(os.path.abspath(fs_root), "")
+    if not os.path.abspath(os.path.join(root, filename.strip("/\\"))).startswith(root):
+        return bottle.HTTPError(403, "Access denied.")
+
+    headers = {"Cache-Control": "public, max-age=31536000"}
+
+    encoding, suffix = None, ""
+    available = static_encodings.get(url_path, [])
+    if available:
+        headers["Vary"] = "Accept-Encoding"
+        accepted = _accepted_encodings()
+        if not bottle.request.get_header("Range"):
+            for encoding, suffix in ENCODINGS:
+                if encoding in available and encoding in accepted:
+                    headers["Content-Encoding"] = encoding
+                    break
+            else:
+                encoding, suffix = None, ""
+
+    # only digests from the manifests (request paths are never hashed)
+    digest = static_manifest_md5(url_path)
+    etag = None
+    if digest:
+        etag = '"%s%s"' % (digest, "-" + encoding if encoding else "")
+        if _etag_matches(etag):
+            headers["ETag"] = etag
+            return bottle.HTTPResponse(status=304, **headers)
+
+    # type of the original file (not of the compressed one)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    # file body is sent using wsgi.file_wrapper (if the server provides it)
+    response = bottle.static_file(filename + suffix, root=fs_root, mimetype=mimetype)
+    if response.status_code < 400:
+        if etag:
+            headers["ETag"] = etag
+        for name, value in headers.items():
+            response.set_header(name, value)
+    return response
+
+
 def static(filename):
     """ return static file
     :param filename: url path
@@ -97,11 +182,6 @@ def static(filename):
     :return: http response
     """
 
-    def prepare_response(filename, fs_root):
-        response = bottle.static_file(filename, root=fs_root)
-        response.add_header("Cache-Control", "public, max-age=31536000")
-        return response
-
     if not bottle.DEBUG:
         logger.warning("Static files should be handled externally in production mode.")
 
@@ -109,21 +189,23 @@ def static(filename):
     if match:
         plugin_name, plugin_file = match.groups()
 
-        # find correspoding plugin
-        for plugin in bottle.app().foris_plugin_loader.plugins:
-            if plugin.PLUGIN_NAME == plugin_name:
-                return prepare_response(plugin_file, os.path.join(plugin.DIRNAME, "static"))
+        static_dir = get_plugin_static_dir(plugin_name)
+        if static_dir:
+            return static_response(plugin_file, static_dir, "static/" + filename.lstrip("/"))
 
         return bottle.HTTPError(404, "File does not exist.")
 
     match = re.match(r"/*generated/+([a-z]{2})/+(.+)", filename)
     if match:
-        filename = "/".join(match.groups())
-        return prepare_response(
-            filename, os.path.join(current_state.assets_path, current_state.app)
+        return static_response(
+            "/".join(match.groups()),
+            assets_dir(get_root_script_name()),
+            "static/" + filename.lstrip("/"),
         )
 
-    return prepare_response(filename, os.path.join(BASE_DIR, "static"))
+    return static_response(
+        filename, os.path.join(BASE_DIR, "static"), "static/" + filename.lstrip("/")
+    )
 
 
 @login_required
@@ -187,6 +269,19 @@ def reset_guide():
     bottle.redirect(reverse("/"))
 
 
+@login_required
+def metrics_export():
+    res = bottle.response.copy(cls=bottle.HTTPResponse)
+    if bottle.request.GET.get("format") == "json":
+        res.content_type = "application/json"
+        res.body = json.dumps(metrics.to_json())
+    else:
+        res.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        res.body = metrics.to_prometheus()
+    res.status = 200
+    raise res
+
+
 def ping():
     res = bottle.response.copy(cls=bottle.HTTPResponse)
     res.content_type = "application/json"
@@ -226,9 +321,11 @@ def init_default_app(index, include_static=False):
     app.route("/leave_guide", method="POST", name="leave_guide", callback=leave_guide)
     app.route("/reset_guide", method="POST", name="reset_guide", callback=reset_guide)
     if include_static:
-        app.route("/static/<filename:re:.*>", name="static", callback=static)
+        app.route("/static/<filename:re:.*>", name="static", callback=static, backend_data=False)
     # route for testing whether the foris app is alive (used in js)
-    app.route("/ping", name="ping", method=("GET", "OPTIONS"), callback=ping)
+    app.route("/ping", name="ping", method=("GET", "OPTIONS"), callback=ping, backend_data=False)
+    # Prometheus text format (json when ?format=json)
+    app.route("/metrics", name="metrics", callback=metrics_export, backend_data=False)
     return app
 
 
@@ -243,6 +340,7 @@ def init_common_app(app, prefix):
     :param prefix: prefix which has been used to mount the application
     """
     app.catchall = False  # caught by ReportingMiddleware
+    app.install(MetricsPlugin())
     app.error_handler[403] = foris_403_handler
     app.add_hook("after_request", clickjacking_protection)
     app.add_hook("after_request", disable_caching)
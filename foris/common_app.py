@@ -24,14 +24,30 @@ from bottle_i18n import I18NMiddleware, I18NPlugin, i18n_defaults
 from foris import BASE_DIR
 from foris.common import init_common_app, init_default_app
 from foris.langs import DEFAULT_LANGUAGE
+from foris.middleware import bottle_csrf
 from foris.middleware.backend_data import BackendData
 from foris.middleware.sessions import SessionMiddleware
 from foris.middleware.reporting import ReportingMiddleware
+from foris.middleware.server_timing import ServerTimingMiddleware
 from foris.plugins import ForisPluginLoader
+from foris.profiling import profiler
+from foris.sessions import get_store
 from foris.state import current_state
 from foris.utils.bottle_stuff import prepare_template_defaults, route_list_cmdline, route_list_debug
 from foris.utils import messages
-from foris.utils import dynamic_assets
+from foris.utils import dynamic_assets, routing
+from foris.utils.metrics import instrument_templates
+
+
+def get_session_store(args):
+    """ Creates session store according to CLI arguments
+    """
+    name = getattr(args, "session_store", "ubus")
+    if name == "sqlite":
+        return get_store(name, path=args.session_db)
+    elif name == "cookie":
+        return get_store(name, secret=args.session_secret_file)
+    return get_store(name)
 
 
 def prepare_common_app(args, app_name, init_function, top_index, logger, load_plugins=True):
@@ -53,14 +69,27 @@ def prepare_common_app(args, app_name, init_function, top_index, logger, load_pl
     # internationalization
     i18n_defaults(bottle.SimpleTemplate, bottle.request)
     i18n_defaults(bottle.Jinja2Template, bottle.request)
-    bottle.Jinja2Template.settings["extensions"] = ["foris.utils.translators.i18n"]
+    bottle.Jinja2Template.settings["extensions"] = [
+        "foris.utils.translators.i18n",
+        "foris.utils.fragment_cache.FragmentCacheExtension",
+    ]
     bottle.Jinja2Template.settings["bytecode_cache"] = jinja2.FileSystemBytecodeCache(
         directory=current_state.assets_path
     )
 
+    # CSRF tokens
+    bottle_csrf.settings.configure(
+        getattr(args, "csrf_mode", "session"),
+        getattr(args, "session_secret_file", None),
+        getattr(args, "csrf_bucket", 0),
+    )
+
     # setup default template defaults
     prepare_template_defaults()
 
+    # measure template rendering (see /metrics)
+    instrument_templates()
+
     # init messaging template
     messages.set_template_defaults()
 
@@ -86,10 +115,18 @@ def prepare_common_app(args, app_name, init_function, top_index, logger, load_pl
             prefix = route.config["mountpoint.prefix"]
             init_common_app(mounted, prefix)
 
+    plugins = []
     if load_plugins:
         # load Foris plugins before applying Bottle plugins to app
-        loader = ForisPluginLoader(app)
-        loader.autoload_plugins()
+        with profiler.phase("plugins"):
+            loader = ForisPluginLoader(app)
+            loader.autoload_plugins()
+        plugins = loader.plugins
+
+    # all routes and plugin static files are registered now
+    with profiler.phase("routing"):
+        routing.build_route_index(bottle.app())
+        routing.load_static_manifests()
 
     # i18n middleware
     app = I18NMiddleware(
@@ -110,7 +147,10 @@ def prepare_common_app(args, app_name, init_function, top_index, logger, load_pl
     app.install_dump_route(bottle.app())
 
     # session handling
-    app = SessionMiddleware(app, args.session_timeout)
+    app = SessionMiddleware(app, args.session_timeout, store=get_session_store(args))
+
+    # report durations of the request parts (html debug panel is appended in debug mode)
+    app = ServerTimingMiddleware(app, debug_panel=args.debug)
 
     # print routes to console and exit
     if args.routes:
@@ -123,7 +163,10 @@ def prepare_common_app(args, app_name, init_function, top_index, logger, load_pl
         routes = route_list_debug(bottle.app())
         logger.debug("Routes:\n%s", "\n".join(routes))
 
-    # Make dynamic assets cleanup
-    dynamic_assets.reset(app_name, args.assets)
+    # Prepare the directory of dynamic assets (assets of other versions are removed)
+    # cgi process handles only a single request so the other languages are not rendered
+    with profiler.phase("dynamic assets"):
+        warmup = getattr(args, "server", None) != "cgi"
+        dynamic_assets.reset(app_name, args.assets, plugins, warmup=warmup)
 
     return app
@@ -17,6 +17,7 @@
 import csv
 import logging
 import pathlib
+import threading
 
 from bottle import Bottle, request, template, response
 import bottle
@@ -24,6 +25,7 @@ import bottle
 from foris.common import login
 from foris.utils.translators import _
 from foris.utils import login_required, messages, is_safe_redirect
+from foris.utils.bottle_stuff import set_template_default
 from foris.middleware.bottle_csrf import CSRFPlugin
 from foris.utils.routing import reverse
 from foris.state import current_state
@@ -77,15 +79,96 @@ config_pages = {
 }
 
 
+class ConfigPageRegistry(object):
+    """ Snapshot of the registered config pages with presorted menu and slug index
+
+    It is built on demand (see get_config_page_registry()) and replaced by a new one
+    with a higher version when the registered pages change.
+    """
+
+    __slots__ = ("version", "pages", "slug_map")
+
+    def __init__(self, version, pages):
+        self.version = version
+
+        sort_key = lambda e: (e.menu_order, e.slug)  # noqa: E731
+        self.pages = tuple(sorted(pages.values(), key=sort_key))
+        self.slug_map = dict(pages)
+        for page in self.pages:
+            page.subpages.sort(key=sort_key)
+            for subpage in page.subpages:
+                self.slug_map.setdefault(subpage.slug, subpage)
+
+
+_registry = None
+_registry_version = 0
+_registry_lock = threading.Lock()
+# slug -> subpage of the registered pages (updated by add_config_page() and add_config_subpage())
+_subpage_index = None
+
+
+def get_config_page_registry():
+    """ Returns current config page registry
+
+    :rtype: ConfigPageRegistry
+    """
+    global _registry
+    registry = _registry
+    if registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ConfigPageRegistry(_registry_version, config_pages)
+                logger.debug("Config page registry built (version %d)", _registry_version)
+            registry = _registry
+    return registry
+
+
+def _drop_registry():
+    global _registry, _registry_version
+    _registry = None
+    _registry_version += 1
+
+
+def _get_subpage_index():
+    global _subpage_index
+    if _subpage_index is None:
+        _subpage_index = {}
+        for page in config_pages.values():
+            for subpage in page.subpages:
+                _subpage_index.setdefault(subpage.slug, subpage)
+    return _subpage_index
+
+
+def invalidate_config_pages():
+    """ Should be called when the registered pages are changed
+        (e.g. subpages were added to an existing page)
+    """
+    global _subpage_index
+    with _registry_lock:
+        _subpage_index = None
+        _drop_registry()
+
+
 def get_config_pages():
     """ Returns sorted config pages
     """
-    res = sorted(config_pages.values(), key=lambda e: (e.menu_order, e.slug))
+    return get_config_page_registry().pages
+
+
+def get_config_pages_version():
+    """ Returns a number which changes whenever the registered config pages change
+    """
+    return get_config_page_registry().version
+
 
-    # sort subpages
-    for page in res:
-        page.subpages.sort(key=lambda e: (e.menu_order, e.slug))
-    return res
+def get_config_pages_menu_state():
+    """ Returns a value which changes whenever the menu items could change
+
+    Pages (e.g. from plugins) show, hide, disable or tag their menu items according to
+    the current state which is obtained via web.get_data, so the version of these data is
+    a part of the menu cache key (the pages are not asked on each render).
+    """
+    return current_state.web_data_version
 
 
 def add_config_page(page_class):
@@ -95,18 +178,49 @@ def add_config_page(page_class):
     """
     if page_class.slug is None:
         raise Exception("Page %s doesn't define a propper slug" % page_class)
-    page_map = {k: v for k, v in config_pages.items()}
-
-    for page in config_pages.values():
-        for subpage in page.subpages:
-            page_map[subpage.slug] = subpage
 
-    if page_class.slug in page_map:
-        raise Exception(
-            "Error when adding page %s slug '%s' is already used in %s"
-            % (page_class, page_class.slug, page_map[page_class.slug])
-        )
-    config_pages[page_class.slug] = page_class
+    # the registry is not built here so that plugin registration stays cheap
+    with _registry_lock:
+        subpage_index = _get_subpage_index()
+        used_in = config_pages.get(page_class.slug) or subpage_index.get(page_class.slug)
+        if used_in:
+            raise Exception(
+                "Error when adding page %s slug '%s' is already used in %s"
+                % (page_class, page_class.slug, used_in)
+            )
+        config_pages[page_class.slug] = page_class
+        for subpage in page_class.subpages:
+            subpage_index.setdefault(subpage.slug, subpage)
+        _drop_registry()
+
+
+def add_config_subpage(page_slug, subpage_class):
+    """Register a subpage of an already registered config page.
+
+    :param page_slug: slug of the parent page
+    :param subpage_class: handler class
+    """
+    if subpage_class.slug is None:
+        raise Exception("Page %s doesn't define a propper slug" % subpage_class)
+
+    with _registry_lock:
+        page_class = config_pages.get(page_slug)
+        if page_class is None:
+            raise Exception(
+                "Error when adding subpage %s page '%s' is not registered"
+                % (subpage_class, page_slug)
+            )
+        subpage_index = _get_subpage_index()
+        used_in = config_pages.get(subpage_class.slug) or subpage_index.get(subpage_class.slug)
+        if used_in:
+            raise Exception(
+                "Error when adding subpage %s slug '%s' is already used in %s"
+                % (subpage_class, subpage_class.slug, used_in)
+            )
+        # don't modify the list which could be shared with other pages
+        page_class.subpages = list(page_class.subpages) + [subpage_class]
+        subpage_index[subpage_class.slug] = subpage_class
+        _drop_registry()
 
 
 def add_external_page(name: str, title: str, url: str, order: int = 50):
@@ -143,15 +257,9 @@ populate_external_pages()
 
 
 def get_config_page(page_name):
-    ConfigPage = config_pages.get(page_name, None)
+    ConfigPage = get_config_page_registry().slug_map.get(page_name, None)
     if ConfigPage:
         return ConfigPage
-
-    # Try to iterate through subpages
-    for page in config_pages.values():
-        for subpage in page.subpages:
-            if subpage.slug == page_name:
-                return subpage
     raise bottle.HTTPError(404, "Unknown configuration page.")
 
 
@@ -176,8 +284,7 @@ def config_page_get(page_name):
     if current_state.guide.enabled and page_name not in current_state.guide.available_tabs:
         bottle.redirect(reverse("config_page", page_name=current_state.guide.current))
 
-    bottle.SimpleTemplate.defaults["active_config_page_key"] = page_name
-    bottle.Jinja2Template.defaults["active_config_page_key"] = page_name
+    set_template_default("active_config_page_key", page_name)
     ConfigPage = get_config_page(page_name)
 
     # test if page is enabled otherwise redirect to default
@@ -190,8 +297,7 @@ def config_page_get(page_name):
 
 @login_required
 def config_page_post(page_name):
-    bottle.SimpleTemplate.defaults["active_config_page_key"] = page_name
-    bottle.Jinja2Template.defaults["active_config_page_key"] = page_name
+    set_template_default("active_config_page_key", page_name)
     ConfigPage = get_config_page(page_name)
     config_page = ConfigPage(request.POST.decode())
     if request.is_xhr:
@@ -214,8 +320,7 @@ def config_page_post(page_name):
 
 @login_required
 def config_action(page_name, action):
-    bottle.SimpleTemplate.defaults["active_config_page"] = page_name
-    bottle.Jinja2Template.defaults["active_config_page"] = page_name
+    set_template_default("active_config_page", page_name)
     ConfigPage = get_config_page(page_name)
     config_page = ConfigPage()
     try:
@@ -227,8 +332,7 @@ def config_action(page_name, action):
 
 @login_required
 def config_action_post(page_name, action):
-    bottle.SimpleTemplate.defaults["active_config_page_key"] = page_name
-    bottle.Jinja2Template.defaults["active_config_page_key"] = page_name
+    set_template_default("active_config_page_key", page_name)
     ConfigPage = get_config_page(page_name)
     config_page = ConfigPage(request.POST.decode())
     if request.is_xhr:
@@ -256,8 +360,7 @@ def config_action_post(page_name, action):
 
 @login_required
 def config_ajax(page_name):
-    bottle.SimpleTemplate.defaults["active_config_page_key"] = page_name
-    bottle.Jinja2Template.defaults["active_config_page_key"] = page_name
+    set_template_default("active_config_page_key", page_name)
     action = request.params.get("action")
     if not action:
         raise bottle.HTTPError(404, "AJAX action not specified.")
@@ -272,8 +375,7 @@ def config_ajax(page_name):
 
 @login_required
 def config_ajax_form(page_name, form_name):
-    bottle.SimpleTemplate.defaults["active_config_page_key"] = page_name
-    bottle.Jinja2Template.defaults["active_config_page_key"] = page_name
+    set_template_default("active_config_page_key", page_name)
     ConfigPage = get_config_page(page_name)
     config_page = ConfigPage()
     if not request.is_xhr:
@@ -342,6 +444,8 @@ def init_app():
     app.route("/<page_name:re:.+>/", name="config_page", callback=config_page_get)
     bottle.SimpleTemplate.defaults["get_config_pages"] = get_config_pages
     bottle.Jinja2Template.defaults["get_config_pages"] = get_config_pages
+    bottle.Jinja2Template.defaults["get_config_pages_version"] = get_config_pages_version
+    bottle.Jinja2Template.defaults["get_config_pages_menu_state"] = get_config_pages_menu_state
     return app
 
 
@@ -14,7 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import typing
 
+from foris.state import current_state
+from foris.utils import timing
 from foris.utils.addresses import mask_to_prefix_4
 
 
@@ -28,14 +31,45 @@ DEFAULT_GUEST_PREFIX = mask_to_prefix_4(DEFAULT_GUEST_MASK)
 
 
 class BaseConfigHandler(object):
+    # data which are obtained from the backend when the handler is created
+    # {attribute_name: (module, action) or (module, action, data)}
+    backend_requests: typing.Dict[str, tuple] = {}
+
     def __init__(self, data=None):
         self.data = data
         self.__form_cache = None
+        self._perform_backend_requests()
+
+    def get_backend_requests(self):
+        """ Returns backend requests which should be performed when the handler is created
+
+        Override this when the requests depend on the current state (e.g. language).
+
+        :rtype: dict
+        """
+        return self.backend_requests
+
+    def _perform_backend_requests(self):
+        """ Performs all backend requests of the handler at once and stores their results
+            into the corresponding attributes
+
+            The requests are independent so they are performed concurrently
+            (see Backend.perform_many())
+        """
+        requests = self.get_backend_requests()
+        if not requests:
+            return
+
+        names = list(requests)
+        results = current_state.backend.perform_many([requests[e] for e in names])
+        for name, result in zip(names, results):
+            setattr(self, name, result)
 
     @property
     def form(self):
         if self.__form_cache is None:
-            self.__form_cache = self.get_form()
+            with timing.measure("form-definition", type(self).__name__):
+                self.__form_cache = self.get_form()
         return self.__form_cache
 
     def get_form(self):
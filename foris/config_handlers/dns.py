@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+
 from .base import BaseConfigHandler
 
 from foris import fapi
@@ -32,9 +34,10 @@ class DNSHandler(BaseConfigHandler):
     """
 
     userfriendly_title = gettext("DNS")
+    backend_requests = {"backend_data": ("dns", "get_settings")}
 
     def get_form(self):
-        data = current_state.backend.perform("dns", "get_settings")
+        data = copy.deepcopy(self.backend_data)
         available_forwarders = [[e["name"], e["description"]] for e in data["available_forwarders"]]
         data["dnssec_disabled"] = not data["dnssec_enabled"]
         if self.data:
@@ -28,10 +28,7 @@ from .base import BaseConfigHandler, DEFAULT_GUEST_MASK, DEFAULT_GUEST_IP
 
 class GuestHandler(BaseConfigHandler):
     userfriendly_title = gettext("Guest network")
-
-    def __init__(self, *args, **kwargs):
-        super(GuestHandler, self).__init__(*args, **kwargs)
-        self.backend_data = current_state.backend.perform("guest", "get_settings")
+    backend_requests = {"backend_data": ("guest", "get_settings")}
 
     def get_form(self):
         data = {}
@@ -27,10 +27,7 @@ from .base import BaseConfigHandler
 
 class LanHandler(BaseConfigHandler):
     userfriendly_title = gettext("LAN")
-
-    def __init__(self, *args, **kwargs):
-        super(LanHandler, self).__init__(*args, **kwargs)
-        self.backend_data = current_state.backend.perform("lan", "get_settings")
+    backend_requests = {"backend_data": ("lan", "get_settings")}
 
     def get_form(self):
         data = {}
@@ -179,10 +179,7 @@ class UnifiedTimeHandler(BaseConfigHandler):
     """
 
     userfriendly_title = gettext("Region and time")
-
-    def __init__(self, *args, **kwargs):
-        self.backend_data = current_state.backend.perform("time", "get_settings")
-        super().__init__(*args, **kwargs)
+    backend_requests = {"backend_data": ("time", "get_settings")}
 
     def get_form(self):
         data = copy.deepcopy(self.backend_data)
@@ -32,15 +32,7 @@ class NetworksHandler(BaseConfigHandler):
     """
 
     userfriendly_title = gettext("Network interfaces")
-
-    def load_backend_data(self):
-        data = current_state.backend.perform("networks", "get_settings")
-
-        self.backend_data = data
-
-    def __init__(self, *args, **kwargs):
-        self.load_backend_data()
-        super(NetworksHandler, self).__init__(*args, **kwargs)
+    backend_requests = {"backend_data": ("networks", "get_settings")}
 
     def get_form(self):
         data = copy.deepcopy(self.backend_data)
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+
 from foris import fapi, validators
 from foris.form import Password, Textbox, Dropdown, Checkbox, Radio, Number, Email, Time
 from foris.state import current_state
@@ -24,9 +26,10 @@ from .base import BaseConfigHandler
 
 class NotificationsHandler(BaseConfigHandler):
     userfriendly_title = gettext("Notifications")
+    backend_requests = {"backend_data": ("router_notifications", "get_settings")}
 
     def get_form(self):
-        data = current_state.backend.perform("router_notifications", "get_settings")
+        data = copy.deepcopy(self.backend_data)
         data["enable_smtp"] = data["emails"]["enabled"]
         data["use_turris_smtp"] = "1" if data["emails"]["smtp_type"] == "turris" else "0"
         data["to"] = " ".join(data["emails"]["common"]["to"])
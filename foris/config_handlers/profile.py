@@ -30,13 +30,7 @@ class ProfileHandler(BaseConfigHandler):
     """
 
     userfriendly_title = gettext("Guide workflow")
-
-    def __init__(self, *args, **kwargs):
-        self.load_backend_data()
-        super(ProfileHandler, self).__init__(*args, **kwargs)
-
-    def load_backend_data(self):
-        self.backend_data = current_state.backend.perform("web", "get_guide")
+    backend_requests = {"backend_data": ("web", "get_guide")}
 
     def get_form(self):
 
@@ -43,10 +43,7 @@ class RemoteHandler(BaseConfigHandler):
     }
 
     userfriendly_title = gettext("Remote Access")
-
-    def __init__(self, *args, **kwargs):
-        self.backend_data = current_state.backend.perform("remote", "get_settings")
-        super().__init__(*args, **kwargs)
+    backend_requests = {"backend_data": ("remote", "get_settings")}
 
     def get_form(self):
         data = {
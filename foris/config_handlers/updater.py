@@ -18,12 +18,13 @@
 
 import copy
 import logging
-import pkg_resources
+import threading
 import typing
 
 from foris import fapi, validators
 from foris.form import Checkbox, Radio, RadioSingle, Number, Hidden, Textbox
 from foris.state import current_state
+from foris.utils import packages
 from foris.utils.translators import gettext_dummy as gettext, _
 
 from .base import BaseConfigHandler
@@ -32,6 +33,49 @@ from .base import BaseConfigHandler
 logger = logging.getLogger(__name__)
 
 
+_always_on_reasons: typing.Optional[typing.List[typing.Any]] = None
+_always_on_lock = threading.Lock()
+
+
+def get_always_on_reasons() -> typing.List[typing.Any]:
+    """ Returns the reasons why the updater is supposed to be always on
+
+    The 'updater_always_on' entry points are called only once
+    (see reload_always_on_reasons()).
+    """
+    global _always_on_reasons
+
+    with _always_on_lock:
+        if _always_on_reasons is None:
+            reasons = []
+            for entry_point in packages.iter_entry_points("updater_always_on"):
+                logger.info("Processing 'updater_always_on' for '%s' plugin", entry_point.name)
+                reason: typing.Optional[str] = entry_point.load()()
+                if reason:
+                    reasons.append(reason)
+            _always_on_reasons = reasons
+        return _always_on_reasons
+
+
+def reload_always_on_reasons():
+    """ Rescans installed distributions and calls the 'updater_always_on' entry points again
+    """
+    global _always_on_reasons
+
+    with _always_on_lock:
+        packages.reload_index()
+        _always_on_reasons = None
+
+
+def handle_notification(module):
+    """ Handles notification from the backend (see BackendListener)
+
+    Packages are installed or removed by the updater while foris is running.
+    """
+    if module is None or module == "updater":
+        reload_always_on_reasons()
+
+
 class UpdaterHandler(BaseConfigHandler):
     userfriendly_title = gettext("Updater")
 
@@ -45,16 +89,9 @@ class UpdaterHandler(BaseConfigHandler):
         super(UpdaterHandler, self).__init__(*args, **kwargs)
 
         # Check whether updater is supposed to be always on and store the reason why
-        self.always_on_reasons: typing.List[str] = []
-        for entry_point in pkg_resources.iter_entry_points("updater_always_on"):
-            logger.info("Processing 'updater_always_on' for '%s' plugin", entry_point.name)
-            reason: typing.Option[str] = entry_point.load()()
-            if reason:
-                self.always_on_reasons.append(reason)
-
-        self.backend_data = current_state.backend.perform(
-            "updater", "get_settings", {"lang": current_state.language}
-        )
+        # (delayed strings are translated to the current language)
+        self.always_on_reasons: typing.List[str] = [str(e) for e in get_always_on_reasons()]
+
         # store setting required for rendering
         self.current_approval = self.backend_data["approval"]
         # update can be in 3 states: True, False, None
@@ -65,6 +102,9 @@ class UpdaterHandler(BaseConfigHandler):
             "delay", self.APPROVAL_DEFAULT_DELAY
         )
 
+    def get_backend_requests(self):
+        return {"backend_data": ("updater", "get_settings", {"lang": current_state.language})}
+
     def get_form(self):
         data = copy.deepcopy(self.backend_data)
 
@@ -24,12 +24,14 @@ from foris.utils.translators import gettext_dummy as gettext, _
 
 class WanHandler(BaseConfigHandler):
     userfriendly_title = gettext("WAN")
+    backend_requests = {
+        "status_data": ("wan", "get_wan_status"),
+        "backend_data": ("wan", "get_settings"),
+    }
 
     def __init__(self, *args, **kwargs):
         # Do not display "none" options for WAN protocol if hide_no_wan is True
         self.hide_no_wan = kwargs.pop("hide_no_wan", False)
-        self.status_data = current_state.backend.perform("wan", "get_wan_status")
-        self.backend_data = current_state.backend.perform("wan", "get_settings")
         super(WanHandler, self).__init__(*args, **kwargs)
 
     @staticmethod
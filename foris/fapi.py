@@ -23,6 +23,7 @@ from bottle import MultiDict
 
 from foris.form import Input, InputWithArgs, Dropdown, Form, Checkbox, websafe, Hidden, Radio
 from foris import validators as validators_module
+from foris.utils import timing
 
 
 logger = logging.getLogger(__name__)
@@ -172,8 +173,9 @@ class ForisForm(ForisFormElement):
         inputs = [x.field for x in self.get_active_fields()]
         # TODO: creating the form everytime might by a wrong approach...
         logger.debug("Creating Form()...")
-        form = Form(*inputs, validators=self.validators)
-        form.fill(self.data)
+        with timing.measure("form", self.name):
+            form = Form(*inputs, validators=self.validators)
+            form.fill(self.data)
         self.__form_cache = form
         return form
 
@@ -236,7 +238,9 @@ class ForisForm(ForisFormElement):
 
     def validate(self):
         self.validated = True
-        return self._form.validates(self.data)
+        form = self._form
+        with timing.measure("form-validation", self.name):
+            return form.validates(self.data)
 
     def add_callback(self, cb):
         """Add callback function.
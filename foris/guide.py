@@ -16,7 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from foris.utils.translators import gettext_dummy as _
+from foris.state import current_state
+from foris.utils.translators import gettext_dummy as _, translations
 
 
 WORKFLOW_OLD = "old"
@@ -114,6 +115,19 @@ class MessagesDefault:
         state = "CURRENT" if current else "PASSED"
         return getattr(cls, "%s_%s" % (step.upper(), state))
 
+    @classmethod
+    def render_all(cls, language):
+        """ Translates all the messages of the workflow
+
+        :returns: {attribute name: [translated message]}
+        :rtype: dict
+        """
+        return {
+            name: [e.render(language) for e in getattr(cls, name)]
+            for name in dir(cls)
+            if name.endswith(("_PASSED", "_CURRENT"))
+        }
+
 
 class MessageBridge(MessagesDefault):
     NETWORKS_PASSED = [
@@ -187,13 +201,40 @@ class MessageRouter(MessagesDefault):
     FINISHED_CURRENT = FINISHED_PASSED
 
 
+WORKFLOW_MAP = {
+    WORKFLOW_BRIDGE: MessageBridge,
+    WORKFLOW_MIN: MessageMin,
+    WORKFLOW_ROUTER: MessageRouter,
+}
+
+# (workflow, language) -> (catalog generation, messages translated via render_all())
+_rendered_messages = {}
+_rendered_generation = None
+
+
 def get_guide_messages(step, current, workflow):
-    WORKFLOW_MAP = {
-        WORKFLOW_BRIDGE: MessageBridge,
-        WORKFLOW_MIN: MessageMin,
-        WORKFLOW_ROUTER: MessageRouter,
-    }
-    return WORKFLOW_MAP.get(workflow, MessagesDefault).get(step, current)
+    global _rendered_generation
+
+    messages_class = WORKFLOW_MAP.get(workflow, MessagesDefault)
+    generation = translations.generation
+    if _rendered_generation != generation:
+        # messages rendered using the previous catalogs are not needed anymore
+        _rendered_messages.clear()
+        _rendered_generation = generation
+
+    key = (workflow, current_state.language)
+    cached = _rendered_messages.get(key)
+    if cached is not None and cached[0] == generation:
+        rendered = cached[1]
+    else:
+        rendered = messages_class.render_all(current_state.language)
+        _rendered_messages[key] = (generation, rendered)
+
+    state = "CURRENT" if current else "PASSED"
+    try:
+        return rendered["%s_%s" % (step.upper(), state)]
+    except KeyError:
+        return messages_class.get(step, current)
 
 
 class Guide(object):
@@ -204,6 +245,9 @@ class Guide(object):
         self.steps = backend_data["workflow_steps"]
         self.current = backend_data.get("next_step", None)
 
+    def cache_key(self):
+        return (self.enabled, self.workflow, tuple(self.passed), tuple(self.steps), self.current)
+
     @property
     def available_tabs(self):
         return self.passed + ([self.current] if self.current else [])
@@ -16,7 +16,11 @@
 
 import bottle
 
+from foris.backend import BackendUnavailable
+from foris.guide import Guide
+from foris.middleware.reporting import unavailable_response
 from foris.state import current_state
+from foris.utils import timing
 from foris.utils.caches import per_request
 
 
@@ -27,6 +31,9 @@ class BackendData(object):
         There can be a few running instances of foris apps (e.g config, ...).
         When one changes the other should reflect the change immediatelly.
         Therefor it is necessary to update it so frequent.
+
+        Routes which don't need these data (e.g. static files) should be
+        created with `backend_data=False` route config option.
     """
 
     def set_language(self, language):
@@ -44,21 +51,77 @@ class BackendData(object):
 
     def __init__(self, app):
         self.app = app
+        # (data, guide) - guide is built only when the data are reloaded
+        self.loaded = None
+
+    @staticmethod
+    def _get_route(environ):
+        """ Finds the route which is going to handle the request (including mounted apps)
+
+        :returns: route or None if not found
+        :rtype: bottle.Route
+        """
+        app = bottle.app()
+        path = environ.get("PATH_INFO") or "/"
+        try:
+            while True:
+                route, _ = app.router.match(dict(environ, PATH_INFO=path))
+                if "mountpoint.target" not in route.config:
+                    return route
+                prefix = route.config["mountpoint.prefix"].rstrip("/")
+                path = path[len(prefix) :] or "/"
+                app = route.config["mountpoint.target"]
+        except bottle.HTTPError:
+            return None
+
+    @staticmethod
+    def backend_data_required(route):
+        return route is None or route.config.get("backend_data", True)
 
     def __call__(self, environ, start_response):
 
         # clear per request data cache
         per_request.backend_data.clear()
 
-        try:
-            data = current_state.backend.perform("web", "get_data")
-            per_request.backend_data["web", "get_data", None] = data
-        except Exception:
-            # Exceptions raised here are not correctly processed in flup
-            # so we don't propagate the excetion (it will fail later)
-            # use best effort here and if e.g. backend is not running it will fail later
+        if not self.backend_data_required(self._get_route(environ)):
             return self.app(environ, start_response)
 
+        if not current_state.web_data_outdated():
+            # nothing has changed since the last request (see ForisState.handle_notification)
+            data, guide = self.loaded
+        else:
+            generation = current_state.web_data_generation
+            try:
+                with timing.measure("backend-data"):
+                    data = current_state.backend.perform("web", "get_data")
+            except BackendUnavailable:
+                # the request would fail anyway so don't make it wait for the timeouts
+                return unavailable_response(start_response)
+            except Exception:
+                # Exceptions raised here are not correctly processed in flup
+                # so we don't propagate the excetion (it will fail later)
+                # use best effort here and if e.g. backend is not running it will fail later
+                return self.app(environ, start_response)
+            changed = self.loaded is None or self.loaded[0] != data
+            guide = Guide(data["guide"])
+            self.loaded = data, guide
+            current_state.set_web_data_loaded(generation, changed)
+
+        per_request.backend_data["web", "get_data", None] = data
+
+        # state is request local so it needs to be updated within each request
+        self.update_state(data, guide)
+
+        return self.app(environ, start_response)
+
+    def update_state(self, data, guide):
+        """ Updates current_state using data obtained via web.get_data
+
+        :param data: response of web.get_data
+        :type data: dict
+        :param guide: guide built from data["guide"]
+        :type guide: foris.guide.Guide
+        """
         # update language
         self.set_language(data["language"])
 
@@ -80,7 +143,5 @@ class BackendData(object):
         # update device
         current_state.set_device(data["device"])
 
-        # initialize guide
-        current_state.update_guide(data["guide"])
-
-        return self.app(environ, start_response)
+        # guide object is shared by the requests until the data are reloaded
+        current_state.set_guide(guide)
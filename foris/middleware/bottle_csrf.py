@@ -15,15 +15,85 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import bottle
+import hashlib
+import hmac
+import secrets
 import string
+import time
 
 from random import SystemRandom
 
 random = SystemRandom()
 
 
+class CSRFSettings(object):
+    """ CSRF token settings
+
+    There are two modes:
+        session - random token is stored in the session
+        hmac - token is an HMAC of the session id (no session access is needed)
+    """
+
+    MODES = ["session", "hmac"]
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, mode="session", secret=None, bucket_size=0):
+        """
+        :param mode: session or hmac
+        :param secret: secret used to sign the tokens (hmac mode only)
+        :type secret: bytes
+        :param bucket_size: token is valid only within a time bucket and the following one
+                            (in seconds, 0 means that the token doesn't expire)
+        :type bucket_size: int
+        """
+        if mode not in CSRFSettings.MODES:
+            raise ValueError("Unknown CSRF mode '%s'" % mode)
+        self.mode = mode
+        self.secret = secret or secrets.token_bytes(32)
+        self.bucket_size = bucket_size
+
+
+settings = CSRFSettings()
+
+
+def _current_bucket():
+    return int(time.time() // settings.bucket_size) if settings.bucket_size else 0
+
+
+def _hmac_token(session_id, bucket):
+    digest = hmac.new(
+        settings.secret, ("%s:%d" % (session_id, bucket)).encode(), hashlib.sha256
+    ).hexdigest()
+    return "%d-%s" % (bucket, digest)
+
+
+def _validate_hmac_token(token, session_id):
+    bucket, _, _ = token.partition("-")
+    try:
+        bucket = int(bucket)
+    except ValueError:
+        return False
+    current = _current_bucket()
+    if bucket not in (current, current - 1):
+        return False
+    return hmac.compare_digest(_hmac_token(session_id, bucket).encode(), token.encode())
+
+
+def validate_csrf_token(token):
+    if settings.mode == "hmac":
+        session = bottle.request.environ["foris.session"]
+        return _validate_hmac_token(token, session.cookie_session_id)
+    return hmac.compare_digest(token.encode(), get_csrf_token().encode())
+
+
 def get_csrf_token():
     session = bottle.request.environ["foris.session"]
+    if settings.mode == "hmac":
+        # derived from the session id - the session doesn't need to be loaded
+        return _hmac_token(session.cookie_session_id, _current_bucket())
+
     csrf_token = session.get("csrf_token")
     if not csrf_token:
         # create new token if it's not present in this session
@@ -36,6 +106,9 @@ def update_csrf_token(save_session=True):
 
     This should be called on every login.
     """
+    if settings.mode == "hmac":
+        # new session id (session is recreated on login) means a new token
+        return
 
     def generate_token():
         return "".join(random.choice(string.ascii_letters + string.digits) for i in range(32))
@@ -72,9 +145,8 @@ class CSRFPlugin(object):
         # make CSRF protection implicitly enabled (since it's more fool-proof)
         disable_csrf_protect = route.config.get("disable_csrf_protect", False)
 
-        if not get_csrf_token():
-            update_csrf_token()
-
+        # token is not created here - the session would have to be loaded
+        # (it is created on demand by get_csrf_token())
         if disable_csrf_protect or bottle.request.method in ("GET", "HEAD", "OPTIONS", "TRACE"):
             return callback
 
@@ -86,7 +158,7 @@ class CSRFPlugin(object):
                 )
             # do not refer session from outer scope! we need to get new value
             # in each call of the function
-            if not token or token != get_csrf_token():
+            if not token or not validate_csrf_token(token):
                 raise CSRFValidationError()
 
             return callback(*args, **kwargs)
@@ -23,7 +23,7 @@ from traceback import format_exc
 from bottle import _e, tob, html_escape, static_file
 
 from foris.utils.routing import get_root
-from foris.backend import ExceptionInBackend
+from foris.backend import BackendUnavailable, ExceptionInBackend
 from foris.state import current_state
 
 
@@ -67,6 +67,46 @@ ERROR_TEMPLATE = u"""<!DOCTYPE html>
 """
 
 
+UNAVAILABLE_TEMPLATE = u"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta http-equiv="refresh" content="%(retry_after)d">
+    <title>Service unavailable | Administration interface of router Turris</title>
+    <style>
+    body, html {background-color: #eee; font-family: Helvetica, Arial, sans-serif;}
+    #page {background-color: #fff; border: 1px solid #ccc; margin: 0 auto; padding: 1em; min-width: 60em; width: 90%%;}
+    hr {border: 0; color: #999; background-color: #999; height: 1px;}
+    p {line-height: 160%%;}
+    </style>
+</head>
+<body>
+    <div id="page">
+        <h1>The configuration backend is not available</h1>
+
+        <p>The service which manages the configuration of your router is not responding right now (it is probably being restarted). This page will be reloaded automatically.</p>
+        <hr>
+
+        <h1>Konfigurační backend není dostupný</h1>
+
+        <p>Služba, která spravuje konfiguraci Vašeho routeru, momentálně neodpovídá (pravděpodobně se restartuje). Tato stránka bude automaticky znovu načtena.</p>
+    </div>
+</body>
+</html>
+"""
+
+
+def unavailable_response(start_response, retry_after=5):
+    """ Responds with 503 page (used when the backend is unreachable)
+
+    :param retry_after: time after which the request should be repeated (in seconds)
+    :type retry_after: int
+    """
+    headers = [("Content-Type", "text/html; charset=UTF-8"), ("Retry-After", str(retry_after))]
+    start_response("503 SERVICE UNAVAILABLE", headers)
+    return [tob(UNAVAILABLE_TEMPLATE % {"retry_after": retry_after})]
+
+
 def filter_sensitive_params(params_dict, sensitive_params):
     for k, v in params_dict.items():
         for pattern in sensitive_params:
@@ -91,6 +131,8 @@ class ReportingMiddleware(object):
     def __call__(self, environ, start_response):
         try:
             return self.app(environ, start_response)
+        except BackendUnavailable:
+            return unavailable_response(start_response)
         except (Exception, ExceptionInBackend) as e:
             template_vars = {}
             if "bottle.request.post" in environ:
@@ -128,4 +170,4 @@ class ReportingMiddleware(object):
         def foris_error():
             return static_file(self.dump_file, "/tmp", mimetype="text/plain", download=True)
 
-        app.route("/%s" % self.dump_file, callback=foris_error)
+        app.route("/%s" % self.dump_file, callback=foris_error, backend_data=False)
@@ -0,0 +1,115 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bottle
+
+from bottle import html_escape, tob
+
+from foris.utils import timing
+
+
+DEBUG_PANEL_TEMPLATE = u"""
+<div id="foris-server-timing" style="position: fixed; bottom: 0; right: 0; z-index: 1000; \
+background-color: #fef9df; border: 1px solid #999; padding: 0.5em; font-size: 11px;">
+<table>%s</table>
+</div>
+"""
+
+
+class ServerTimingMiddleware(object):
+    def __init__(self, app, debug_panel=False):
+        """
+        Initialize middleware which reports where the time of the request was spent
+        using Server-Timing header.
+
+        The header reveals backend actions and templates, so it is sent only in debug mode
+        or to logged in users.
+
+        :param app: instance of bottle application to apply this middleware to
+        :param debug_panel: append the timings also as a html panel to html pages
+        """
+        self.app = app
+        self.debug_panel = debug_panel
+
+    def __call__(self, environ, start_response):
+        timings = timing.start_request()
+
+        if self.debug_panel:
+            return self._call_with_panel(environ, start_response, timings)
+
+        def timing_start_response(status, headers, exc_info=None):
+            if self._header_allowed(environ):
+                headers.append(("Server-Timing", timings.header()))
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, timing_start_response)
+        finally:
+            timing.finish_request()
+
+    @staticmethod
+    def _header_allowed(environ):
+        if bottle.DEBUG:
+            return True
+
+        session = environ.get("foris.session")
+        # don't load the session only because of the header (e.g. static files)
+        if session is None or not session.loaded or session.is_anonymous:
+            return False
+        return bool(session.get("user_authenticated"))
+
+    def _call_with_panel(self, environ, start_response, timings):
+        response = {}
+        chunks = []  # including the data passed to the legacy write() callable
+
+        def buffering_start_response(status, headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = headers
+            response["exc_info"] = exc_info
+            return chunks.append
+
+        try:
+            result = self.app(environ, buffering_start_response)
+            try:
+                for data in result:
+                    chunks.append(data)
+            finally:
+                # e.g. releases the file of wsgi.file_wrapper
+                if hasattr(result, "close"):
+                    result.close()
+            body = b"".join(chunks)
+            headers = response["headers"]
+            headers.append(("Server-Timing", timings.header()))
+
+            content_type = dict((k.lower(), v) for k, v in headers).get("content-type", "")
+            if content_type.startswith("text/html") and b"</body>" in body:
+                body = body.replace(b"</body>", self._render_panel(timings) + b"</body>", 1)
+                headers = [(k, v) for k, v in headers if k.lower() != "content-length"]
+                headers.append(("Content-Length", str(len(body))))
+
+            start_response(response["status"], headers, response["exc_info"])
+            return [body]
+        finally:
+            timing.finish_request()
+
+    @staticmethod
+    def _render_panel(timings):
+        rows = [
+            "<tr><td>%s</td><td>%s</td><td>%.1f ms</td></tr>"
+            % (html_escape(name), html_escape(str(description or "")), duration * 1000)
+            for name, duration, description in timings.records()
+        ]
+        return tob(DEBUG_PANEL_TEMPLATE % "".join(rows))
@@ -18,15 +18,17 @@ import logging
 
 from datetime import datetime
 
-from foris.ubus.sessions import UbusSession, SessionNotFound
+from foris.sessions import BaseSession, SessionNotFound
+from foris.utils.messages import flush_messages
 
 logger = logging.getLogger("middleware.sessions")
 
 
 class SessionProxy(object):
-    def __init__(self, env_key, timeout):
+    def __init__(self, store, env_key, timeout):
         self.cookie_set_needed = False
         self.cookie_unset_needed = False
+        self.store = store
         self.env_key = env_key
         self.timeout = timeout
 
@@ -40,13 +42,14 @@ class SessionProxy(object):
 
     @property
     def is_anonymous(self):
-        return self.session_id == UbusSession.ANONYMOUS
+        return self._session.anonymous
+
+    @property
+    def renew_needed(self):
+        return not self.destroyed and self._session.renew_needed
 
     def set_cookie(self):
         self.cookie_set_needed = True
-        self._cookie_set_text = "; ".join(
-            ["%s=%s" % (self.env_key, self.session_id), "httponly", "Path=/"]
-        )
 
     def unset_cookie(self):
         self.cookie_unset_needed = True
@@ -61,7 +64,8 @@ class SessionProxy(object):
 
     @property
     def set_cookie_text(self):
-        return self._cookie_set_text
+        # session id could be changed when the session was saved (see CookieSession)
+        return "; ".join(["%s=%s" % (self.env_key, self.session_id), "httponly", "Path=/"])
 
     @property
     def unset_cookie_text(self):
@@ -82,9 +86,9 @@ class SessionProxy(object):
 
 
 class SessionWsProxy(SessionProxy):
-    def __init__(self, env_key, timeout, session_id=None):
-        super(SessionWsProxy, self).__init__(env_key, timeout)
-        self._session = UbusSession(self.timeout, session_id)
+    def __init__(self, store, env_key, timeout, session_id=None):
+        super(SessionWsProxy, self).__init__(store, env_key, timeout)
+        self._session = store.open(self.timeout, session_id)
 
         if session_id is None:
             # grant listen for the new session
@@ -99,17 +103,81 @@ class SessionWsProxy(SessionProxy):
 
 
 class SessionForisProxy(SessionProxy):
+    """ Session is loaded lazily - when it is accessed for the first time
+        (e.g. requests for static files usually don't need the session at all)
+    """
+
     DONT_STORE_IN_ANONYMOUS = ["user_authenticated"]
 
-    def __init__(self, env_key, timeout, session_id):
-        super(SessionForisProxy, self).__init__(env_key, timeout)
-        self._session = UbusSession(self.timeout, session_id)
+    def __init__(self, store, env_key, timeout, session_id, ws_key=None, ws_session_id=None):
+        super(SessionForisProxy, self).__init__(store, env_key, timeout)
+        self._session_key = session_id
+        self._ws_key = ws_key
+        self._ws_session_key = ws_session_id
+        self._loaded_session = None
+        self._ws_session = None
+        self._replaced = False
         self.tainted = False
-        if self.is_anonymous:
+        self.environ = None  # 'foris.session.id' is kept up-to-date there (see SessionMiddleware)
+
+    @property
+    def loaded(self):
+        return self._loaded_session is not None
+
+    @property
+    def _session(self):
+        if self._loaded_session is None:
+            self._load()
+        return self._loaded_session
+
+    @_session.setter
+    def _session(self, session):
+        self._loaded_session = session
+        if self.environ is not None:
+            self.environ["foris.session.id"] = session.session_id
+
+    @property
+    def ws_session(self):
+        self._session  # ws session is loaded together with the foris session
+        return self._ws_session
+
+    @ws_session.setter
+    def ws_session(self, ws_session):
+        self._ws_session = ws_session
+
+    def _load(self):
+        try:
+            self._session = self.store.open(self.timeout, self._session_key)
+        except SessionNotFound:
+            self._session = self.store.open(self.timeout, BaseSession.ANONYMOUS)
+
+        if self._session.anonymous:
             self._session.filtered_keys = list(SessionForisProxy.DONT_STORE_IN_ANONYMOUS)
-        self.ws_session = None
+        elif self._ws_key:
+            try:
+                self._ws_session = SessionWsProxy(
+                    self.store, self._ws_key, self.timeout, self._ws_session_key
+                )
+            except SessionNotFound:
+                self._ws_session = SessionWsProxy(self.store, self._ws_key, self.timeout)
         logger.debug("session '%s' loaded" % self.session_id)
 
+    @property
+    def cookie_session_id(self):
+        """ Id of the session which the client sent in the cookie
+            (or the id of the new session when it was replaced in this request)
+
+        Unlike session_id it doesn't require the session to be loaded.
+        """
+        return self.session_id if self._replaced else self._session_key
+
+    @property
+    def is_anonymous(self):
+        if not self.loaded and self._session_key == BaseSession.ANONYMOUS:
+            # no session cookie - no need to load the session
+            return True
+        return super(SessionForisProxy, self).is_anonymous
+
     def __len__(self):
         return self._session.__len__()
 
@@ -134,8 +202,14 @@ class SessionForisProxy(SessionProxy):
         return self._session.get(*args, **kwargs)
 
     def save(self):
+        session_id = self.session_id
         self._session.save()
         self.tainted = False
+        if self.session_id != session_id:
+            # session id is changed by the stores which keep the data in the cookie
+            self.set_cookie()
+            if self.environ is not None:
+                self.environ["foris.session.id"] = self.session_id
         logger.debug("session '%s' stored" % self.session_id)
 
     def destroy(self):
@@ -151,7 +225,8 @@ class SessionForisProxy(SessionProxy):
             self.ws_session.unload()
             self.destroy()
 
-        self._session = UbusSession(self.timeout)
+        self._session = self.store.open(self.timeout)
+        self._replaced = True
         logger.debug("session '%s' created" % self.session_id)
         self._session.filtered_keys = []
         self.load()
@@ -162,7 +237,8 @@ class SessionForisProxy(SessionProxy):
 
         self.destroy()
         self.unload()
-        self._session = UbusSession(self.timeout, session_id=UbusSession.ANONYMOUS)
+        self._session = self.store.open(self.timeout, session_id=BaseSession.ANONYMOUS)
+        self._replaced = True
         self._session.filtered_keys = list(SessionForisProxy.DONT_STORE_IN_ANONYMOUS)
         self.ws_session = None
 
@@ -173,7 +249,20 @@ class SessionMiddleware(object):
         filtered = [e.strip() for e in cookies.split(";") if e.strip().startswith("%s=" % name)]
         return filtered[0][len(name) + 1 :] if filtered else None
 
-    def __init__(self, wrap_app, timeout, env_key="foris.session", ws_key="foris.ws.session"):
+    def __init__(
+        self, wrap_app, timeout, store=None, env_key="foris.session", ws_key="foris.ws.session"
+    ):
+        """
+        :param wrap_app: application to be wrapped
+        :param timeout: session timeout (in seconds)
+        :param store: session store (ubus store is used by default)
+        :type store: foris.sessions.SessionStore
+        """
+        if store is None:
+            from foris.sessions.ubus import UbusSessionStore
+
+            store = UbusSessionStore()
+        self.store = store
         self.timeout = timeout
         self.env_key = env_key
         self.ws_key = ws_key
@@ -182,30 +271,34 @@ class SessionMiddleware(object):
     def __call__(self, environ, start_response):
         cookies = environ.get("HTTP_COOKIE", "")
         session_key = self._get_cookie(self.env_key, cookies)
-        session_key = session_key if session_key else UbusSession.ANONYMOUS
+        session_key = session_key if session_key else BaseSession.ANONYMOUS
         ws_session_key = self._get_cookie(self.ws_key, cookies)
 
-        try:
-            session = SessionForisProxy(self.env_key, self.timeout, session_key)
-        except SessionNotFound:
-            session = SessionForisProxy(self.env_key, self.timeout, UbusSession.ANONYMOUS)
+        session = SessionForisProxy(
+            self.store, self.env_key, self.timeout, session_key, self.ws_key, ws_session_key
+        )
+        environ["foris.session"] = session
+        # the session is not loaded here, so the id is the one from the cookie until it is loaded
+        # and the data are accessed through the proxy (it loads the session on the first access)
+        environ["foris.session.id"] = session_key
+        environ["foris.session.data"] = session
+        session.environ = environ
 
-        if not session.is_anonymous:
-            try:
-                ws_session = SessionWsProxy(self.ws_key, self.timeout, ws_session_key)
-            except SessionNotFound:
-                ws_session = SessionWsProxy(self.ws_key, self.timeout)
-        else:
-            ws_session = None
+        def session_start_response(status, headers, exc_info=None):
+            if not session.loaded:
+                # session was not used at all
+                return start_response(status, headers, exc_info)
 
-        session.ws_session = ws_session
+            # store messages added during the request (including the error handlers)
+            flush_messages(environ)
 
-        environ["foris.session"] = session
-        environ["foris.session.id"] = session.session_id
-        environ["foris.session.data"] = session._session._data
+            # Store the current session if it was modified
+            # (before the cookies are set - the session id could be changed)
+            if session.tainted or session.renew_needed:
+                session.save()
 
-        def session_start_response(status, headers, exc_info=None):
             # update ws session cookies
+            ws_session = session.ws_session
             if ws_session and ws_session.cookie_set_needed:
                 headers.append(("Set-cookie", ws_session.set_cookie_text))
             elif ws_session and ws_session.cookie_unset_needed:
@@ -217,10 +310,6 @@ class SessionMiddleware(object):
             elif session.cookie_unset_needed:
                 headers.append(("Set-cookie", session.unset_cookie_text))
 
-            # Store the current session if it was modified
-            if session.tainted:
-                session.save()
-
             return start_response(status, headers, exc_info)
 
         return self.wrap_app(environ, session_start_response)
@@ -5,16 +5,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import gettext
 import inspect
 import importlib
 import logging
 import os
 import pkgutil
-import pkg_resources
 
 import bottle
 
+from foris.utils.packages import distribution_version
 from foris.utils.translators import translations
 
 
@@ -41,15 +40,13 @@ class ForisPlugin(object):
     def add_translations(self):
         """Add translations in current plugin.
 
+        The catalogs are loaded together with foris catalogs (on the first use of a language).
+
         This approach has one design flaw - messages in the plugin apply to
         the whole app. This is not an issue now, but it should be examined
         later and replaced by a better solution.
         """
-        for lang, default_translation in translations.items():
-            local_translation = gettext.translation(
-                "messages", os.path.join(self.DIRNAME, "locale"), languages=[lang], fallback=True
-            )
-            default_translation.add_fallback(local_translation)
+        translations.add_locale_dir(os.path.join(self.DIRNAME, "locale"))
 
 
 class ForisPluginLoader(object):
@@ -69,10 +66,7 @@ class ForisPluginLoader(object):
         for _, mod_name, _ in pkgutil.iter_modules(modules.__path__):
             plugin_module_name = "foris_plugins.%s" % mod_name
             # try to determine version
-            try:
-                version = pkg_resources.get_distribution("foris_%s_plugin" % mod_name).version
-            except pkg_resources.DistributionNotFound:
-                version = "?"
+            version = distribution_version("foris_%s_plugin" % mod_name) or "?"
             logger.debug("Found foris plugin '%s (%s)'.", mod_name, version)
             plugin_classes += self._get_plugin_classes(plugin_module_name)
 
@@ -117,3 +111,8 @@ class ForisPluginLoader(object):
         logger.info("Loading plugin: %s", plugin_class)
         instance = plugin_class(self.app)
         self.plugins.append(instance)
+
+        # the plugin could have modified the subpages of the registered pages directly
+        from foris.config import invalidate_config_pages
+
+        invalidate_config_pages()
@@ -0,0 +1,301 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Startup profiler (see --profile-startup)
+#
+# This module is imported before anything else in foris.__main__ so it has to
+# depend only on the standard library.
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on all platforms
+    resource = None
+
+
+# imports which took less time are hidden in the report (in seconds)
+MIN_IMPORT_TIME = 0.001
+
+# a value is reported as a regression when it exceeds the baseline by both
+# the relative tolerance and the absolute minimum
+TIME_TOLERANCE = 0.2
+MIN_TIME_DIFF = 0.005  # in seconds
+RSS_TOLERANCE = 0.1
+
+
+class ImportNode(object):
+    __slots__ = ("name", "duration", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+        self.children = []
+
+    @property
+    def self_duration(self):
+        return self.duration - sum(child.duration for child in self.children)
+
+
+class _TimingLoader(object):
+    """ Wraps the loader of a module and measures the execution of the module
+    """
+
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def exec_module(self, module):
+        # put the original loader back (e.g. pkg_resources dispatches on the loader type)
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+
+        if threading.current_thread() is not threading.main_thread():
+            return self.loader.exec_module(module)
+
+        with self.profiler.measure_import(module.__name__):
+            return self.loader.exec_module(module)
+
+
+class _ImportFinder(object):
+    """ Meta path finder which wraps the loaders found by the remaining finders
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        # namespace packages are not executed
+        if spec.loader is None or spec.origin in (None, "namespace"):
+            return spec
+        if not hasattr(spec.loader, "exec_module"):
+            return spec
+
+        spec.loader = _TimingLoader(spec.loader, self.profiler)
+        return spec
+
+
+class StartupProfiler(object):
+    """ Collects durations of the startup phases and of the imported modules
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.start_time = None
+        self.total = None
+        self.phases = []  # list of (name, depth, duration)
+        self.imports = ImportNode(None)
+        self._phase_depth = 0
+        self._import_stack = [self.imports]
+        self._finder = None
+
+    def start(self):
+        """ Starts measuring (should be called before the imports which should be measured)
+        """
+        self.enabled = True
+        self.start_time = time.perf_counter()
+        self._finder = _ImportFinder(self)
+        sys.meta_path.insert(0, self._finder)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.total = time.perf_counter() - self.start_time
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self.enabled = False
+
+    @contextlib.contextmanager
+    def measure_import(self, name):
+        node = ImportNode(name)
+        self._import_stack[-1].children.append(node)
+        self._import_stack.append(node)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            node.duration = time.perf_counter() - start_time
+            self._import_stack.pop()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Measures a part of the startup (nothing is recorded when the profiler is not running)
+
+        :param name: name of the phase (nested phases are displayed indented)
+        :type name: str
+        """
+        if not self.enabled:
+            yield
+            return
+
+        record = [name, self._phase_depth, 0.0]
+        self.phases.append(record)
+        self._phase_depth += 1
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            record[2] = time.perf_counter() - start_time
+            self._phase_depth -= 1
+
+    def mark(self, name):
+        """ Records a phase which lasted from the start of the profiler till now
+        """
+        if self.enabled:
+            self.phases.append([name, 0, time.perf_counter() - self.start_time])
+
+    def to_dict(self):
+        """ Summary of the profile which can be stored as a baseline
+        """
+        imports = {}
+
+        def walk(node):
+            for child in node.children:
+                imports[child.name] = child.duration
+                walk(child)
+
+        walk(self.imports)
+        return {
+            "total": self.total,
+            "peak_rss": peak_rss(),
+            "phases": {name: duration for name, _, duration in self.phases},
+            "imports": imports,
+        }
+
+    def report(self):
+        """ Formats the profile as a human readable text
+        """
+        lines = []
+        rss = peak_rss()
+        lines.append(
+            "Startup: %.1f ms, peak RSS: %s"
+            % ((self.total or 0.0) * 1000, "%d kB" % rss if rss is not None else "unknown")
+        )
+        lines.append("")
+        lines.append("Phases:")
+        for name, depth, duration in self.phases:
+            lines.append("  %-40s %9.1f ms" % ("  " * depth + name, duration * 1000))
+        lines.append("")
+        lines.append("Imports (cumulative / self):")
+
+        def walk(node, depth):
+            children = sorted(node.children, key=lambda e: e.duration, reverse=True)
+            for child in children:
+                if child.duration < MIN_IMPORT_TIME:
+                    continue
+                lines.append(
+                    "  %-50s %9.1f ms %9.1f ms"
+                    % ("  " * depth + child.name, child.duration * 1000, child.self_duration * 1000)
+                )
+                walk(child, depth + 1)
+
+        walk(self.imports, 0)
+        return "\n".join(lines)
+
+
+def peak_rss():
+    """ Peak resident set size of the process in kB (None if it can't be determined)
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, linux kilobytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _time_regressed(current, baseline):
+    return current - baseline > max(baseline * TIME_TOLERANCE, MIN_TIME_DIFF)
+
+
+def compare(current, baseline):
+    """ Compares two profile summaries (see StartupProfiler.to_dict())
+
+    :param current: summary of the current run
+    :type current: dict
+    :param baseline: summary of the reference run
+    :type baseline: dict
+    :returns: descriptions of the regressions
+    :rtype: list of str
+    """
+    res = []
+    if current.get("total") is not None and baseline.get("total") is not None:
+        if _time_regressed(current["total"], baseline["total"]):
+            res.append(
+                "total: %.1f ms -> %.1f ms" % (baseline["total"] * 1000, current["total"] * 1000)
+            )
+
+    for key in ("phases", "imports"):
+        current_values = current.get(key, {})
+        for name, base in sorted(baseline.get(key, {}).items()):
+            if name in current_values and _time_regressed(current_values[name], base):
+                res.append(
+                    "%s %s: %.1f ms -> %.1f ms"
+                    % (key[:-1], name, base * 1000, current_values[name] * 1000)
+                )
+        for name, value in sorted(current_values.items()):
+            # new imports are reported when they are significant
+            if key == "imports" and name not in baseline.get(key, {}) and value > MIN_TIME_DIFF:
+                res.append("new import %s: %.1f ms" % (name, value * 1000))
+
+    current_rss, baseline_rss = current.get("peak_rss"), baseline.get("peak_rss")
+    if current_rss is not None and baseline_rss is not None:
+        if current_rss > baseline_rss * (1 + RSS_TOLERANCE):
+            res.append("peak RSS: %d kB -> %d kB" % (baseline_rss, current_rss))
+
+    return res
+
+
+def check_baseline(path, summary):
+    """ Compares the summary with the baseline stored in a file
+
+    The baseline is created from the summary when the file doesn't exist.
+
+    :param path: path to the baseline file (json)
+    :type path: str
+    :param summary: summary of the current run (see StartupProfiler.to_dict())
+    :type summary: dict
+    :returns: descriptions of the regressions (None when a new baseline was written)
+    :rtype: list of str or None
+    """
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        return None
+
+    with open(path) as f:
+        baseline = json.load(f)
+    return compare(summary, baseline)
+
+
+profiler = StartupProfiler()
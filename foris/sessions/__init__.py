@@ -0,0 +1,190 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import importlib
+import logging
+
+from json import JSONEncoder
+
+logger = logging.getLogger("foris.sessions")
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+class SessionFailedToCreate(Exception):
+    pass
+
+
+class SessionDestroyed(Exception):
+    pass
+
+
+class SessionReadOnly(Exception):
+    pass
+
+
+def not_destroyed(func):
+    def wrapped(self, *args, **kwargs):
+        if self.destroyed:
+            raise SessionDestroyed()
+        return func(self, *args, **kwargs)
+
+    return wrapped
+
+
+def not_readonly(func):
+    def wrapped(self, *args, **kwargs):
+        if self.readonly:
+            raise SessionReadOnly()
+        return func(self, *args, **kwargs)
+
+    return wrapped
+
+
+class BaseSession(object):
+    """ Dict-like session data
+
+    Store specific sessions should implement _create(), _obtain(), save() and destroy().
+    """
+
+    ANONYMOUS = "00000000000000000000000000000000"
+
+    def __init__(self, timeout, session_id=None):
+        if not session_id:
+            self._create(timeout)
+        else:
+            self._obtain(session_id)
+        self.destroyed = False
+        self.readonly = False
+        self.filtered_keys = []
+
+    def _create(self, timeout):
+        raise NotImplementedError()
+
+    def _obtain(self, session_id):
+        raise NotImplementedError()
+
+    @property
+    def anonymous(self):
+        return self.session_id == self.ANONYMOUS
+
+    @property
+    def renew_needed(self):
+        """ Session needs to be saved to delay its expiration
+        """
+        return False
+
+    def save(self):
+        raise NotImplementedError()
+
+    def destroy(self):
+        raise NotImplementedError()
+
+    @not_readonly
+    @not_destroyed
+    def grant(self, obj, function, scope="ubus"):
+        """ Grants access to an ubus object (makes sense only for ubus sessions)
+        """
+        logger.debug(
+            "Session '%s' doesn't support grants ('%s'.'%s')." % (self.session_id, obj, function)
+        )
+
+    def _filtered_data(self):
+        return {k: v for k, v in self._data.items() if k not in self.filtered_keys}
+
+    # make session iterable
+    @not_destroyed
+    def __getitem__(self, key):
+        return self._data.get(key, None)
+
+    @not_readonly
+    @not_destroyed
+    def __delitem__(self, key):
+        self._data.pop(key, None)
+
+    @not_destroyed
+    def __iter__(self):
+        for key in self._data:
+            yield key
+
+    @not_destroyed
+    def __contains__(self, key):
+        return key in self._data
+
+    @not_readonly
+    @not_destroyed
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise TypeError("key is not a string")
+        # test whether the key is ascii (exception will be raised otherwise)
+        key.encode("ascii")
+        # test whenter the value is json-serializable (exception otherwise)
+        JSONEncoder().encode(value)
+        self._data[key] = value
+
+    @not_destroyed
+    def __len__(self):
+        return len(self._data)
+
+    @not_destroyed
+    def get(self, *args, **kwargs):
+        return self._data.get(*args, **kwargs)
+
+
+class SessionStore(object):
+    """ Creates and obtains sessions of a particular kind
+    """
+
+    name = None
+
+    def open(self, timeout, session_id=None):
+        """ Creates a new session or obtains an existing one
+
+        :param timeout: timeout of a newly created session (in seconds)
+        :type timeout: int
+        :param session_id: id of an existing session (None to create a new one)
+        :type session_id: str
+        :returns: session
+        :rtype: BaseSession
+        :raises SessionNotFound: when the session doesn't exist or has expired
+        """
+        raise NotImplementedError()
+
+
+# name -> (module, class)
+STORES = {
+    "ubus": ("foris.sessions.ubus", "UbusSessionStore"),
+    "sqlite": ("foris.sessions.sqlite", "SqliteSessionStore"),
+    "cookie": ("foris.sessions.cookie", "CookieSessionStore"),
+}
+
+
+def get_store(name, **kwargs):
+    """ Creates a session store
+
+    Stores are imported on demand (e.g. ubus store requires a running ubus daemon).
+
+    :param name: name of the store (see STORES)
+    :type name: str
+    :param kwargs: store specific arguments
+    :rtype: SessionStore
+    """
+    module_name, class_name = STORES[name]
+    store_class = getattr(importlib.import_module(module_name), class_name)
+    logger.debug("Using '%s' session store." % name)
+    return store_class(**kwargs)
@@ -0,0 +1,150 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+
+from foris.sessions import (
+    BaseSession,
+    SessionNotFound,
+    SessionStore,
+    not_destroyed,
+    not_readonly,
+)
+
+logger = logging.getLogger("foris.sessions.cookie")
+
+
+class CookieSession(BaseSession):
+    """ Session which data are stored in the session id itself (signed payload)
+
+    Session id changes whenever the session is saved, so the cookie needs to be set again.
+    """
+
+    def __init__(self, store, timeout, session_id=None):
+        self._store = store
+        super(CookieSession, self).__init__(timeout, session_id)
+
+    def _create(self, timeout):
+        self._data = {}
+        self._anonymous = False
+        self.expires_in = timeout
+        self._expires_at = time.time() + timeout
+        self.session_id = self._store.sign(self._payload({}))
+        logger.debug("Session '%s' created." % self.session_id)
+
+    def _obtain(self, session_id):
+        if session_id == self.ANONYMOUS:
+            # new anonymous session (it gets its own cookie when saved)
+            self.session_id = session_id
+            self._data, self._anonymous, self.expires_in, self._expires_at = {}, True, 0, None
+            return
+
+        payload = self._store.verify(session_id)
+        if payload is None:
+            logger.debug("Session '%s' not found." % session_id)
+            raise SessionNotFound()
+        self.session_id = session_id
+        self._data = payload["data"]
+        self._anonymous = payload["anonymous"]
+        self.expires_in = payload["timeout"]
+        self._expires_at = payload["expires_at"]
+
+    def _payload(self, data):
+        return {
+            "data": data,
+            "anonymous": self._anonymous,
+            "timeout": self.expires_in,
+            "expires_at": self._expires_at,
+        }
+
+    @property
+    def anonymous(self):
+        return self._anonymous
+
+    @property
+    def renew_needed(self):
+        """ Expiration is delayed only when the session (cookie) is saved
+        """
+        return (
+            self._expires_at is not None
+            and self._expires_at - time.time() < self.expires_in / 2
+        )
+
+    @not_readonly
+    @not_destroyed
+    def save(self):
+        if self._expires_at is not None:
+            self._expires_at = time.time() + self.expires_in
+        session_id = self._store.sign(self._payload(self._filtered_data()))
+        if len(session_id) > self._store.MAX_SIZE:
+            logger.error("Session data are too large to be stored in a cookie.")
+            return False
+        self.session_id = session_id
+        return True
+
+    @not_readonly
+    @not_destroyed
+    def destroy(self):
+        # signed cookie can't be revoked, it is only unset in the browser
+        self.destroyed = True
+        logger.debug("Session '%s' destroyed." % self.session_id)
+
+
+class CookieSessionStore(SessionStore):
+    """ Stateless sessions - data are stored in HMAC-signed cookies
+
+    Suitable only for small session data (see MAX_SIZE). Note that the data
+    are signed, not encrypted (they can be read by the client).
+    """
+
+    name = "cookie"
+    MAX_SIZE = 3800  # in bytes (browsers limit a cookie to 4096 bytes including its name)
+
+    def __init__(self, secret=None):
+        if secret is None:
+            logger.warning("No session secret set. Sessions will be lost on restart.")
+            secret = secrets.token_bytes(32)
+        self.secret = secret
+
+    def open(self, timeout, session_id=None):
+        return CookieSession(self, timeout, session_id)
+
+    def _signature(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).hexdigest()
+
+    def sign(self, payload):
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode())
+        return "%s.%s" % (encoded.decode(), self._signature(encoded))
+
+    def verify(self, session_id):
+        """ :returns: payload or None if the signature is invalid or the session has expired
+        """
+        encoded, _, signature = session_id.encode().rpartition(b".")
+        if not hmac.compare_digest(self._signature(encoded).encode(), signature):
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded).decode())
+        except ValueError:
+            return None
+        if payload["expires_at"] is not None and payload["expires_at"] < time.time():
+            return None
+        return payload
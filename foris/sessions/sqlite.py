@@ -0,0 +1,177 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from foris.sessions import (
+    BaseSession,
+    SessionNotFound,
+    SessionStore,
+    not_destroyed,
+    not_readonly,
+)
+
+logger = logging.getLogger("foris.sessions.sqlite")
+
+
+class SqliteSession(BaseSession):
+    def __init__(self, store, timeout, session_id=None):
+        self._store = store
+        super(SqliteSession, self).__init__(timeout, session_id)
+
+    def _create(self, timeout):
+        self.session_id = secrets.token_hex(16)
+        self._data = {}
+        self.expires_in = timeout
+        self._store.insert(self.session_id, timeout)
+        logger.debug("Session '%s' created." % self.session_id)
+
+    def _obtain(self, session_id):
+        self.session_id = session_id
+        self._data, self.expires_in = self._store.obtain(session_id)
+        logger.debug("Session '%s' obtained." % session_id)
+
+    @not_readonly
+    @not_destroyed
+    def save(self):
+        if not self._store.update(self.session_id, self._filtered_data()):
+            logger.debug("Failed to store session data.")
+            return False
+        return True
+
+    @not_readonly
+    @not_destroyed
+    def destroy(self):
+        self._store.delete(self.session_id)
+        self.destroyed = True
+        logger.debug("Session '%s' destroyed." % self.session_id)
+
+
+class SqliteSessionStore(SessionStore):
+    """ Sessions stored in a local sqlite database (memory-mapped)
+
+    The database can be shared by more processes. Expired sessions are
+    periodically removed (using an index of the expiration times).
+    """
+
+    name = "sqlite"
+    MMAP_SIZE = 4 * 1024 * 1024  # in bytes
+    PURGE_INTERVAL = 60  # in seconds
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            timeout INTEGER NOT NULL,
+            expires_at REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)",
+    ]
+
+    def __init__(self, path="/tmp/foris-sessions.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._purged_at = 0
+
+    def open(self, timeout, session_id=None):
+        return SqliteSession(self, timeout, session_id)
+
+    def _connect(self):
+        # connection can't be shared with forked processes
+        if self._connection is None or self._connection_pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA mmap_size=%d" % self.MMAP_SIZE)
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+            self._connection_pid = os.getpid()
+            logger.debug("Connected to session database '%s'." % self.path)
+        return self._connection
+
+    def _execute(self, query, params=()):
+        """ :returns: (fetched rows, number of modified rows)
+        """
+        with self._lock:
+            cursor = self._connect().execute(query, params)
+            return cursor.fetchall(), cursor.rowcount
+
+    def _purge(self, now):
+        if now - self._purged_at < self.PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        _, count = self._execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+        logger.debug("%d expired sessions removed." % count)
+
+    def insert(self, session_id, timeout):
+        now = time.time()
+        self._purge(now)
+        self._execute(
+            "INSERT INTO sessions (id, data, timeout, expires_at) VALUES (?, ?, ?, ?)",
+            (session_id, "{}", timeout, now + timeout),
+        )
+
+    def obtain(self, session_id):
+        """ Obtains session data and delays its expiration
+
+        :returns: (data, timeout)
+        :raises SessionNotFound: when the session doesn't exist or has expired
+        """
+        now = time.time()
+        self._purge(now)
+        if session_id == BaseSession.ANONYMOUS:
+            # anonymous session never expires
+            self._execute(
+                "INSERT OR IGNORE INTO sessions (id, data, timeout, expires_at) "
+                "VALUES (?, ?, 0, NULL)",
+                (session_id, "{}"),
+            )
+
+        self._execute(
+            "UPDATE sessions SET expires_at = ? + timeout "
+            "WHERE id = ? AND expires_at IS NOT NULL AND expires_at > ?",
+            (now, session_id, now),
+        )
+        rows, _ = self._execute(
+            "SELECT data, timeout FROM sessions "
+            "WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (session_id, now),
+        )
+        if not rows:
+            logger.debug("Session '%s' not found." % session_id)
+            raise SessionNotFound()
+        data, timeout = rows[0]
+        return json.loads(data), timeout
+
+    def update(self, session_id, data):
+        _, count = self._execute(
+            "UPDATE sessions SET data = ? WHERE id = ?", (json.dumps(data), session_id)
+        )
+        return count > 0
+
+    def delete(self, session_id):
+        self._execute("DELETE FROM sessions WHERE id = ?", (session_id,))
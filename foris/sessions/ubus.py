@@ -0,0 +1,29 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from foris.sessions import SessionStore
+from foris.ubus.sessions import UbusSession
+
+
+class UbusSessionStore(SessionStore):
+    """ Sessions stored in rpcd (via ubus), required by the websocket server
+        to authorize the listening
+    """
+
+    name = "ubus"
+
+    def open(self, timeout, session_id=None):
+        return UbusSession(timeout, session_id)
@@ -15,7 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import logging
+import threading
+import time
 
 from foris import __version__ as version
 from foris.langs import DEFAULT_LANGUAGE
@@ -23,19 +26,79 @@ from foris.langs import DEFAULT_LANGUAGE
 logger = logging.getLogger("foris.state")
 
 
+class RequestLocal(object):
+    """ Attribute of ForisState which is kept separately for each thread
+        so that concurrent requests can't see the data of each other
+
+        Threads which haven't set the attribute yet (e.g. backend listener)
+        see the value which was set last.
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance._request_local, self.name)
+        except AttributeError:
+            return instance._last_values.get(self.name, self.default)
+
+    def __set__(self, instance, value):
+        setattr(instance._request_local, self.name, value)
+        instance._last_values[self.name] = value
+
+
 class ForisState(object):
+    # modules which notifications could change the data obtained via web.get_data
+    WEB_DATA_MODULES = ["web", "maintain", "password", "router_notifications", "updater"]
+    # web data are reloaded at least this often even when no notification arrives
+    WEB_DATA_MAX_AGE = 300  # in seconds
+
+    # data obtained via web.get_data (updated within each request see BackendData)
+    language = RequestLocal(DEFAULT_LANGUAGE)
+    reboot_required = RequestLocal(False)
+    notification_count = RequestLocal(0)
+    updater_is_running = RequestLocal(False)
+    password_set = RequestLocal()
+    turris_os_version = RequestLocal()
+    device = RequestLocal()
+    guide = RequestLocal()
+
     def __init__(self):
+        self._request_local = threading.local()
+        self._last_values = {}
         self.foris_version = version
-        self.language = DEFAULT_LANGUAGE
         self.app = None
-        self.reboot_required = False
         self.assets_path = None
         self.sentry_running = False
+        self.web_data_generation = 0
+        self.web_data_loaded = None  # (generation, timestamp) of the last loaded web data
+        self.web_data_version = 0  # changes when the loaded web data differ from the previous ones
 
     def update_lang(self, lang):
         logger.debug(f"current lang updated to '{lang}'")
         self.language = lang
 
+    @contextlib.contextmanager
+    def local_language(self, lang):
+        """ Switches the language temporarily only within the current thread
+        """
+        missing = object()
+        original = getattr(self._request_local, "language", missing)
+        self._request_local.language = lang
+        try:
+            yield
+        finally:
+            if original is missing:
+                del self._request_local.language
+            else:
+                self._request_local.language = original
+
     def set_app(self, app):
         logger.debug(f"current app updated to '{app}'")
         self.app = app
@@ -74,6 +137,21 @@ class ForisState(object):
         logger.debug(f"setting notification_count={new_count}")
         self.notification_count = new_count
 
+    def fragment_cache_key(self):
+        """ Returns the state which affects rendering of cached template fragments
+            (see foris.utils.fragment_cache)
+        """
+        return (
+            self.language,
+            self.device,
+            self.turris_os_version,
+            self.password_set,
+            self.notification_count,
+            self.reboot_required,
+            self.updater_is_running,
+            self.guide.cache_key() if self.guide is not None else None,
+        )
+
     def repr(self):
         return "%s (%s)" % (self.__class__, str(vars(self)))
 
@@ -99,6 +177,44 @@ class ForisState(object):
         """
         self.device = device
 
+    def handle_notification(self, module):
+        """ Handles notification from the backend (see BackendListener)
+
+        :param module: name of the module which sent the notification
+                       (None means that notifications could have been missed)
+        :type module: str
+        """
+        guide_enabled = self.guide is not None and self.guide.enabled
+        if module is None or module in self.WEB_DATA_MODULES or guide_enabled:
+            # guide steps are passed by updating the settings of any module
+            self.web_data_generation += 1
+            logger.debug(f"web data outdated (generation {self.web_data_generation})")
+
+    def web_data_outdated(self):
+        """ Checks whether the data obtained via web.get_data should be reloaded
+
+        Without a running backend listener the data are always considered outdated.
+        """
+        if self.web_data_loaded is None or not self.backend.listening:
+            return True
+
+        generation, loaded_at = self.web_data_loaded
+        return (
+            generation != self.web_data_generation
+            or time.monotonic() - loaded_at > self.WEB_DATA_MAX_AGE
+        )
+
+    def set_web_data_loaded(self, generation, changed=True):
+        """ Marks that web data were loaded
+        :param generation: web data generation obtained before the data were requested
+        :type generation: int
+        :param changed: the data differ from the previously loaded data
+        :type changed: bool
+        """
+        self.web_data_loaded = (generation, time.monotonic())
+        if changed:
+            self.web_data_version += 1
+
     def update_password_set(self, password_set):
         logger.debug(f"setting password_set={password_set}")
         self.password_set = password_set
@@ -109,6 +225,9 @@ class ForisState(object):
         logger.debug(f"setting guide_data ({guide_data})")
         self.guide = Guide(guide_data)
 
+    def set_guide(self, guide):
+        self.guide = guide
+
     def set_assets_path(self, assets_path):
         logger.debug(f"setting assets_path to '{assets_path}'")
         self.assets_path = assets_path
@@ -0,0 +1,322 @@
+# coding=utf-8
+
+import threading
+import time
+
+import pytest
+
+from foris_client.buses.base import ControllerError
+
+from foris.backend import (
+    Backend,
+    BackendBusy,
+    BackendUnavailable,
+    CircuitBreaker,
+    ExceptionInBackend,
+)
+from foris.utils.caches import BackendCache
+
+
+class FakeSender(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.threads = set()
+
+    def send(self, module, action, data, timeout=None, controller_id=None):
+        self.threads.add(threading.current_thread().name)
+        response = self.responses[module, action]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_backend(name, responses):
+    sender = FakeSender(responses)
+
+    class FakeBackend(Backend):
+        def _create_sender(self):
+            return sender
+
+    if name == "mqtt":
+        backend = FakeBackend(
+            name, host="localhost", port=1883, credentials=None, controller_id=None
+        )
+    else:
+        backend = FakeBackend(name, path="/tmp/fake.sock")
+    return backend, sender
+
+
+RESPONSES = {
+    ("wan", "get_settings"): {"wan_settings": {}},
+    ("wan", "get_wan_status"): {"up": True},
+    ("lan", "get_settings"): {"mode": "managed"},
+    ("web", "get_data"): {},
+    ("dns", "get_settings"): ControllerError(
+        [{"stacktrace": "trace", "description": "description"}]
+    ),
+}
+
+
+@pytest.mark.parametrize("name", ["ubus", "unix-socket", "mqtt"])
+def test_perform_many_order(name):
+    backend, _ = make_backend(name, RESPONSES)
+    assert backend.perform_many(
+        [("wan", "get_wan_status"), ("lan", "get_settings", None), ("wan", "get_settings")]
+    ) == [{"up": True}, {"mode": "managed"}, {"wan_settings": {}}]
+
+
+def test_perform_many_parallel():
+    backend, sender = make_backend("unix-socket", RESPONSES)
+    backend.perform_many([("wan", "get_wan_status"), ("wan", "get_settings")])
+    assert all(e.startswith("foris-backend") for e in sender.threads)
+
+    backend, sender = make_backend("ubus", RESPONSES)
+    backend.perform_many([("wan", "get_wan_status"), ("wan", "get_settings")])
+    assert sender.threads == {threading.current_thread().name}
+
+
+@pytest.mark.parametrize("name", ["ubus", "unix-socket"])
+def test_perform_many_failure(name):
+    backend, _ = make_backend(name, RESPONSES)
+    requests = [("wan", "get_wan_status"), ("dns", "get_settings"), ("lan", "get_settings")]
+
+    with pytest.raises(ExceptionInBackend) as excinfo:
+        backend.perform_many(requests)
+    assert excinfo.value.query == {"module": "dns", "action": "get_settings", "kind": "request"}
+
+    assert backend.perform_many(requests, raise_exception_on_failure=False) == [
+        {"up": True},
+        None,
+        {"mode": "managed"},
+    ]
+
+
+class CountingSender(FakeSender):
+    def __init__(self, responses):
+        super(CountingSender, self).__init__(responses)
+        self.calls = []
+
+    def send(self, module, action, data, timeout=None, controller_id=None):
+        self.calls.append((module, action))
+        return super(CountingSender, self).send(module, action, data, timeout, controller_id)
+
+
+def test_cache():
+    responses = dict(RESPONSES)
+    responses["wan", "update_settings"] = {"result": True}
+    sender = CountingSender(responses)
+
+    class FakeBackend(Backend):
+        def _create_sender(self):
+            return sender
+
+    backend = FakeBackend("unix-socket", path="/tmp/fake.sock")
+
+    response = backend.perform("wan", "get_settings")
+    response["modified"] = True
+    assert backend.perform("wan", "get_settings") == {"wan_settings": {}}
+    assert sender.calls == [("wan", "get_settings")]
+
+    # volatile data are not cached
+    backend.perform("wan", "get_wan_status")
+    backend.perform("wan", "get_wan_status")
+    assert sender.calls.count(("wan", "get_wan_status")) == 2
+
+    # update invalidates the module
+    backend.perform("lan", "get_settings")
+    backend.perform("wan", "update_settings", {"wan_settings": {}})
+    backend.perform("wan", "get_settings")
+    backend.perform("lan", "get_settings")
+    assert sender.calls.count(("wan", "get_settings")) == 2
+    assert sender.calls.count(("lan", "get_settings")) == 1
+
+
+def test_cache_eviction():
+    cache = BackendCache("test", {"wan": 60, "lan": 0.01}, 30)
+    cache.set("a", "wan", "x" * 10)
+    cache.set("b", "wan", "y" * 10)
+    assert cache.get("a") == (True, "x" * 10)
+    cache.set("c", "wan", "z" * 10)  # "b" is the least recently used
+    assert cache.get("b") == (False, None)
+    assert cache.get("a")[0] and cache.get("c")[0]
+    assert cache.size == 24
+
+    cache.set("d", "lan", {})
+    time.sleep(0.02)
+    assert cache.get("d") == (False, None)
+
+    cache.invalidate("wan")
+    assert cache.size == 0
+
+
+def test_circuit_breaker():
+    responses = dict(RESPONSES)
+    responses["lan", "get_settings"] = OSError("Connection refused")
+    responses["web", "get_data"] = OSError("Connection refused")
+    backend, sender = make_backend("unix-socket", responses)
+    backend.circuit_breaker.probe_interval = 0.01
+
+    for _ in range(backend.circuit_breaker.failure_threshold):
+        with pytest.raises(OSError):
+            backend.perform("lan", "get_settings")
+
+    # failing fast
+    assert not backend.circuit_breaker.closed
+    with pytest.raises(BackendUnavailable):
+        backend.perform("wan", "get_wan_status")
+
+    # backend is back
+    responses["web", "get_data"] = {}
+    time.sleep(0.1)
+    assert backend.circuit_breaker.state == CircuitBreaker.CLOSED
+    assert backend.perform("wan", "get_wan_status") == {"up": True}
+
+
+def test_circuit_breaker_fails_fast():
+    responses = dict(RESPONSES)
+    responses["wan", "get_settings"] = RuntimeError("ubus error occured: Method not found")
+    responses["wan", "get_wan_status"] = RuntimeError("ubus error occured: Request timed out")
+    responses["web", "get_data"] = RuntimeError("Failed to find object 'foris-controller-web'")
+    backend, _ = make_backend("ubus", responses)
+
+    # method missing in the backend doesn't open the circuit
+    for _ in range(backend.circuit_breaker.failure_threshold):
+        with pytest.raises(RuntimeError):
+            backend.perform("wan", "get_settings")
+    assert backend.circuit_breaker.closed
+
+    # python-ubus reports missing objects and timeouts as RuntimeError as well
+    for _ in range(backend.circuit_breaker.failure_threshold):
+        with pytest.raises(RuntimeError):
+            backend.perform("wan", "get_wan_status")
+    assert not backend.circuit_breaker.closed
+
+    # the connection is busy (e.g. a probe is running)
+    backend.circuit_breaker.state = CircuitBreaker.OPEN
+    with backend._instance_lock:
+        start = time.time()
+        with pytest.raises(BackendUnavailable):
+            backend.perform("wan", "get_wan_status")
+        assert time.time() - start < 1
+
+
+def test_probe_busy_connection():
+    backend, _ = make_backend("ubus", RESPONSES)
+    backend.PROBE_TIMEOUT = 10
+    with backend._instance_lock:
+        with pytest.raises(BackendBusy):
+            backend._probe()
+    backend._probe()
+
+
+def test_ubus_lock_shared_with_sessions():
+    from foris import ubus
+
+    backend, _ = make_backend("ubus", RESPONSES)
+    assert backend._instance_lock is ubus.lock
+    backend.after_fork()
+    assert backend._instance_lock is ubus.lock
+
+    backend, _ = make_backend("unix-socket", RESPONSES)
+    assert backend._instance_lock is not ubus.lock
+
+
+def test_timeouts():
+    backend, _ = make_backend("ubus", RESPONSES)
+    assert backend.get_timeout("wan", "get_settings") == Backend.READ_TIMEOUT
+    assert backend.get_timeout("wan", "update_settings") == Backend.DEFAULT_TIMEOUT
+    assert backend.get_timeout("maintain", "generate_backup") > Backend.DEFAULT_TIMEOUT
+
+
+def test_parallel_perform():
+    responses = dict(RESPONSES)
+    senders = []
+
+    class FakeBackend(Backend):
+        def _create_sender(self):
+            sender = FakeSender(responses)
+            senders.append(sender)
+            return sender
+
+    backend = FakeBackend("unix-socket", path="/tmp/fake.sock")
+    backend.perform("wan", "get_wan_status")
+    backend.perform("wan", "get_wan_status")
+    assert len(senders) == 1  # idle sender is reused
+
+    with backend._acquire_sender():
+        backend.perform("wan", "get_wan_status")
+    assert len(senders) == 2
+
+
+def test_listener_dispatch(monkeypatch):
+    from foris import backend as backend_module
+
+    class FakeListener(object):
+        def __init__(self, handler):
+            self.handler = handler
+
+        def listen(self):
+            self.handler({"module": "lan"}, "other-controller")
+            self.handler({"module": "web"}, "controller")
+            threading.Event().wait()
+
+    monkeypatch.setattr(
+        backend_module, "_create_listener", lambda name, handler, **kwargs: FakeListener(handler)
+    )
+    backend, _ = make_backend("unix-socket", RESPONSES)
+    backend.controller_id = "controller"
+    listener = backend_module.BackendListener(backend, "/tmp/fake-notifications.sock")
+    received = []
+    listener.add_handler(received.append)
+    listener.start()
+
+    deadline = time.time() + 5
+    while len(received) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    # None (connected) - data could be outdated, notifications of other controllers are ignored
+    assert received == [None, "web"]
+    assert listener.listening
+    # no extra process is needed for unix-socket bus
+    assert isinstance(listener._worker, threading.Thread)
+
+
+def test_notification_outdates_web_data():
+    from foris.state import ForisState
+
+    class FakeBackend(object):
+        listening = True
+
+    state = ForisState()
+    state.backend = FakeBackend()
+    assert state.web_data_outdated()
+
+    state.set_web_data_loaded(state.web_data_generation)
+    assert not state.web_data_outdated()
+
+    # guide is disabled so unrelated modules don't matter
+    state.handle_notification("lan")
+    assert not state.web_data_outdated()
+
+    state.handle_notification("web")
+    assert state.web_data_outdated()
+
+    state.set_web_data_loaded(state.web_data_generation)
+    state.handle_notification(None)
+    assert state.web_data_outdated()
+
+
+def test_write_outdates_web_data(monkeypatch):
+    from foris.state import current_state
+
+    responses = dict(RESPONSES)
+    responses["web", "set_language"] = {"result": True}
+    responses["web", "get_data"] = {}
+    backend, _ = make_backend("ubus", responses)
+    monkeypatch.setattr(current_state, "web_data_generation", 0)
+    monkeypatch.setattr(current_state, "guide", None)
+
+    backend.perform("web", "get_data")
+    assert current_state.web_data_generation == 0
+
+    backend.perform("web", "set_language", {"language": "cs"})
+    assert current_state.web_data_generation == 1
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+import bottle
+import pytest
+
+from foris.middleware.backend_data import BackendData
+from foris.state import current_state
+
+WEB_DATA = {
+    "language": "en",
+    "reboot_required": False,
+    "notification_count": 0,
+    "updater_running": False,
+    "password_ready": True,
+    "turris_os_version": "4.0",
+    "device": "omnia",
+    "guide": {"enabled": False, "workflow": "old", "passed": [], "workflow_steps": []},
+}
+
+
+class FakeBackend(object):
+    listening = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def perform(self, module, action, data=None):
+        assert (module, action) == ("web", "get_data")
+        self.calls += 1
+        return WEB_DATA
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(current_state, "backend", backend, raising=False)
+    monkeypatch.setattr(current_state, "web_data_generation", 0)
+    monkeypatch.setattr(current_state, "web_data_loaded", None)
+    return backend
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # language of the app is not tested here
+    monkeypatch.setattr(BackendData, "set_language", lambda self, language: None)
+    app = bottle.Bottle()
+    app.route("/", callback=lambda: "index")
+    bottle.default_app.push(app)
+    yield app
+    bottle.default_app.pop()
+
+
+def call(wsgi_app, path):
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "SCRIPT_NAME": ""}
+    return b"".join(wsgi_app(environ, lambda status, headers, exc_info=None: None))
+
+
+def test_guide_reused(app, backend):
+    wsgi_app = BackendData(app)
+
+    call(wsgi_app, "/")
+    guide = current_state.guide
+    call(wsgi_app, "/")
+    assert backend.calls == 1
+    assert current_state.guide is guide
+
+    version = current_state.web_data_version
+    current_state.handle_notification("web")
+    call(wsgi_app, "/")
+    assert backend.calls == 2
+    assert current_state.guide is not guide
+    # the same data were obtained (e.g. the cached menu can be reused)
+    assert current_state.web_data_version == version
+
+
+def test_static_routes_skip_backend(app, backend):
+    sub = bottle.Bottle()
+    sub.route("/page", callback=lambda: "page")
+    sub.route("/static/<filename>", callback=lambda filename: filename, backend_data=False)
+    app.route("/static/<filename>", callback=lambda filename: filename, backend_data=False)
+    app.mount("/main/", sub)
+    wsgi_app = BackendData(app)
+
+    assert call(wsgi_app, "/static/a.css") == b"a.css"
+    assert call(wsgi_app, "/main/static/b.css") == b"b.css"
+    assert backend.calls == 0
+
+    assert call(wsgi_app, "/main/page") == b"page"
+    assert backend.calls == 1
+    assert call(wsgi_app, "/") == b"index"
@@ -0,0 +1,68 @@
+# coding=utf-8
+
+import bottle
+import pytest
+
+from foris import config
+from foris.config.pages.base import ConfigPageMixin
+
+
+def test_config_page_registry(monkeypatch):
+    monkeypatch.setattr(config, "config_pages", dict(config.config_pages))
+    registry = config.get_config_page_registry()
+    assert config.get_config_page_registry() is registry
+    assert list(config.get_config_pages()) == sorted(
+        registry.pages, key=lambda e: (e.menu_order, e.slug)
+    )
+
+    class SubPage(ConfigPageMixin):
+        slug = "test-sub"
+        menu_order = 1
+
+    class Page(ConfigPageMixin):
+        slug = "test-page"
+        menu_order = 0
+        subpages = [SubPage]
+
+    config.add_config_page(Page)
+    # registry is built on the first use only
+    assert config._registry is None
+    new_registry = config.get_config_page_registry()
+    assert new_registry.version > registry.version
+    assert config.get_config_pages()[0] is Page
+    assert config.get_config_page("test-sub") is SubPage
+
+    with pytest.raises(Exception):
+        config.add_config_page(SubPage)
+
+    class OtherSubPage(ConfigPageMixin):
+        slug = "test-other-sub"
+        menu_order = 0
+
+    version = config.get_config_pages_version()
+    config.add_config_subpage("test-page", OtherSubPage)
+    assert config.get_config_pages_version() > version
+    assert config.get_config_page("test-other-sub") is OtherSubPage
+    assert Page.subpages == [OtherSubPage, SubPage]
+    assert ConfigPageMixin.subpages == []
+    with pytest.raises(Exception):
+        config.add_config_subpage("test-page", OtherSubPage)
+    with pytest.raises(bottle.HTTPError):
+        config.get_config_page("missing")
+
+    monkeypatch.undo()
+    config.invalidate_config_pages()
+    assert "test-page" not in config.get_config_page_registry().slug_map
+
+
+def test_config_pages_menu_state(monkeypatch):
+    from foris.state import current_state
+
+    monkeypatch.setattr(current_state, "web_data_version", 0)
+    monkeypatch.setattr(current_state, "web_data_loaded", None)
+
+    state = config.get_config_pages_menu_state()
+    current_state.set_web_data_loaded(current_state.web_data_generation, changed=False)
+    assert config.get_config_pages_menu_state() == state
+    current_state.set_web_data_loaded(current_state.web_data_generation)
+    assert config.get_config_pages_menu_state() != state
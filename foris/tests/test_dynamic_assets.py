@@ -0,0 +1,61 @@
+# coding=utf-8
+
+import os
+import time
+
+import bottle
+
+from foris.langs import translations
+from foris.utils import dynamic_assets
+
+
+def test_dynamic_assets(tmp_path, monkeypatch):
+    assets = tmp_path / "assets"
+    (assets / "config-0123456789abcdef").mkdir(parents=True)  # stale assets
+    templates = tmp_path / "templates"
+    (templates / "javascript").mkdir(parents=True)
+    (templates / "javascript" / "test.js.j2").write_text("var lang = '{{ lang() }}';")
+    monkeypatch.setattr(bottle, "TEMPLATE_PATH", [str(templates)])
+
+    dynamic_assets.reset("config", str(assets))
+
+    # directory is selected according to the script name
+    bottle.request.bind({"SCRIPT_NAME": "/foris", "bottle.app": bottle.Bottle()})
+    dynamic_assets.store_template("javascript/test.js", "en", "/foris")
+    target = dynamic_assets.assets_dir("/foris")
+    assert os.path.islink(str(assets / "config"))
+    assert os.readlink(str(assets / "config")) == os.path.basename(target)
+    assert not (assets / "config-0123456789abcdef").exists()
+    assert (assets / "config" / "en" / "javascript" / "test.js").read_text() == "var lang = 'en';"
+
+    # other languages are rendered in background
+    deadline = time.time() + 5
+    while len(dynamic_assets.dynamic_assets_map) < len(translations) and time.time() < deadline:
+        time.sleep(0.01)
+    for lang in translations:
+        path = assets / "config" / lang / "javascript" / "test.js"
+        assert path.read_text() == "var lang = '%s';" % lang
+
+    # assets are kept when nothing changes
+    dynamic_assets.reset("config", str(assets), warmup=False)
+    dynamic_assets.store_template("javascript/test.js", "en", "/foris")
+    assert dynamic_assets.assets_dir("/foris") == target
+    assert (assets / "config" / "cs" / "javascript" / "test.js").exists()
+
+    # assets of several script names are used at once (e.g. proxy and direct access)
+    bottle.request.bind({"SCRIPT_NAME": "/other", "bottle.app": bottle.Bottle()})
+    dynamic_assets.store_template("javascript/test.js", "en", "/other")
+    other_target = dynamic_assets.assets_dir("/other")
+    assert other_target != target
+    assert os.readlink(str(assets / "config")) == os.path.basename(target)
+    assert os.path.exists(os.path.join(target, "cs", "javascript", "test.js"))
+    assert os.path.exists(os.path.join(other_target, "en", "javascript", "test.js"))
+    assert not os.path.exists(os.path.join(other_target, "cs"))
+
+    # assets of another version are dropped
+    monkeypatch.setattr(dynamic_assets, "__version__", "0.0.0-test")
+    dynamic_assets.reset("config", str(assets), warmup=False)
+    dynamic_assets.store_template("javascript/test.js", "en", "/foris")
+    assert dynamic_assets.assets_dir("/foris") not in (target, other_target)
+    assert not os.path.exists(target)
+    assert not os.path.exists(other_target)
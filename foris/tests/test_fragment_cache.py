@@ -0,0 +1,32 @@
+# coding=utf-8
+
+import bottle
+import jinja2
+
+from foris.state import current_state
+from foris.utils.fragment_cache import FragmentCacheExtension, fragment_cache
+
+
+def test_fragment_cache():
+    bottle.request.bind({})
+    env = jinja2.Environment(extensions=[FragmentCacheExtension])
+    template = env.from_string('{% cache "test", page %}{{ page }}-{{ counter() }}{% endcache %}')
+    calls = []
+
+    def counter():
+        calls.append(None)
+        return len(calls)
+
+    fragment_cache.clear()
+    assert template.render(page="a", counter=counter) == "a-1"
+    assert template.render(page="a", counter=counter) == "a-1"
+    assert template.render(page="b", counter=counter) == "b-2"
+
+    # state change renders the fragment again
+    original_count = current_state.notification_count
+    current_state.update_notification_count(original_count + 1)
+    try:
+        assert template.render(page="a", counter=counter) == "a-3"
+    finally:
+        current_state.update_notification_count(original_count)
+    assert fragment_cache.hits == 1
@@ -0,0 +1,79 @@
+# coding=utf-8
+
+import io
+
+import bottle
+
+from foris.utils import messages
+
+
+class FakeSession(dict):
+    def __init__(self, *args, **kwargs):
+        super(FakeSession, self).__init__(*args, **kwargs)
+        self.writes = 0
+
+    def __setitem__(self, key, value):
+        self.writes += 1
+        super(FakeSession, self).__setitem__(key, value)
+
+
+def test_message_queue():
+    stored = {"text": "old", "level": list(messages.INFO), "extra_classes": []}
+    session = FakeSession({"_messages": [stored]})
+    bottle.request.bind({"foris.session": session})
+
+    messages.error("failed")
+    messages.warning("careful")
+    messages.success("done")
+    assert session.writes == 0
+
+    assert [e.text for e in messages.get_messages(min_level=messages.WARNING)] == [
+        "failed",
+        "careful",
+    ]
+    assert [e.text for e in messages.get_messages()] == ["old", "done"]
+    assert list(messages.get_messages()) == []
+
+    messages.info("next request")
+    messages.flush_messages(bottle.request.environ)
+    messages.flush_messages(bottle.request.environ)
+    assert session.writes == 1
+    assert [messages.Message.from_json(e).text for e in session["_messages"]] == ["next request"]
+
+
+def test_message_from_error_handler(tmpdir):
+    from foris.common import foris_403_handler
+    from foris.middleware.bottle_csrf import CSRFValidationError
+    from foris.middleware.sessions import SessionMiddleware
+    from foris.sessions import BaseSession, get_store
+
+    def form():
+        raise CSRFValidationError()
+
+    app = bottle.Bottle()
+    app.route("/", name="index", callback=lambda: "")
+    app.route("/form", method="POST", callback=form)
+    app.error_handler[403] = foris_403_handler
+    store = get_store("sqlite", path=str(tmpdir.join("sessions.db")))
+    wsgi_app = SessionMiddleware(app, 60, store=store)
+
+    statuses = []
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/form",
+        "SCRIPT_NAME": "",
+        "CONTENT_LENGTH": "0",
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.errors": io.StringIO(),
+    }
+    bottle.default_app.push(app)
+    try:
+        list(wsgi_app(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    finally:
+        bottle.default_app.pop()
+
+    assert statuses[0].startswith("302")
+    session = store.open(60, BaseSession.ANONYMOUS)
+    assert [messages.Message.from_json(e).text for e in session["_messages"]] == [
+        "You have been logged out due to longer inactivity."
+    ]
@@ -0,0 +1,115 @@
+# coding=utf-8
+
+import sys
+
+import bottle
+
+from foris.utils.metrics import Metrics, MetricsPlugin, instrument_templates, metrics
+
+
+def test_export():
+    m = Metrics()
+    labels = (("module", "wan"), ("action", "get_settings"))
+    m.observe("foris_backend_request_seconds", labels, 0.02)
+    m.observe("foris_backend_request_seconds", labels, 100)
+    m.inc("foris_backend_errors_total", labels)
+
+    text = m.to_prometheus()
+    assert "# TYPE foris_backend_request_seconds histogram" in text
+    assert (
+        'foris_backend_request_seconds_bucket{module="wan",action="get_settings",le="0.01"} 0'
+        in text
+    )
+    assert (
+        'foris_backend_request_seconds_bucket{module="wan",action="get_settings",le="0.025"} 1'
+        in text
+    )
+    assert (
+        'foris_backend_request_seconds_bucket{module="wan",action="get_settings",le="+Inf"} 2'
+        in text
+    )
+    assert 'foris_backend_request_seconds_count{module="wan",action="get_settings"} 2' in text
+    assert 'foris_backend_errors_total{module="wan",action="get_settings"} 1' in text
+
+    data = m.to_json()
+    assert data["foris_backend_errors_total"] == [
+        {"labels": {"module": "wan", "action": "get_settings"}, "value": 1}
+    ]
+    assert data["foris_backend_request_seconds"][0]["count"] == 2
+
+
+def test_instrumentation():
+    metrics.clear()
+    instrument_templates()
+    app = bottle.Bottle()
+    app.install(MetricsPlugin())
+    app.route("/page/<name>", callback=lambda name: bottle.template("hello {{name}}", name=name))
+
+    environ = {"PATH_INFO": "/page/x", "REQUEST_METHOD": "GET", "wsgi.errors": sys.stderr}
+    assert app(environ, lambda status, headers, exc_info=None: None) == [b"hello x"]
+
+    data = metrics.to_json()
+    assert data["foris_http_request_seconds"][0]["labels"] == {
+        "route": "/page/<name>",
+        "method": "GET",
+    }
+    assert data["foris_template_render_seconds"][0]["count"] == 1
+
+
+def test_server_timing(monkeypatch):
+    import bottle
+
+    from foris.middleware.server_timing import ServerTimingMiddleware
+    from foris.utils import timing
+
+    def app(environ, start_response):
+        timing.record("backend", 0.0123, "web.get_data")
+        start_response("200 OK", [("Content-Type", "text/html")])
+        return [b"<html><body></body></html>"]
+
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured.update(headers)
+
+    class Session(dict):
+        loaded = True
+        is_anonymous = False
+
+    # not sent to anonymous clients
+    monkeypatch.setattr(bottle, "DEBUG", False)
+    ServerTimingMiddleware(app)({}, start_response)
+    assert "Server-Timing" not in captured
+    ServerTimingMiddleware(app)({"foris.session": Session()}, start_response)
+    assert "Server-Timing" not in captured
+
+    ServerTimingMiddleware(app)({"foris.session": Session(user_authenticated=True)}, start_response)
+    assert captured["Server-Timing"].startswith('backend;dur=12.3;desc="web.get_data", total;dur=')
+
+    body = b"".join(ServerTimingMiddleware(app, debug_panel=True)({}, start_response))
+    assert b"foris-server-timing" in body
+    assert captured["Content-Length"] == str(len(body))
+    assert timing.current() is None
+
+
+def test_server_timing_panel_write_and_close():
+    from foris.middleware.server_timing import ServerTimingMiddleware
+
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            return iter([b"</body></html>"])
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        write = start_response("200 OK", [("Content-Type", "text/html")])
+        write(b"<html><body>")
+        return Body()
+
+    body = b"".join(ServerTimingMiddleware(app, debug_panel=True)({}, lambda *args: None))
+    assert body.startswith(b"<html><body>")
+    assert b"foris-server-timing" in body
+    assert closed == [True]
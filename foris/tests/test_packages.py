@@ -0,0 +1,56 @@
+# coding=utf-8
+
+import pytest
+
+from foris.utils import packages
+
+
+def test_distribution_index():
+    index = packages.get_index()
+    assert packages.get_index() is index
+
+    assert packages.distribution_version("pytest") == pytest.__version__
+    assert packages.distribution_version("PyTest") == pytest.__version__
+    assert packages.distribution_version("foris_nonexisting_plugin") is None
+    assert "pytest" in [e.name for e in packages.iter_entry_points("console_scripts")]
+    assert list(packages.iter_entry_points("nonexisting_group")) == []
+
+    packages.reload_index()
+    assert packages.get_index() is not index
+
+
+def test_always_on_reasons(monkeypatch):
+    from foris.config_handlers import updater
+
+    calls = []
+
+    class EntryPoint(object):
+        name = "test"
+
+        def load(self):
+            def reason():
+                calls.append(None)
+                return "managed"
+
+            return reason
+
+    monkeypatch.setattr(packages, "iter_entry_points", lambda group: iter([EntryPoint()]))
+    updater.reload_always_on_reasons()
+    try:
+        assert updater.get_always_on_reasons() == ["managed"]
+        assert updater.get_always_on_reasons() == ["managed"]
+        assert len(calls) == 1
+
+        updater.reload_always_on_reasons()
+        assert updater.get_always_on_reasons() == ["managed"]
+        assert len(calls) == 2
+
+        # updater could have installed some packages
+        updater.handle_notification("wan")
+        assert updater.get_always_on_reasons() == ["managed"]
+        assert len(calls) == 2
+        updater.handle_notification("updater")
+        assert updater.get_always_on_reasons() == ["managed"]
+        assert len(calls) == 3
+    finally:
+        updater.reload_always_on_reasons()
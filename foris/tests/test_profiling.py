@@ -0,0 +1,45 @@
+# coding=utf-8
+
+import json
+import sys
+
+from foris import profiling
+
+
+def test_startup_profiler(tmpdir):
+    tmpdir.join("profiled_outer.py").write("import time\ntime.sleep(0.01)\nimport profiled_inner\n")
+    tmpdir.join("profiled_inner.py").write("import time\ntime.sleep(0.02)\n")
+    sys.path.insert(0, str(tmpdir))
+
+    profiler = profiling.StartupProfiler()
+    profiler.start()
+    try:
+        with profiler.phase("outer"):
+            with profiler.phase("inner"):
+                import profiled_outer  # noqa: F401
+    finally:
+        profiler.stop()
+        sys.path.remove(str(tmpdir))
+        sys.modules.pop("profiled_outer", None)
+        sys.modules.pop("profiled_inner", None)
+
+    assert profiler._finder not in sys.meta_path
+    assert [(name, depth) for name, depth, _ in profiler.phases] == [("outer", 0), ("inner", 1)]
+
+    outer = [e for e in profiler.imports.children if e.name == "profiled_outer"][0]
+    assert [e.name for e in outer.children] == ["profiled_inner"]
+    assert outer.duration >= 0.03
+    assert 0.01 <= outer.self_duration < outer.duration
+    assert "profiled_inner" in profiler.report()
+
+    summary = profiler.to_dict()
+    path = str(tmpdir.join("baseline.json"))
+    assert profiling.check_baseline(path, summary) is None
+    assert profiling.check_baseline(path, summary) == []
+
+    with open(path) as f:
+        baseline = json.load(f)
+    baseline["imports"]["profiled_inner"] = 0.001
+    regressions = profiling.compare(summary, baseline)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("import profiled_inner")
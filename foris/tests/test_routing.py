@@ -0,0 +1,138 @@
+# coding=utf-8
+
+import hashlib
+
+import bottle
+
+from foris.utils import routing, static_manifest
+
+
+def test_reverse():
+    app = bottle.Bottle()
+    sub = bottle.Bottle()
+    app.route("/", name="index", callback=lambda: "")
+    sub.route("/page/<page_name>/", name="page", callback=lambda page_name: "")
+    sub.route("/about", name="about", callback=lambda: "")
+    app.mount("/main", sub)
+    bottle.default_app.push(app)
+    try:
+        bottle.request.bind({"SCRIPT_NAME": "/foris", "PATH_INFO": "/"})
+        bottle.request.environ["bottle.app"] = app
+        assert routing.reverse("index") == "/foris/"
+        assert routing.reverse("about") == "/foris/main/about"
+        assert routing.reverse("about") == "/foris/main/about"
+        assert routing.reverse("page", page_name="x") == "/foris/main/page/x/"
+        sub.route("/late", name="late", callback=lambda: "")
+        assert routing.reverse("late") == "/foris/main/late"
+        index = routing._route_index
+        for _ in range(2):
+            try:
+                routing.reverse("missing")
+            except bottle.RouteBuildError:
+                pass
+            else:
+                assert False
+        # nothing was added since the last rebuild
+        assert routing._route_index is index
+    finally:
+        bottle.default_app.pop()
+
+
+def test_static_manifest(tmp_path, monkeypatch):
+    static_dir = tmp_path / "static"
+    (static_dir / "css").mkdir(parents=True)
+    (static_dir / "css" / "screen.css").write_text("body {}")
+    static_manifest.build_manifest(str(static_dir), fingerprint=True)
+    digest = static_manifest.file_digest(str(static_dir / "css" / "screen.css"))
+
+    monkeypatch.setattr(routing, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(routing, "static_md5_map", {})
+    monkeypatch.setattr(routing, "static_fingerprinted", set())
+    routing.load_static_manifests()
+    bottle.request.bind({"SCRIPT_NAME": "/foris", "bottle.app": bottle.Bottle()})
+
+    url = "/foris/static/css/screen.%s.css" % digest[: static_manifest.FINGERPRINT_LENGTH]
+    assert routing.static("css/screen.css") == url
+    assert (tmp_path / url[len("/foris/") :]).exists()
+
+    # files missing in the manifest are hashed
+    (static_dir / "new.js").write_text("")
+    assert routing.static("new.js") == "/foris/static/new.js?md5=%s" % hashlib.md5().hexdigest()
+
+    # files changed after the manifest was written (e.g. upgraded plugin) are hashed
+    (static_dir / "css" / "screen.css").write_text("body { color: red; }")
+    monkeypatch.setattr(routing, "static_md5_map", {})
+    monkeypatch.setattr(routing, "static_fingerprinted", set())
+    routing.load_static_manifests()
+    digest = hashlib.md5(b"body { color: red; }").hexdigest()
+    assert routing.static("css/screen.css") == "/foris/static/css/screen.css?md5=%s" % digest
+
+
+def test_static_handler(tmp_path, monkeypatch):
+    from foris import common
+
+    static_dir = tmp_path / "static"
+    (static_dir / "css").mkdir(parents=True)
+    (static_dir / "css" / "screen.css").write_text("body { color: black; }\n" * 100)
+    static_manifest.build_manifest(str(static_dir), compress=True)
+    assert (static_dir / "css" / "screen.css.gz").exists()
+
+    monkeypatch.setattr(routing, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(common, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(routing, "static_md5_map", {})
+    routing.load_static_manifests()
+
+    # only the arguments supported by bottle 0.12 are used
+    static_file = bottle.static_file
+    monkeypatch.setattr(
+        bottle,
+        "static_file",
+        lambda filename, root, mimetype="auto", download=False, charset="UTF-8": static_file(
+            filename, root, mimetype=mimetype, download=download, charset=charset
+        ),
+    )
+
+    bottle.request.bind({"HTTP_ACCEPT_ENCODING": "gzip, deflate", "bottle.app": bottle.Bottle()})
+    response = common.static("css/screen.css")
+    assert response.status_code == 200
+    assert response.get_header("Content-Encoding") == "gzip"
+    assert response.get_header("Content-Type").startswith("text/css")
+    assert response.get_header("Cache-Control") == "public, max-age=31536000"
+    assert response.get_header("Vary") == "Accept-Encoding"
+    assert len([e for e in response.headerlist if e[0] == "Etag"]) == 1
+    etag = response.get_header("ETag")
+    assert etag.endswith('-gzip"')
+    response.body.close()
+
+    bottle.request.bind({"HTTP_IF_NONE_MATCH": etag, "HTTP_ACCEPT_ENCODING": "gzip"})
+    assert common.static("css/screen.css").status_code == 304
+
+    bottle.request.bind({"HTTP_ACCEPT_ENCODING": "gzip;q=0"})
+    response = common.static("css/screen.css")
+    assert response.get_header("Content-Encoding") is None
+    assert response.get_header("ETag") != etag
+    response.body.close()
+
+
+def test_static_handler_outside_root(tmp_path, monkeypatch):
+    from foris import common
+
+    (tmp_path / "static").mkdir()
+    (tmp_path / "secret").write_text("secret")
+    (tmp_path / "static" / "unlisted.js").write_text("")
+
+    monkeypatch.setattr(routing, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(common, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(routing, "static_md5_map", {})
+    routing.load_static_manifests()
+
+    for path in ["../secret", "../missing", "css/../../secret"]:
+        bottle.request.bind({"HTTP_IF_NONE_MATCH": "*", "bottle.app": bottle.Bottle()})
+        assert common.static(path).status_code == 403
+
+    # files which are not in the manifest are not hashed
+    bottle.request.bind({"bottle.app": bottle.Bottle()})
+    response = common.static("unlisted.js")
+    assert response.status_code == 200
+    response.body.close()
+    assert routing.static_md5_map == {}
@@ -0,0 +1,151 @@
+# coding=utf-8
+
+import time
+
+import pytest
+
+from foris.sessions import BaseSession, SessionNotFound, get_store
+
+TIMEOUT = 60
+
+
+@pytest.fixture(params=["sqlite", "cookie"])
+def store(request, tmpdir):
+    if request.param == "sqlite":
+        return get_store("sqlite", path=str(tmpdir.join("sessions.db")))
+    return get_store("cookie", secret=b"secret")
+
+
+def test_save_and_obtain(store):
+    session = store.open(TIMEOUT)
+    assert not session.anonymous
+    session["test1"] = 1
+    session["test2"] = {"key": "value"}
+    session.save()
+
+    session = store.open(TIMEOUT, session.session_id)
+    assert sorted(session) == ["test1", "test2"]
+    assert session["test2"] == {"key": "value"}
+
+    del session["test1"]
+    session.save()
+    session = store.open(TIMEOUT, session.session_id)
+    assert sorted(session) == ["test2"]
+
+
+def test_anonymous(store):
+    session = store.open(TIMEOUT, BaseSession.ANONYMOUS)
+    assert session.anonymous
+    session.filtered_keys = ["user_authenticated"]
+    session["user_authenticated"] = True
+    session["csrf_token"] = "token"
+    session.save()
+
+    session = store.open(TIMEOUT, session.session_id)
+    assert session.anonymous
+    assert "user_authenticated" not in session
+    assert session["csrf_token"] == "token"
+
+
+def test_expired(store):
+    session = store.open(0.01)
+    session.save()
+    time.sleep(0.02)
+    with pytest.raises(SessionNotFound):
+        store.open(TIMEOUT, session.session_id)
+
+
+def test_sqlite_destroy(tmpdir):
+    store = get_store("sqlite", path=str(tmpdir.join("sessions.db")))
+    session = store.open(TIMEOUT)
+    session.destroy()
+    with pytest.raises(SessionNotFound):
+        store.open(TIMEOUT, session.session_id)
+
+
+def test_cookie_signature():
+    store = get_store("cookie", secret=b"secret")
+    session = store.open(TIMEOUT)
+    session["user_authenticated"] = True
+    session.save()
+
+    payload, signature = session.session_id.split(".")
+    with pytest.raises(SessionNotFound):
+        store.open(TIMEOUT, payload + "." + "0" * len(signature))
+    with pytest.raises(SessionNotFound):
+        get_store("cookie", secret=b"other").open(TIMEOUT, session.session_id)
+
+
+def test_lazy_loading(tmpdir):
+    from foris.middleware.sessions import SessionMiddleware
+
+    opened = []
+    store = get_store("sqlite", path=str(tmpdir.join("sessions.db")))
+    open_session = store.open
+
+    def counting_open(timeout, session_id=None):
+        opened.append(session_id)
+        return open_session(timeout, session_id)
+
+    store.open = counting_open
+
+    environs = []
+
+    def app(environ, start_response):
+        environs.append(environ)
+        if environ["PATH_INFO"] == "/login":
+            session = environ["foris.session"]
+            session.recreate()
+            session["user_authenticated"] = True
+        start_response("200 OK", [])
+        return [b""]
+
+    headers = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        headers.clear()
+        headers.update(response_headers)
+
+    middleware = SessionMiddleware(app, TIMEOUT, store=store)
+    middleware({"PATH_INFO": "/static/img/logo.png"}, start_response)
+    assert opened == [] and headers == {}
+
+    middleware({"PATH_INFO": "/login"}, start_response)
+    assert opened and "foris.session=" in headers["Set-cookie"]
+
+    # compatibility environ keys
+    environ = environs[-1]
+    assert environ["foris.session.id"] == environ["foris.session"].session_id
+    assert environ["foris.session.data"]["user_authenticated"] is True
+
+
+def test_hmac_csrf_token(monkeypatch):
+    import bottle
+
+    from foris.middleware import bottle_csrf
+    from foris.middleware.sessions import SessionForisProxy
+
+    monkeypatch.setattr(bottle_csrf, "settings", bottle_csrf.CSRFSettings())
+    bottle_csrf.settings.configure("hmac", b"secret", 60)
+
+    def bind(session_id):
+        session = SessionForisProxy(None, "foris.session", TIMEOUT, session_id)
+        bottle.request.bind({"foris.session": session})
+        return session
+
+    bind("session1")
+    token = bottle_csrf.get_csrf_token()
+    assert bottle_csrf.validate_csrf_token(token)
+    assert not bottle_csrf.validate_csrf_token(token[:-1] + "x")
+    assert not bottle_csrf.validate_csrf_token("garbage")
+
+    # tokens of the previous bucket are still valid
+    bucket = int(token.split("-")[0])
+    monkeypatch.setattr(bottle_csrf, "_current_bucket", lambda: bucket + 1)
+    assert bottle_csrf.validate_csrf_token(token)
+    monkeypatch.setattr(bottle_csrf, "_current_bucket", lambda: bucket + 2)
+    assert not bottle_csrf.validate_csrf_token(token)
+
+    bind("session2")
+    monkeypatch.setattr(bottle_csrf, "_current_bucket", lambda: bucket)
+    assert not bottle_csrf.validate_csrf_token(token)
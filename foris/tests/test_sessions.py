@@ -2,6 +2,7 @@
 
 import pytest
 
+from foris.ubus import sessions
 from foris.ubus.sessions import UbusSession, SessionDestroyed, SessionNotFound, SessionReadOnly
 
 TIMEOUT = 60
@@ -168,3 +169,64 @@ def test_readonly():
 
     with pytest.raises(SessionReadOnly):
         del session["key"]
+
+
+def test_legacy_format():
+    session = UbusSession(TIMEOUT)
+    session_id = session.session_id
+    sessions.call(
+        "session",
+        "set",
+        {"ubus_rpc_session": session_id, "values": {"foris": {"test1": 1, "test2": "2"}}},
+    )
+    try:
+        session = UbusSession(TIMEOUT, session_id)
+        assert sorted(session) == ["test1", "test2"] and session["test1"] == 1
+
+        # converted to the new format when saved
+        session["test3"] = True
+        session.save()
+        values = sessions.call("session", "list", {"ubus_rpc_session": session_id})[0]["data"]
+        assert sessions.LEGACY_KEY not in values
+        assert values["foris_test1"] == 1 and values["foris_test3"] is True
+
+        session = UbusSession(TIMEOUT, session_id)
+        assert sorted(session) == ["test1", "test2", "test3"]
+    finally:
+        session.destroy()
+
+
+@pytest.fixture
+def cache_fixture():
+    sessions.session_cache.enable()
+    yield sessions.session_cache
+    sessions.session_cache.disable()
+
+
+def test_cache(session_fixture, cache_fixture, monkeypatch):
+    calls = []
+    call = sessions.call
+
+    def counting_call(obj, func, params):
+        calls.append(func)
+        return call(obj, func, params)
+
+    monkeypatch.setattr(sessions, "call", counting_call)
+
+    session = UbusSession(TIMEOUT, session_fixture)
+    session["test1"] = 0
+    del session["test2"]
+    session.save()
+
+    # obtained from the cache (changes are written in background)
+    session = UbusSession(TIMEOUT, session_fixture)
+    assert session["test1"] == 0 and "test2" not in session
+    assert calls.count("list") == 1
+
+    # only the changes were sent
+    cache_fixture.flush()
+    assert calls[0] == "list" and sorted(calls[1:]) == ["set", "unset"]
+    cache_fixture.remove(session_fixture)
+
+    session = UbusSession(TIMEOUT, session_fixture)
+    assert sorted(session) == ["test1", "test3"]
@@ -0,0 +1,157 @@
+# coding=utf-8
+
+import gettext
+import struct
+
+from foris.state import current_state
+from foris.utils import translators
+
+
+def write_mo(path, messages):
+    """Writes a minimal .mo file (originals are sorted as msgfmt does)"""
+    items = sorted((k.encode("utf-8"), v.encode("utf-8")) for k, v in messages.items())
+    keys_start = 28 + 16 * len(items)
+    keys = b"".join(k + b"\0" for k, _ in items)
+    values = b"".join(v + b"\0" for _, v in items)
+    originals, translations = [], []
+    offset = keys_start
+    for key, _ in items:
+        originals.append((len(key), offset))
+        offset += len(key) + 1
+    for _, value in items:
+        translations.append((len(value), offset))
+        offset += len(value) + 1
+
+    header = struct.pack("<7I", 0x950412DE, 0, len(items), 28, 28 + 8 * len(items), 0, 0)
+    tables = b"".join(struct.pack("<2I", *e) for e in originals + translations)
+    with open(path, "wb") as f:
+        f.write(header + tables + keys + values)
+
+
+def test_mmap_catalog(tmp_path):
+    path = str(tmp_path / "messages.mo")
+    write_mo(
+        path,
+        {
+            "": "Content-Type: text/plain; charset=UTF-8\n"
+            "Plural-Forms: nplurals=3; plural=(n==1) ? 0 : (n>=2 && n<=4) ? 1 : 2;\n",
+            "Language": "Jazyk",
+            "%d file\0%d files": "%d soubor\0%d soubory\0%d souborů",
+            "menu\x04Save": "Uložit",
+        },
+    )
+    expected = gettext.GNUTranslations(open(path, "rb"))
+    catalog = translators.MmapCatalog(path)
+    assert sorted(translators.catalog_messages(catalog)) == sorted(
+        translators.catalog_messages(expected)
+    )
+
+    translation = translators.MergedTranslations([("test", catalog)])
+    for message in ["Language", "Unknown", "Save"]:
+        assert translation.gettext(message) == expected.gettext(message)
+    for n in [1, 3, 7]:
+        assert translation.ngettext("%d file", "%d files", n) == expected.ngettext(
+            "%d file", "%d files", n
+        )
+    assert translation.pgettext("menu", "Save") == "Uložit"
+
+
+def test_lazy_translations(tmp_path, monkeypatch):
+    for lang in ["cs", "de"]:
+        (tmp_path / lang / "LC_MESSAGES").mkdir(parents=True)
+        write_mo(str(tmp_path / lang / "LC_MESSAGES" / "messages.mo"), {"Yes": "Yes-" + lang})
+    monkeypatch.setattr(translators.LazyTranslations, "MAX_LOADED", 1)
+    translations = translators.LazyTranslations(["en", "cs", "de"], str(tmp_path))
+
+    assert list(translations) == ["en", "cs", "de"] and "cs" in translations
+    assert translations["cs"].gettext("Yes") == "Yes-cs"
+    assert translations["xx"].gettext("Yes") == "Yes"
+    assert translations["de"].gettext("Yes") == "Yes-de"
+    assert len(translations._loaded) == 1
+
+    plugin_dir = tmp_path / "plugin"
+    (plugin_dir / "de" / "LC_MESSAGES").mkdir(parents=True)
+    write_mo(str(plugin_dir / "de" / "LC_MESSAGES" / "messages.mo"), {"No": "Nein"})
+    translations.add_locale_dir(str(plugin_dir))
+    assert translations["de"].gettext("No") == "Nein"
+
+    # languages loaded in a transient block don't evict the cached ones
+    assert translations["cs"].gettext("Yes") == "Yes-cs"
+    with translations.transient():
+        assert translations["de"].gettext("Yes") == "Yes-de"
+        assert translations["cs"].gettext("Yes") == "Yes-cs"
+    assert list(translations._loaded) == ["cs"]
+
+
+def test_merged_translations(tmp_path):
+    catalogs = {
+        "core": {"Yes": "Ano", "Save": "Uložit"},
+        "plugin1": {"Save": "Uložit změny", "Open": "Otevřít"},
+        "plugin2": {"Open": "Otevřít", "Close": "Zavřít"},
+    }
+    for name, messages in catalogs.items():
+        (tmp_path / name / "cs" / "LC_MESSAGES").mkdir(parents=True)
+        write_mo(str(tmp_path / name / "cs" / "LC_MESSAGES" / "messages.mo"), messages)
+
+    translations = translators.LazyTranslations(["en", "cs"], str(tmp_path / "core"))
+    translations.add_locale_dir(str(tmp_path / "plugin1"))
+    translations.add_locale_dir(str(tmp_path / "plugin2"))
+
+    translation = translations["cs"]
+    assert [translation.gettext(e) for e in ["Yes", "Save", "Open", "Close", "No"]] == [
+        "Ano",
+        "Uložit",
+        "Otevřít",
+        "Zavřít",
+        "No",
+    ]
+    assert translations.conflicts("cs") == [
+        ("Save", str(tmp_path / "core"), str(tmp_path / "plugin1"))
+    ]
+
+
+def test_delayed_strings(tmp_path, monkeypatch):
+    (tmp_path / "cs" / "LC_MESSAGES").mkdir(parents=True)
+    write_mo(
+        str(tmp_path / "cs" / "LC_MESSAGES" / "messages.mo"),
+        {"Hello %s": "Ahoj %s", "world": "světe", "{0} items": "{0} položek"},
+    )
+    translations = translators.LazyTranslations(["en", "cs"], str(tmp_path))
+    monkeypatch.setattr(translators, "translations", translations)
+
+    hello = translators.gettext_dummy("Hello %s")
+    assert translators.gettext_dummy("Hello %s") is hello
+    greeting = translators.delayed_concat(hello % translators.gettext_dummy("world"), "!")
+    count = translators.gettext_dummy("{0} items").format(3)
+
+    with current_state.local_language("cs"):
+        assert str(greeting) == "Ahoj světe!"
+        assert str(count) == "3 položek"
+        # + renders the string right away
+        concatenated = "> " + translators.gettext_dummy("world") + "!"
+        assert isinstance(concatenated, str) and concatenated == "> světe!"
+    with current_state.local_language("en"):
+        assert str(greeting) == "Hello world!"
+
+    # cached translation is dropped when the catalogs change
+    (tmp_path / "plugin" / "cs" / "LC_MESSAGES").mkdir(parents=True)
+    translations.add_locale_dir(str(tmp_path / "plugin"))
+    monkeypatch.setattr(translations, "_load", lambda lang: translators.NullTranslations())
+    with current_state.local_language("cs"):
+        assert str(greeting) == "Hello world!"
+
+
+def test_guide_messages(monkeypatch):
+    from foris import guide
+
+    monkeypatch.setattr(guide, "_rendered_messages", {})
+    with current_state.local_language("en"):
+        message = guide.get_guide_messages("password", True, guide.WORKFLOW_ROUTER)
+        assert message == [str(e) for e in guide.MessageRouter.PASSWORD_CURRENT]
+        assert guide.get_guide_messages("password", True, guide.WORKFLOW_ROUTER) is message
+
+    # messages of the previous catalogs are dropped
+    monkeypatch.setattr(translators.translations, "generation", -1)
+    with current_state.local_language("cs"):
+        guide.get_guide_messages("password", True, guide.WORKFLOW_ROUTER)
+    assert list(guide._rendered_messages) == [(guide.WORKFLOW_ROUTER, "cs")]
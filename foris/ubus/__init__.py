@@ -19,9 +19,14 @@ from __future__ import absolute_import
 import ubus
 import logging
 import json
+import threading
 
 logger = logging.getLogger("ubus")
 
+# ubus connection can't be used from more threads at the same time
+# (it is shared with the ubus backend see foris.backend.Backend)
+lock = threading.Lock()
+
 
 if not ubus.get_connected():
     logger.debug("Connecting to ubus.")
@@ -30,4 +35,15 @@ if not ubus.get_connected():
 
 def call(obj, func, params):
     logger.debug("Calling function '%s'.'%s' with params '%s'" % (obj, func, json.dumps(params)))
-    return ubus.call(obj, func, params)
+    with lock:
+        return ubus.call(obj, func, params)
+
+
+def reconnect():
+    """ Opens a new ubus connection (the connection can't be shared with forked processes)
+    """
+    with lock:
+        if ubus.get_connected():
+            ubus.disconnect()
+        logger.debug("Reconnecting to ubus.")
+        ubus.connect()
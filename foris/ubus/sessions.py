@@ -1,92 +1,314 @@
+import atexit
+import json
 import logging
+import threading
+import time
 
 from . import call
-from json import JSONEncoder
 
-logger = logging.getLogger("ubus.sessions")
-
-
-class SessionNotFound(Exception):
-    pass
-
-
-class SessionFailedToCreate(Exception):
-    pass
-
-
-class SessionDestroyed(Exception):
-    pass
-
-
-class SessionReadOnly(Exception):
-    pass
-
-
-def not_destroyed(func):
-    def wrapped(self, *args, **kwargs):
-        if self.destroyed:
-            raise SessionDestroyed()
-        return func(self, *args, **kwargs)
+from foris.sessions import (  # noqa: F401 (exceptions are re-exported)
+    BaseSession,
+    SessionDestroyed,
+    SessionFailedToCreate,
+    SessionNotFound,
+    SessionReadOnly,
+    not_destroyed,
+    not_readonly,
+)
+from foris.utils import timing
 
-    return wrapped
-
-
-def not_readonly(func):
-    def wrapped(self, *args, **kwargs):
-        if self.readonly:
-            raise SessionReadOnly()
-        return func(self, *args, **kwargs)
-
-    return wrapped
+logger = logging.getLogger("ubus.sessions")
 
 
-class UbusSession(object):
-    ANONYMOUS = "00000000000000000000000000000000"
+# each key of foris session data is stored as a separate ubus session value
+# so that only the keys which were changed need to be sent
+KEY_PREFIX = "foris_"
+# all session data used to be stored as a single value
+# Sessions in this format are still read, but they are converted to the new format when
+# they are saved. Older versions of foris (and other readers of the 'foris' value)
+# don't see the data of the converted sessions (i.e. the user has to log in again).
+LEGACY_KEY = "foris"
+
+
+def _copy(data):
+    return json.loads(json.dumps(data))
+
+
+def _store_delta(session_id, synced, data, legacy=False):
+    """ Sends only the keys which differ from the data which are stored in ubus
+
+    :param synced: data which are stored in ubus
+    :param data: new data
+    :param legacy: data are stored in the legacy format as well (should be removed)
+    """
+    changed = {KEY_PREFIX + k: v for k, v in data.items() if k not in synced or synced[k] != v}
+    removed = [KEY_PREFIX + k for k in synced if k not in data]
+    if legacy:
+        removed.append(LEGACY_KEY)
+
+    with timing.measure("session", "save"):
+        if changed:
+            call("session", "set", {"ubus_rpc_session": session_id, "values": changed})
+        if removed:
+            call("session", "unset", {"ubus_rpc_session": session_id, "keys": removed})
+    logger.debug(
+        "foris session '%s' stored (changed %s, removed %s)"
+        % (session_id, sorted(changed), sorted(removed))
+    )
+
+
+class CachedSession(object):
+    __slots__ = ("data", "synced", "legacy", "expires_in", "expires_at", "renewed_at")
+
+    def __init__(self, data, synced, legacy, expires_in):
+        self.data = data
+        self.synced = synced
+        self.legacy = legacy
+        self.renewed(expires_in)
+
+    def renewed(self, expires_in):
+        self.expires_in = expires_in
+        self.renewed_at = time.monotonic()
+        # 0 means that the session never expires (e.g. anonymous session)
+        self.expires_at = self.renewed_at + expires_in if expires_in else None
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() > self.expires_at
+
+
+class SessionCache(object):
+    """ In-process cache of the session data
+
+    Obtaining a cached session doesn't require any ubus call, the session
+    is only renewed (in ubus) once in RENEW_INTERVAL. Expiration of the session
+    is tracked locally according to `expires_in` of the last renewal.
+
+    Saved data are written to ubus later in a background thread
+    (only the changed keys are sent).
+
+    Cache should be enabled only when the requests are processed within a single process,
+    otherwise the data could get out of sync with the other processes.
+    """
+
+    RENEW_INTERVAL = 60  # in seconds
+
+    def __init__(self):
+        self.enabled = False
+        self._sessions = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._dirty_cond = threading.Condition(self._lock)
+        self._writing = 0  # number of sessions which are being written right now
+        self._written_cond = threading.Condition(self._lock)
+        self._writer = None
+
+    def enable(self):
+        self.enabled = True
+        # don't lose the changes which were not written yet
+        atexit.register(self.flush)
+
+    def disable(self):
+        """ Stores pending changes, stops the background writer and drops cached sessions
+        """
+        self.enabled = False
+        atexit.unregister(self.flush)
+        self.flush()
+        with self._lock:
+            writer, self._writer = self._writer, None
+            self._dirty_cond.notify_all()
+        if writer:
+            writer.join()
+        with self._lock:
+            self._sessions.clear()
+            self._dirty.clear()
+
+    def get(self, session_id):
+        """ Returns cached session
+
+        :returns: (data, expires_in, renew_needed) or None when not cached
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.expired:
+                logger.debug("Cached session '%s' expired." % session_id)
+                self._sessions.pop(session_id)
+                self._dirty.discard(session_id)
+                return None
+            renew_needed = (
+                session.expires_at is not None
+                and time.monotonic() - session.renewed_at > self.RENEW_INTERVAL
+            )
+            return _copy(session.data), session.expires_in, renew_needed
+
+    def put(self, session_id, data, expires_in, legacy=False):
+        """ Caches session data which were obtained from ubus
+        """
+        with self._lock:
+            # drop expired sessions
+            for expired_id in [k for k, v in self._sessions.items() if v.expired]:
+                if expired_id not in self._dirty:
+                    del self._sessions[expired_id]
+            self._sessions[session_id] = CachedSession(_copy(data), _copy(data), legacy, expires_in)
+
+    def renewed(self, session_id, expires_in):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.renewed(expires_in)
+
+    def update(self, session_id, data):
+        """ Updates data of a cached session, data will be stored to ubus later
+
+        :returns: False if the session is not cached
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            session.data = _copy(data)
+            self._dirty.add(session_id)
+            self._dirty_cond.notify()
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="foris-session-writer")
+                self._writer.daemon = True
+                self._writer.start()
+        return True
 
+    def remove(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._dirty.discard(session_id)
+
+    def flush(self):
+        """ Stores all pending changes to ubus
+
+        It returns after the changes which are being written by another thread are stored too.
+        """
+        while True:
+            with self._lock:
+                if not self._dirty:
+                    while self._writing:
+                        self._written_cond.wait()
+                    return
+                session_id = self._dirty.pop()
+                session = self._sessions.get(session_id)
+                if session is None:
+                    continue
+                synced, data, legacy = session.synced, _copy(session.data), session.legacy
+                session.synced, session.legacy = data, False
+                self._writing += 1
+            try:
+                _store_delta(session_id, synced, data, legacy)
+            except RuntimeError:
+                logger.warning("Failed to store data of session '%s'." % session_id)
+                self.remove(session_id)
+            finally:
+                with self._lock:
+                    self._writing -= 1
+                    self._written_cond.notify_all()
+
+    def _write(self):
+        writer = threading.current_thread()
+        while True:
+            with self._lock:
+                while not self._dirty and self._writer is writer:
+                    self._dirty_cond.wait()
+                if self._writer is not writer:
+                    return  # disabled
+            self.flush()
+
+
+session_cache = SessionCache()
+
+
+class UbusSession(BaseSession):
     def _load_data(self, data):
         self.session_id = data["ubus_rpc_session"]
-        self._data = data["data"].get("foris", {})
+        values = data["data"]
+        self._legacy = LEGACY_KEY in values
+        self._data = dict(values.get(LEGACY_KEY, {}))
+        self._data.update(
+            {k[len(KEY_PREFIX) :]: v for k, v in values.items() if k.startswith(KEY_PREFIX)}
+        )
+        self._synced = {} if self._legacy else _copy(self._data)
         self.expires_in = data["expires"]
 
     def _create(self, timeout):
         try:
-            res = call("session", "create", {"timeout": timeout})
+            with timing.measure("session", "create"):
+                res = call("session", "create", {"timeout": timeout})
             self._load_data(res[0])
+            if session_cache.enabled:
+                session_cache.put(self.session_id, self._data, self.expires_in)
             logger.debug("Session '%s' created: %s" % (self.session_id, repr(res)))
         except RuntimeError:
             logger.debug("Failed to create a session.")
             raise SessionFailedToCreate()
 
     def _obtain(self, session_id):
+        cached = session_cache.get(session_id) if session_cache.enabled else None
+        if cached:
+            self.session_id = session_id
+            self._data, self.expires_in, renew_needed = cached
+            self._synced = None  # stored by the cache
+            self._legacy = False
+            logger.debug("session '%s' obtained from cache" % session_id)
+            if renew_needed:
+                self._renew()
+            return
+
         try:
             # This will renew session -> expires will be delayed
-            res = call("session", "list", {"ubus_rpc_session": session_id})
+            with timing.measure("session", "obtain"):
+                res = call("session", "list", {"ubus_rpc_session": session_id})
             logger.debug("session '%s' obtained: %s" % (session_id, repr(res)))
             self._load_data(res[0])
         except RuntimeError:
             logger.debug("session '%s' not found." % session_id)
             raise SessionNotFound()
 
-    def __init__(self, timeout, session_id=None):
-        if not session_id:
-            self._create(timeout)
-        else:
-            self._obtain(session_id)
-        self.destroyed = False
-        self.readonly = False
-        self.filtered_keys = []
+        if session_cache.enabled:
+            session_cache.put(self.session_id, self._data, self.expires_in, self._legacy)
+
+    def _renew(self):
+        """ Renews the session in ubus without obtaining its data
+        """
+        try:
+            # any access to the session delays its expiration
+            with timing.measure("session", "renew"):
+                call(
+                    "session",
+                    "access",
+                    {
+                        "ubus_rpc_session": self.session_id,
+                        "scope": "ubus",
+                        "object": "session",
+                        "function": "access",
+                    },
+                )
+            session_cache.renewed(self.session_id, self.expires_in)
+            logger.debug("session '%s' renewed" % self.session_id)
+        except RuntimeError:
+            logger.debug("session '%s' not found." % self.session_id)
+            session_cache.remove(self.session_id)
+            raise SessionNotFound()
 
     @not_readonly
     @not_destroyed
     def save(self):
+        filtered_data = self._filtered_data()
+        if session_cache.enabled and session_cache.update(self.session_id, filtered_data):
+            # data will be stored to ubus by the cache
+            logger.debug("foris session '%s' cached: %s" % (self.session_id, filtered_data))
+            return True
+
         try:
-            filtered_data = {k: v for k, v in self._data.items() if k not in self.filtered_keys}
-            call(
-                "session",
-                "set",
-                {"ubus_rpc_session": self.session_id, "values": {"foris": filtered_data}},
-            )
-            logger.debug("foris session '%s' stored: %s" % (self.session_id, filtered_data))
+            synced = self._synced if self._synced is not None else {}
+            _store_delta(self.session_id, synced, filtered_data, self._legacy)
+            self._synced, self._legacy = _copy(filtered_data), False
         except RuntimeError:
             logger.debug("Failed to store session data.")
             return False
@@ -96,6 +318,7 @@ class UbusSession(object):
     @not_readonly
     @not_destroyed
     def destroy(self):
+        session_cache.remove(self.session_id)
         try:
             call("session", "destroy", {"ubus_rpc_session": self.session_id})
             logger.debug("foris session destroyed: %s" % self._data)
@@ -103,44 +326,6 @@ class UbusSession(object):
         except RuntimeError:
             logger.debug("Failed to store session data.")
 
-    # make session iterable
-    @not_destroyed
-    def __getitem__(self, key):
-        return self._data.get(key, None)
-
-    @not_readonly
-    @not_destroyed
-    def __delitem__(self, key):
-        self._data.pop(key, None)
-
-    @not_destroyed
-    def __iter__(self):
-        for key in self._data:
-            yield key
-
-    @not_destroyed
-    def __contains__(self, key):
-        return key in self._data
-
-    @not_readonly
-    @not_destroyed
-    def __setitem__(self, key, value):
-        if not isinstance(key, str):
-            raise TypeError("key is not a string")
-        # test whether the key is ascii (exception will be raised otherwise)
-        key.encode("ascii")
-        # test whenter the value is json-serializable (exception otherwise)
-        JSONEncoder().encode(value)
-        self._data[key] = value
-
-    @not_destroyed
-    def __len__(self):
-        return len(self._data)
-
-    @not_destroyed
-    def get(self, *args, **kwargs):
-        return self._data.get(*args, **kwargs)
-
     @not_readonly
     @not_destroyed
     def grant(self, obj, function, scope="ubus"):
@@ -17,6 +17,7 @@
 
 import base64
 import json
+import threading
 
 import bottle
 import logging
@@ -35,6 +36,9 @@ logger = logging.getLogger("foris.utils")
 
 def is_user_authenticated():
     session = bottle.request.environ["foris.session"]
+    if session.is_anonymous:
+        # anonymous session can't be authenticated (don't load the session without a cookie)
+        return False
     return session.get("user_authenticated", False)
 
 
@@ -140,9 +144,9 @@ class Lazy(object):
         return getattr(self.value, item)
 
 
-class LazyCache(object):
+class LazyCache(threading.local):
     """
-    Simple per request cache of lazy objects
+    Simple per request cache of lazy objects (each thread has its own objects)
     """
 
     def __init__(self):
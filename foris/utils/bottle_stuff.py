@@ -27,7 +27,45 @@ from .translators import translations, gettext, ngettext
 from . import is_user_authenticated, template_helpers
 
 
+class RequestTemplateDefaults(dict):
+    """ Template defaults which can be overriden for the current request only
+        (see set_template_default())
+
+        Both SimpleTemplate and Jinja2Template obtain the defaults via copy()
+        when a template is rendered.
+    """
+
+    ENVIRON_KEY = "foris.template_defaults"
+
+    def copy(self):
+        res = dict(self)
+        try:
+            res.update(bottle.request.environ.get(self.ENVIRON_KEY, {}))
+        except RuntimeError:
+            # rendered outside of a request
+            pass
+        return res
+
+
+def set_template_default(key, value):
+    """ Sets template default variable for the current request only
+
+    Unlike writing to bottle.SimpleTemplate.defaults directly it is safe
+    when the requests are processed concurrently.
+
+    :param key: name of the template variable
+    :type key: str
+    :param value: value of the template variable
+    """
+    environ = bottle.request.environ
+    environ.setdefault(RequestTemplateDefaults.ENVIRON_KEY, {})[key] = value
+
+
 def prepare_template_defaults():
+    # SimpleTemplate and Jinja2Template share the defaults of BaseTemplate
+    if not isinstance(bottle.BaseTemplate.defaults, RequestTemplateDefaults):
+        bottle.BaseTemplate.defaults = RequestTemplateDefaults(bottle.BaseTemplate.defaults)
+
     bottle.SimpleTemplate.defaults["trans"] = lambda msgid: gettext(msgid)  # workaround
     bottle.SimpleTemplate.defaults["translation_names"] = translation_names
     bottle.SimpleTemplate.defaults["translations"] = [e for e in translations]
@@ -15,7 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import collections
+import json
 import logging
+import threading
+import time
 
 
 logger = logging.getLogger("foris.caches")
@@ -34,12 +38,94 @@ class SimpleCache(dict):
         logger.debug("Cache %s: '%s' -> '%s'.", self.name, key, value)
 
 
-class PerRequest(object):
+class PerRequest(threading.local):
     """
-    Ceched per request
+    Ceched per request (each thread which processes requests has its own caches)
     """
 
-    backend_data = SimpleCache("backend_data")
+    def __init__(self):
+        self.backend_data = SimpleCache("backend_data")
 
 
-per_request = PerRequest
+per_request = PerRequest()
+
+
+class BackendCache(object):
+    """
+    Cross-request cache of the backend responses
+
+    Entries expire after a module specific time to live and the least recently used
+    entries are evicted when the total size of the stored responses exceeds the limit.
+    Responses are stored serialized, so every hit returns a fresh copy which
+    can be modified by the caller.
+    """
+
+    def __init__(self, name, ttls, max_size):
+        """
+        :param name: name of the cache (used in logs)
+        :param ttls: time to live (in seconds) of entries for each cached module
+        :type ttls: dict
+        :param max_size: maximal size of stored responses (in bytes)
+        :type max_size: int
+        """
+        self.name = name
+        self.ttls = ttls
+        self.max_size = max_size
+        self.size = 0
+        self._entries = collections.OrderedDict()  # key -> (expires_at, module, raw_response)
+        self._lock = threading.Lock()
+
+    def is_cached_module(self, module):
+        return self.ttls.get(module, 0) > 0
+
+    def get(self, key):
+        """ Returns cached response
+
+        :returns: (True, response) on hit, (False, None) otherwise
+        :rtype: tuple
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires_at, _, raw = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return False, None
+
+            self._entries.move_to_end(key)
+
+        logger.debug("Cache %s: '%s' hit.", self.name, key)
+        return True, json.loads(raw)
+
+    def set(self, key, module, response):
+        raw = json.dumps(response)
+        if len(raw) > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttls[module], module, raw)
+            self.size += len(raw)
+
+            # evict least recently used entries
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+        logger.debug("Cache %s: '%s' stored (%d bytes).", self.name, key, len(raw))
+
+    def invalidate(self, module=None):
+        """ Removes entries of the module (or all entries when module is None)
+        """
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if module is None or v[1] == module]
+            for key in keys:
+                self._remove(key)
+
+        logger.debug("Cache %s: module '%s' invalidated.", self.name, module or "*")
+
+    def _remove(self, key):
+        _, _, raw = self._entries.pop(key)
+        self.size -= len(raw)
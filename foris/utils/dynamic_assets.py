@@ -16,61 +16,225 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import glob
+import hashlib
+import json
 import logging
 import shutil
 import os
+import re
+import threading
 import bottle
 
+from concurrent.futures import ThreadPoolExecutor
+
+from foris import __version__, BASE_DIR
+from foris.langs import translations
+from foris.state import current_state
+from foris.utils import translators
+
 
 logger = logging.getLogger("foris.utils.dynamic_assets")
 
+WARMUP_WORKERS = 2
+
+dynamic_assets_map = {}  # (assets dir, template name, lang) -> True
+
+_assets_dirs = {}  # script name -> directory of the assets rendered for it
+_warmed_up = set()  # (assets dir, template name) rendered for all the languages
+_warmup_lock = threading.Lock()
+_executor = None
+
+# set by reset() - (app_name, assets_path, key) the directories are derived from
+_assets_config = None
+_assets_lock = threading.Lock()
+_warmup_enabled = True
+
+
+def assets_key(app_name, plugins):
+    """ Identifies the content of the dynamic assets
+
+    It changes with foris version, set of the plugins and modification of the translations
+    or of the templates.
+
+    :param app_name: the name of the application
+    :type app_name: str
+    :param plugins: loaded plugins (see ForisPluginLoader)
+    :rtype: str
+    """
+    dirs = [BASE_DIR] + [plugin.DIRNAME for plugin in plugins]
+    files = []
+    for path in dirs:
+        files += glob.glob(os.path.join(path, "locale", "*", "LC_MESSAGES", "*.mo"))
+        files += glob.glob(os.path.join(path, "templates", "javascript", "**"), recursive=True)
+    data = [
+        __version__,
+        app_name,
+        sorted(plugin.PLUGIN_NAME for plugin in plugins),
+        sorted((path, os.stat(path).st_mtime) for path in files if os.path.isfile(path)),
+    ]
+    return hashlib.sha1(json.dumps(data).encode()).hexdigest()[:16]
+
+
+def reset(app_name, assets_path, plugins=(), warmup=True):
+    """ Prepares the generated assets
+
+    Assets are stored in '<assets_path>/<app_name>-<key>-<script key>' so that they can be
+    reused after restart. The key is derived from assets_key(), the script key from the script
+    name of the requests (urls within the assets depend on it), see assets_dir().
+
+    :param warmup: render the assets for the other languages in background
+                   (pointless when the process handles only a single request e.g. cgi)
+    """
+    global _assets_config, _warmup_enabled
+
+    with _assets_lock:
+        dynamic_assets_map.clear()
+        _assets_dirs.clear()
+        _warmed_up.clear()
+        _assets_config = app_name, assets_path, assets_key(app_name, plugins)
+        _warmup_enabled = warmup
+
+    os.makedirs(assets_path, exist_ok=True)
+    link = os.path.join(assets_path, app_name)
+    if os.path.isdir(link) and not os.path.islink(link):
+        shutil.rmtree(link, ignore_errors=True)  # directory created by an older version
 
-dynamic_assets_map = {}
 
-current_assets_path = None
+def assets_dir(script_name):
+    """ Returns the directory of the assets for a script name (it is created if needed)
 
+    Directories with other keys are removed when the first directory is created. Directories
+    of other script names are kept (e.g. foris can be accessed both directly and via a proxy).
 
-def reset(app_name, assets_path):
-    """ Deletes generated assets and cleans md5
+    '<assets_path>/<app_name>' is a symlink to the directory of the first script name
+    (for the web servers which serve the assets directly).
+
+    :param script_name: script name of the application root (see routing.get_root())
+    :rtype: str
     """
-    global dynamic_assets_map
-    dynamic_assets_map = {}
-    target = os.path.join(assets_path, app_name)
-    logger.debug("cleaning dynamic assets in '%s'", target)
-    shutil.rmtree(target, ignore_errors=True)
-    os.makedirs(target)
-    global current_assets_path
-    current_assets_path = target
+    target = _assets_dirs.get(script_name)
+    if target:
+        return target
+
+    with _assets_lock:
+        target = _assets_dirs.get(script_name)
+        if target:
+            return target
+
+        app_name, assets_path, key = _assets_config
+        script_key = hashlib.sha1(script_name.encode()).hexdigest()[:8]
+        target = os.path.join(assets_path, "%s-%s-%s" % (app_name, key, script_key))
+        os.makedirs(target, exist_ok=True)
+        logger.debug("using dynamic assets in '%s' (script name '%s')", target, script_name)
+
+        if not _assets_dirs:
+            # several processes can be started at once (e.g. cgi)
+            link = os.path.join(assets_path, app_name)
+            tmp_link = "%s.%d.%d.tmp" % (link, os.getpid(), threading.get_ident())
+            os.symlink(os.path.basename(target), tmp_link)
+            os.replace(tmp_link, link)
+
+            assets_re = re.compile(r"%s-([0-9a-f]{16})(-[0-9a-f]{8})?$" % re.escape(app_name))
+            for name in os.listdir(assets_path):
+                path = os.path.join(assets_path, name)
+                match = assets_re.match(name)
+                stale = match and not (match.group(1) == key and match.group(2))
+                if stale and not os.path.islink(path):
+                    logger.debug("cleaning stale dynamic assets in '%s'", path)
+                    shutil.rmtree(path, ignore_errors=True)
+
+        _assets_dirs[script_name] = target
+        return target
+
+
+def _render(target_dir, template_name, lang):
+    target_path = os.path.join(target_dir, lang, template_name)
+    if os.path.exists(target_path):
+        logger.debug("Template '%s' (%s) was generated earlier.", template_name, lang)
+        return
 
+    # language of the thread is switched (the assets may be rendered in a background thread)
+    with current_state.local_language(lang):
+        rendered = bottle.template(
+            template_name + ".j2", template_adapter=bottle.Jinja2Template, lang=lambda: lang
+        )
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
 
-def store_template(template_name, lang):
+    # the file might be served by a web server while it is written
+    tmp_path = "%s.%d.%d.tmp" % (target_path, os.getpid(), threading.get_ident())
+    with open(tmp_path, "wb") as f:
+        f.write(bytearray(rendered, "utf8"))
+        f.flush()
+    os.replace(tmp_path, target_path)
+
+    logger.debug(
+        "Generated template '%s' (%s) was stored to '%s'.", template_name, lang, target_path
+    )
+
+
+def store_template(template_name, lang, script_name):
     """ Creates static file from template as stores it
+
+    The template is rendered for the remaining languages in background.
+
     :param template_name: should looks like this <path>/<file>.tpl
     :type template_name: str
+    :param script_name: script name of the application root (see assets_dir())
+    :type script_name: str
     """
     template_name = template_name.lstrip("/")
     logger.debug("Trying to store generated template '%s' (%s)", template_name, lang)
 
+    target_dir = assets_dir(script_name)
+
     # already present
-    if (template_name, lang) in dynamic_assets_map:
+    if (target_dir, template_name, lang) in dynamic_assets_map:
         logger.debug("Template already generated '%s' (%s)", template_name, lang)
         return
 
-    # store file
-    rendered = bottle.template(template_name + ".j2", template_adapter=bottle.Jinja2Template)
-    target_path = os.path.join(current_assets_path, lang, template_name)
+    _render(target_dir, template_name, lang)
+
+    # mark present
+    dynamic_assets_map[(target_dir, template_name, lang)] = True
+
+    if _warmup_enabled:
+        warmup(target_dir, template_name)
+
+
+def _warmup_worker(environ, target_dir, template_name, lang):
+    # urls within the template are generated according to the original request
+    bottle.request.bind(environ)
     try:
-        os.makedirs(os.path.dirname(target_path))
-    except os.error:
-        # already exists
-        pass
-    with open(target_path, "wb") as f:
-        f.write(bytearray(rendered, "utf8"))
-        f.flush()
+        # languages of the requests are kept in the cache of the translations
+        with translators.translations.transient():
+            _render(target_dir, template_name, lang)
+        dynamic_assets_map[(target_dir, template_name, lang)] = True
+    except Exception:
+        logger.exception("Failed to generate template '%s' (%s).", template_name, lang)
 
-    logger.debug(
-        "Generated template '%s' (%s) was stored to '%s'.", template_name, lang, target_path
-    )
 
-    # mark present
-    dynamic_assets_map[(template_name, lang)] = True
+def warmup(target_dir, template_name):
+    """ Renders the template for all installed languages using background threads
+
+    It has to be called within a request (the urls in the templates depend on the request).
+    """
+    global _executor
+
+    with _warmup_lock:
+        if (target_dir, template_name) in _warmed_up:
+            return
+        _warmed_up.add((target_dir, template_name))
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=WARMUP_WORKERS, thread_name_prefix="foris-assets"
+            )
+
+    environ = {
+        "SCRIPT_NAME": bottle.request.environ.get("SCRIPT_NAME", ""),
+        "PATH_INFO": bottle.request.environ.get("PATH_INFO", "/"),
+        "bottle.app": bottle.request.app,
+    }
+    for lang in translations:
+        if (target_dir, template_name, lang) not in dynamic_assets_map:
+            _executor.submit(_warmup_worker, environ, target_dir, template_name, lang)
@@ -0,0 +1,118 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+
+import bottle
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from foris.state import current_state
+
+
+class LRUCache(object):
+    """ Thread-safe mapping which holds at most `max_size` recently used items
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# shared by all jinja2 environments (bottle creates a new one for each template)
+fragment_cache = LRUCache(256)
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(e) for e in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class FragmentCacheExtension(Extension):
+    """ Caches rendered parts of jinja2 templates
+
+    {% cache "menu", active_config_page_key %}...{% endcache %}
+
+    The fragment is stored under the listed keys together with its position in the template
+    and current_state.fragment_cache_key() (language, guide, notification count, ...).
+    So it should not depend on anything else (e.g. csrf token or flash messages).
+
+    Caching is disabled in debug mode so that the changes in templates are visible.
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+
+        args = [nodes.Const(parser.name), nodes.Const(lineno), nodes.List(keys)]
+        return nodes.CallBlock(self.call_method("_cached", args), [], [], body).set_lineno(lineno)
+
+    def _cached(self, name, lineno, keys, caller):
+        if bottle.DEBUG:
+            return caller()
+
+        key = (
+            name,
+            lineno,
+            _freeze(keys),
+            bottle.request.script_name,
+            current_state.fragment_cache_key(),
+        )
+        res = fragment_cache.get(key)
+        if res is None:
+            res = caller()
+            fragment_cache.put(key, res)
+        return res
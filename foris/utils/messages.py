@@ -5,6 +5,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 _SESSION_KEY = "_messages"
+_ENVIRON_KEY = "foris.messages"
 
 # tuple of (priority, level_name)
 INFO = (0, "info")
@@ -14,6 +15,8 @@ ERROR = (30, "error")
 
 
 class Message(object):
+    __slots__ = ("text", "level", "extra_classes")
+
     def __init__(self, text, level, extra_classes=[]):
         """
         Create new message instance.
@@ -27,11 +30,14 @@ class Message(object):
         self.extra_classes = extra_classes
 
     def to_json(self):
-        return {"text": self.text, "level": self.level, "extra_classes": self.extra_classes}
+        return [self.text, self.level, self.extra_classes]
 
     @staticmethod
     def from_json(json):
-        return Message(json["text"], json["level"], json["extra_classes"])
+        if isinstance(json, dict):
+            # stored by an older version
+            return Message(json["text"], json["level"], json["extra_classes"])
+        return Message(*json)
 
     @property
     def classes(self):
@@ -45,6 +51,67 @@ class Message(object):
         return self.level[1]
 
 
+class MessageQueue(object):
+    """
+    Messages of the current session. Messages are read from the session once
+    per request and written back (only when changed) by flush() when the response starts.
+    """
+
+    __slots__ = ("session", "messages", "dirty")
+
+    def __init__(self, session):
+        self.session = session
+        self.messages = [Message.from_json(e) for e in session.get(_SESSION_KEY, [])]
+        self.dirty = False
+
+    @staticmethod
+    def current():
+        """
+        Get message queue of the current request.
+        """
+        environ = bottle.request.environ
+        queue = environ.get(_ENVIRON_KEY)
+        if queue is None:
+            queue = environ[_ENVIRON_KEY] = MessageQueue(environ["foris.session"])
+        return queue
+
+    def add(self, message):
+        self.messages.append(message)
+        self.dirty = True
+
+    def drain(self, predicate):
+        """
+        Remove and return messages matching the predicate.
+        """
+        drained, kept = [], []
+        for msg in self.messages:
+            (drained if predicate(msg) else kept).append(msg)
+        if drained:
+            self.messages = kept
+            self.dirty = True
+        return drained
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.session[_SESSION_KEY] = [e.to_json() for e in self.messages]
+        self.dirty = False
+
+
+def flush_messages(environ):
+    """
+    Stores changed messages of a request to the session.
+
+    It is called by SessionMiddleware when the response starts (i.e. also after
+    the error handlers which are called after the after_request hooks).
+
+    :param environ: WSGI environment of the request
+    """
+    queue = environ.get(_ENVIRON_KEY)
+    if queue is not None:
+        queue.flush()
+
+
 def get_messages(level=None, min_level=None):
     """
     Generator function yielding messages, optionally filtered by severity level.
@@ -53,7 +120,7 @@ def get_messages(level=None, min_level=None):
     :param min_level: get messages with level specified or higher
     """
 
-    def should_show():
+    def should_show(msg):
         if level and msg.level[0] == level[0]:
             return True
         elif min_level and msg.level[0] >= min_level[0]:
@@ -62,14 +129,8 @@ def get_messages(level=None, min_level=None):
             return True
         return False
 
-    session = bottle.request.environ["foris.session"]
-    messages = session.get(_SESSION_KEY, [])
-    all_messages = messages[:]
-    for msg in all_messages:
-        if should_show():
-            messages.remove(msg)
-            session[_SESSION_KEY] = messages
-            yield Message.from_json(msg)
+    for msg in MessageQueue.current().drain(should_show):
+        yield msg
 
 
 def info(text, extra_classes=[]):
@@ -120,10 +181,7 @@ def add_message(text, level=INFO, extra_classes=[]):
     :param level: severity level
     :param extra_classes: extra classes of the message
     """
-    session = bottle.request.environ["foris.session"]
-    messages = session.get(_SESSION_KEY, [])
-    messages.append(Message(text, level, extra_classes).to_json())
-    session[_SESSION_KEY] = messages
+    MessageQueue.current().add(Message(text, level, extra_classes))
 
 
 def set_template_defaults():
@@ -0,0 +1,192 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import functools
+import threading
+import time
+
+import bottle
+
+from foris.utils import timing
+
+# name -> (type, help)
+METRICS = {
+    "foris_backend_request_seconds": ("histogram", "Duration of backend requests."),
+    "foris_backend_errors_total": ("counter", "Number of failed backend requests."),
+    "foris_http_request_seconds": ("histogram", "Duration of HTTP requests per route."),
+    "foris_template_render_seconds": ("histogram", "Duration of template rendering."),
+}
+
+
+class Histogram(object):
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(Histogram.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        idx = bisect.bisect_left(Histogram.BUCKETS, value)
+        if idx < len(self.bucket_counts):
+            self.bucket_counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        res = []
+        total = 0
+        for count in self.bucket_counts:
+            total += count
+            res.append(total)
+        return res
+
+
+class Metrics(object):
+    """ In-process storage of the metrics
+
+    Each metric is identified by its name (see METRICS) and labels
+    (tuple of (label, value) pairs).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[name, labels] = self.counters.get((name, labels), 0) + value
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels
+        )
+
+    def to_prometheus(self):
+        """ Exports metrics in Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in sorted(METRICS.items()):
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self.counters.items()):
+                        if metric == name:
+                            lines.append("%s%s %d" % (name, self._format_labels(labels), value))
+                    continue
+
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(Histogram.BUCKETS, histogram.cumulative_counts()):
+                        lines.append(
+                            "%s_bucket%s %d"
+                            % (name, self._format_labels(labels + (("le", bound),)), count)
+                        )
+                    lines.append(
+                        "%s_bucket%s %d"
+                        % (name, self._format_labels(labels + (("le", "+Inf"),)), histogram.count)
+                    )
+                    lines.append("%s_sum%s %f" % (name, self._format_labels(labels), histogram.sum))
+                    lines.append(
+                        "%s_count%s %d" % (name, self._format_labels(labels), histogram.count)
+                    )
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        """ Exports metrics as a json-serializable dict
+        """
+        res = {name: [] for name in METRICS}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                res[name].append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in self.histograms.items():
+                res[name].append(
+                    {
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(zip(Histogram.BUCKETS, histogram.cumulative_counts())),
+                    }
+                )
+        return res
+
+
+metrics = Metrics()
+
+
+class MetricsPlugin(object):
+    """ Bottle plugin which measures the duration of the requests per route
+    """
+
+    name = "metrics"
+    api = 2
+
+    def apply(self, callback, route):
+        labels = (("route", route.rule), ("method", route.method))
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                metrics.observe("foris_http_request_seconds", labels, time.time() - start_time)
+
+        return wrapper
+
+
+def instrument_templates():
+    """ Measures rendering of templates (both SimpleTemplate and Jinja2Template)
+    """
+
+    def instrument(template_class):
+        if getattr(template_class.render, "instrumented", False):
+            return
+        render = template_class.render
+
+        @functools.wraps(render)
+        def wrapper(self, *args, **kwargs):
+            start_time = time.time()
+            try:
+                return render(self, *args, **kwargs)
+            finally:
+                duration = time.time() - start_time
+                name = self.name or "<string>"
+                metrics.observe("foris_template_render_seconds", (("template", name),), duration)
+                timing.record("template", duration, name)
+
+        wrapper.instrumented = True
+        template_class.render = wrapper
+
+    instrument(bottle.SimpleTemplate)
+    instrument(bottle.Jinja2Template)
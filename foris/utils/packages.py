@@ -0,0 +1,109 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import threading
+
+try:
+    from importlib import metadata
+except ImportError:  # python < 3.8
+    import importlib_metadata as metadata
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    """ Normalizes the name of a distribution (foris_x_plugin == Foris-X-Plugin)
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class DistributionIndex(object):
+    """ Versions and entry points of the installed distributions
+
+    Distributions are scanned only once, use reload_index() to scan them again.
+    """
+
+    __slots__ = ("versions", "entry_points")
+
+    def __init__(self):
+        self.versions = {}  # normalized name -> version
+        self.entry_points = {}  # group -> list of entry points
+
+        for distribution in metadata.distributions():
+            name = distribution.metadata["Name"]
+            if not name:
+                continue
+            name = normalize_name(name)
+            if name in self.versions:
+                # the first distribution on the path shadows the others
+                continue
+            self.versions[name] = distribution.version
+            for entry_point in distribution.entry_points:
+                self.entry_points.setdefault(entry_point.group, []).append(entry_point)
+
+        logger.debug("%d distributions indexed.", len(self.versions))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """ Returns the index of installed distributions (it is built on the first call)
+
+    :rtype: DistributionIndex
+    """
+    global _index
+
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DistributionIndex()
+            index = _index
+    return index
+
+
+def reload_index():
+    """ Drops the index so that the distributions are scanned again on the next use
+    """
+    global _index
+
+    with _index_lock:
+        _index = None
+
+
+def distribution_version(name):
+    """ Returns the version of an installed distribution
+
+    :param name: name of the distribution
+    :type name: str
+    :returns: version or None if the distribution is not installed
+    :rtype: str
+    """
+    return get_index().versions.get(normalize_name(name))
+
+
+def iter_entry_points(group):
+    """ Iterates over the entry points of a group in all installed distributions
+
+    :param group: name of the group
+    :type group: str
+    """
+    return iter(get_index().entry_points.get(group, []))
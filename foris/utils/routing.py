@@ -15,18 +15,77 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import bottle
-import hashlib
 import logging
 import os
 import re
+import threading
 
 from foris import BASE_DIR
-from foris.state import current_state
-from foris.utils.dynamic_assets import store_template
+from foris.utils.dynamic_assets import assets_dir, store_template
+from foris.utils.static_manifest import (
+    current_files,
+    file_digest,
+    fingerprinted_name,
+    read_manifest,
+)
 
 logger = logging.getLogger("utils.routing")
 
 static_md5_map = {}
+static_fingerprinted = set()  # files which can be referred by their fingerprinted names
+static_encodings = {}  # file -> encodings of its precompressed variants
+plugin_static_dirs = None  # plugin name -> static dir
+_static_lock = threading.Lock()
+
+
+def load_static_manifests():
+    """ Fills static_md5_map using the manifests of foris and of the loaded plugins
+
+    It should be called when the plugins are loaded (otherwise it is called on the first use).
+    """
+    global plugin_static_dirs
+
+    with _static_lock:
+        loader = getattr(bottle.app(), "foris_plugin_loader", None)
+        plugins = loader.plugins if loader else []
+        dirs = {plugin.PLUGIN_NAME: os.path.join(plugin.DIRNAME, "static") for plugin in plugins}
+
+        roots = [("static/", os.path.join(BASE_DIR, "static"))]
+        roots += [("static/plugins/%s/" % name, path) for name, path in dirs.items()]
+        for prefix, path in roots:
+            manifest = read_manifest(path)
+            if not manifest:
+                logger.debug("No static manifest for '%s' (files will be hashed)." % path)
+                continue
+            current = current_files(path, manifest)
+            if len(current) < len(manifest["files"]):
+                logger.debug(
+                    "%d files changed since static manifest of '%s' was written (they will be "
+                    "hashed)." % (len(manifest["files"]) - len(current), path)
+                )
+            for name, digest in manifest["files"].items():
+                if name not in current:
+                    continue
+                static_md5_map[prefix + name] = digest
+                if manifest["fingerprinted"]:
+                    static_fingerprinted.add(prefix + name)
+            for name, encodings in manifest.get("encodings", {}).items():
+                if name not in current:
+                    continue
+                static_encodings[prefix + name] = encodings
+                if manifest["fingerprinted"]:
+                    digest = manifest["files"][name]
+                    static_encodings[prefix + fingerprinted_name(name, digest)] = encodings
+
+        plugin_static_dirs = dirs
+
+
+def get_plugin_static_dir(plugin_name):
+    """ Returns static directory of a loaded plugin (None if the plugin is not loaded)
+    """
+    if plugin_static_dirs is None:
+        load_static_manifests()
+    return plugin_static_dirs.get(plugin_name)
 
 
 def _get_prefix_and_script_name():
@@ -54,41 +113,130 @@ def external_route(path):
     return "/" + "/".join(script_name.split("/")[:-1] + [path])
 
 
+class RouteIndex(object):
+    """ Maps route names to the routers of the main app and of its mounted apps
+
+    Routes of the main app take precedence over the routes of the mounted apps.
+    URLs of the routes without arguments are memoized (per script_name).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = {}  # name -> (router, prefix)
+        self.urls = {}  # (script_name, name) -> url
+        self.routers = [app.router]
+
+        for name in app.router.builder:
+            self.routes[name] = (app.router, "")
+        for route in app.routes:
+            if route.config.get("mountpoint.target"):
+                prefix = route.config["mountpoint.prefix"].rstrip("/")
+                router = route.config["mountpoint.target"].router
+                self.routers.append(router)
+                for name in router.builder:
+                    self.routes.setdefault(name, (router, prefix))
+
+        self.version = self._current_version()
+
+    def _current_version(self):
+        # routes are only added (new mounts are routes of the main app as well)
+        return (len(self.app.routes),) + tuple(len(e.builder) for e in self.routers)
+
+    @property
+    def outdated(self):
+        """ Checks whether any route was added since the index was built
+        """
+        return self._current_version() != self.version
+
+    def build(self, script_name, name, **kargs):
+        if not kargs:
+            url = self.urls.get((script_name, name))
+            if url is not None:
+                return url
+
+        router, prefix = self.routes[name]
+        path = router.build(name, **kargs)
+        url = _normalize_path_end("".join([script_name.rstrip("/"), prefix, path]))
+
+        if not kargs:
+            self.urls[script_name, name] = url
+        return url
+
+
+_route_index = None
+_route_index_lock = threading.Lock()
+
+
+def build_route_index(app=None):
+    """ (Re)builds the index used by reverse()
+
+    It should be called when all the apps are mounted and the plugins are loaded.
+    Routes added later are found as well, but the first lookup of such route rebuilds
+    the index (only when some routes were added since the index was built).
+
+    :param app: main app (bottle.app() by default)
+    :rtype: RouteIndex
+    """
+    global _route_index
+    index = RouteIndex(app or bottle.app())
+    with _route_index_lock:
+        _route_index = index
+    logger.debug("Route index built (%d routes)." % len(index.routes))
+    return index
+
+
 def reverse(name, **kargs):
-    script_name, prefix = _get_prefix_and_script_name()
+    script_name, _ = _get_prefix_and_script_name()
+    index = _route_index
+    if index is None or index.app is not bottle.app():
+        index = build_route_index()
+    elif name not in index.routes and index.outdated:
+        index = build_route_index()
     try:
-        path = bottle.app().router.build(name, **kargs)
-        return _normalize_path_end("".join([script_name.rstrip("/"), path]))
-    except bottle.RouteBuildError:
-        for route in bottle.app().routes:
-            if route.config.get("mountpoint"):
-                config = route.config
-                try:
-                    prefix = config["mountpoint.prefix"].rstrip("/")
-                    path = config["mountpoint.target"].router.build(name, **kargs)
-                    return _normalize_path_end("".join([script_name.rstrip("/"), prefix, path]))
-                except bottle.RouteBuildError as e:
-                    if str(e).startswith("Missing URL"):
-                        raise e
-    raise bottle.RouteBuildError("No route with name '%s' in main app or mounted apps." % name)
+        return index.build(script_name, name, **kargs)
+    except KeyError:
+        raise bottle.RouteBuildError("No route with name '%s' in main app or mounted apps." % name)
+
+
+def get_root_script_name():
+    """ Returns the script name of the top-level app (even within a mounted app)
+    """
+    script_name, _ = _get_prefix_and_script_name()
+    script_name = script_name.strip("/")
+    return "/%s" % script_name if script_name else ""
 
 
 def generated_static(name, *args):
     lang = bottle.request.app.lang
-    store_template(name, lang)
+    store_template(name, lang, get_root_script_name())
     name = "generated/%s/%s" % (lang, name.lstrip("/"))
     return static(name, *args)
 
 
 def static(name, *args):
-    script_name, _ = _get_prefix_and_script_name()
-    script_name = script_name.strip("/")
-    script_name = "/%s" % script_name if script_name else ""
-    filename = ("%s/static/%s" % (script_name, name)) % args
+    script_name = get_root_script_name()
     md5 = static_md5("static/" + name)
+    if md5 and not args and "static/" + name.lstrip("/") in static_fingerprinted:
+        return "%s/static/%s" % (script_name, fingerprinted_name(name, md5))
+    filename = ("%s/static/%s" % (script_name, name)) % args
     return "%s?md5=%s" % (filename, md5) if md5 else filename
 
 
+def static_manifest_md5(filename):
+    """ Returns md5 of a static file which is already known (e.g. listed in a manifest)
+
+    Unlike static_md5() the file is never hashed, so it is safe to use it for
+    the paths which come from the requests.
+
+    :param filename: url path
+    :type filename: str
+    :return: md5 of the file or None if the file is not known
+    """
+    if plugin_static_dirs is None:
+        load_static_manifests()
+    return static_md5_map.get(filename.lstrip("/"))
+
+
 def static_md5(filename):
     """ return static file
     :param filename: url path
@@ -96,24 +244,31 @@ def static_md5(filename):
     :return: md5 of the file or none if the file is not found
     """
     filename = filename.lstrip("/")
-    if filename in static_md5_map:
-        return static_md5_map[filename]
+    if plugin_static_dirs is None:
+        load_static_manifests()
+
+    # generated files differ for each script name
+    match = re.match(r"(?:static)?/*generated/+([a-z]{2})/+(.+)", filename)
+    if match:
+        language, template = match.groups()
+        os_path = os.path.join(assets_dir(get_root_script_name()), language, template)
+        cache_key = os_path
+    else:
+        os_path = None
+        cache_key = filename
+
+    digest = static_md5_map.get(cache_key)
+    if digest:
+        return digest
 
     match = re.match(r"(?:static)?/*plugins/+(\w+)/+(.+)", filename)
-    os_path = None
     if match:
         plugin_name, plugin_file = match.groups()
-        # find correspoding plugin
-        for plugin in bottle.app().foris_plugin_loader.plugins:
-            if plugin.PLUGIN_NAME == plugin_name:
-                os_path = os.path.join(plugin.DIRNAME, "static", plugin_file)
-    else:
-        match = re.match(r"(?:static)?/*generated/+([a-z]{2})/+(.+)", filename)
-        if match:
-            language, template = match.groups()
-            os_path = os.path.join(current_state.assets_path, current_state.app, language, template)
-        else:
-            os_path = os.path.join(BASE_DIR, filename)
+        static_dir = plugin_static_dirs.get(plugin_name)
+        if static_dir:
+            os_path = os.path.join(static_dir, plugin_file)
+    elif not os_path:
+        os_path = os.path.join(BASE_DIR, filename)
 
     if not os_path:
         logger.warning("Unable to find file for static url '%s'" % filename)
@@ -123,13 +278,8 @@ def static_md5(filename):
         logger.warning("Static file '%s' related to url '%s' does not exist" % (os_path, filename))
         return None
 
-    md5 = hashlib.md5()
-    with open(os_path, "rb") as f:
-        content = f.read()
-        md5.update(content)
-
-    digest = md5.hexdigest()
-    static_md5_map[filename] = digest
+    digest = file_digest(os_path)
+    static_md5_map[cache_key] = digest
     return digest
 
 
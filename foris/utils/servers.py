@@ -0,0 +1,112 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import signal
+import socketserver
+import time
+
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import bottle
+
+logger = logging.getLogger("foris.servers")
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """ wsgiref server which processes each request in a separate thread
+    """
+
+    daemon_threads = True
+
+
+class RequestHandler(WSGIRequestHandler):
+    quiet = False
+
+    def address_string(self):
+        # Prevent reverse DNS lookups
+        return self.client_address[0]
+
+    def log_request(self, *args, **kwargs):
+        if not self.quiet:
+            return WSGIRequestHandler.log_request(self, *args, **kwargs)
+
+
+class PreforkServer(bottle.ServerAdapter):
+    """ Server which listens in the main process and processes the requests
+        in the forked worker processes (dead workers are replaced)
+
+    Options:
+        workers - number of the worker processes
+        threads - process requests in threads within each worker
+        post_fork - callable which is called in each worker after it is forked
+    """
+
+    RESTART_DELAY = 1  # in seconds (prevents restarting broken workers in a busy loop)
+
+    def run(self, app):
+        workers = self.options.get("workers", 2)
+        server_class = ThreadingWSGIServer if self.options.get("threads") else WSGIServer
+        post_fork = self.options.get("post_fork")
+
+        handler_class = type("Handler", (RequestHandler,), {"quiet": self.quiet})
+        server = make_server(self.host, self.port, app, server_class, handler_class)
+
+        children = set()
+
+        def terminate(signum, frame):
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            server.server_close()
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            while True:
+                while len(children) < workers:
+                    children.add(self._spawn(server, post_fork))
+                pid, status = os.wait()
+                if pid in children:
+                    children.remove(pid)
+                    logger.warning("Worker %d exited (status %d). Restarting.", pid, status)
+                    time.sleep(self.RESTART_DELAY)
+        except KeyboardInterrupt:
+            terminate(signal.SIGINT, None)
+
+    @staticmethod
+    def _spawn(server, post_fork):
+        pid = os.fork()
+        if pid:
+            logger.debug("Worker %d started.", pid)
+            return pid
+
+        # worker process
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        status = 0
+        try:
+            if post_fork:
+                post_fork()
+            server.serve_forever()
+        except Exception:
+            logger.exception("Worker %d failed.", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
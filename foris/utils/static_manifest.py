@@ -0,0 +1,263 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Content digests of the static files
+
+The manifest is generated when the package is built (or via `foris --build-static-manifest`)
+and it is stored next to the static directory so that the digests don't need to be computed
+at runtime. This module should not depend on anything but the standard library
+(it is used by setup.py).
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pkgutil
+import shutil
+
+logger = logging.getLogger("foris.utils.static_manifest")
+
+MANIFEST_NAME = "static-manifest.json"
+MANIFEST_VERSION = 2
+FINGERPRINT_LENGTH = 12
+
+# precompressed variants: encoding -> file suffix (preferred encoding first)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE = (".css", ".js", ".svg", ".html", ".json", ".txt", ".ttf", ".eot", ".map")
+MIN_COMPRESS_SIZE = 256  # in bytes
+
+
+def file_digest(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def file_stat(path):
+    """ Size and modification time used to detect files changed after the manifest was written
+    """
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def current_files(static_dir, manifest):
+    """ Returns names of the files which weren't changed since the manifest was written
+
+    Files of the plugins can be replaced (e.g. by an upgrade of the plugin package) without
+    rebuilding the manifest, so the entries of the changed files must not be used.
+
+    :param static_dir: path to the static directory
+    :type static_dir: str
+    :param manifest: manifest of the static directory (see read_manifest())
+    :type manifest: dict
+    :rtype: set
+    """
+    res = set()
+    stats = manifest.get("stats", {})
+    for name in manifest["files"]:
+        try:
+            stat = file_stat(os.path.join(static_dir, name))
+        except OSError:
+            continue
+        if stats.get(name) == stat:
+            res.add(name)
+    return res
+
+
+def fingerprinted_name(name, digest):
+    """ css/screen.css -> css/screen.<digest>.css """
+    base, ext = os.path.splitext(name)
+    return "%s.%s%s" % (base, digest[:FINGERPRINT_LENGTH], ext)
+
+
+def _compressors():
+    res = {"gzip": lambda data: gzip.compress(data, 9, mtime=0)}
+    try:
+        import brotli
+
+        res["br"] = brotli.compress
+    except ImportError:
+        logger.debug("brotli module is not installed (only gzip variants will be created).")
+    return res
+
+
+def compress_file(path, compressors):
+    """ Creates precompressed siblings of the file (e.g. screen.css.gz)
+
+    Variants which are not smaller than the original file are not created.
+
+    :returns: encodings of the created variants
+    :rtype: list
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    res = []
+    for encoding, suffix in ENCODINGS:
+        if encoding not in compressors:
+            continue
+        compressed = compressors[encoding](data)
+        if len(compressed) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            res.append(encoding)
+    return res
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def manifest_path(static_dir):
+    return os.path.join(os.path.dirname(os.path.normpath(static_dir)), MANIFEST_NAME)
+
+
+def read_manifest(static_dir):
+    """ Reads the manifest of the static directory
+
+    :param static_dir: path to the static directory
+    :type static_dir: str
+    :returns: {"version": ..., "fingerprinted": bool, "files": {name: digest},
+               "stats": {name: [size, mtime]}, "encodings": {name: [encoding]}} or None
+    :rtype: dict
+    """
+    path = manifest_path(static_dir)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("Failed to read static manifest '%s'.", path)
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.warning("Unsupported version of static manifest '%s'.", path)
+        return None
+    return manifest
+
+
+def build_manifest(static_dir, fingerprint=False, compress=False):
+    """ Computes digests of the files in the static directory and writes the manifest
+
+    :param static_dir: path to the static directory
+    :type static_dir: str
+    :param fingerprint: create copies of the files with the digest in their names
+                        (can be served with immutable cache headers)
+    :type fingerprint: bool
+    :param compress: create precompressed variants of the text files (see ENCODINGS)
+    :type compress: bool
+    :rtype: dict
+    """
+    # remove files created by the previous build
+    previous = read_manifest(static_dir)
+    if previous:
+        encodings = previous.get("encodings", {})
+        for name, digest in previous["files"].items():
+            names = [name]
+            if previous["fingerprinted"]:
+                names.append(fingerprinted_name(name, digest))
+                _remove(os.path.join(static_dir, names[-1]))
+            for encoding, suffix in ENCODINGS:
+                if encoding in encodings.get(name, []):
+                    for e in names:
+                        _remove(os.path.join(static_dir, e + suffix))
+
+    files = {}
+    stats = {}
+    for root, dirs, filenames in os.walk(static_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            files[name] = file_digest(path)
+            stats[name] = file_stat(path)
+
+    encodings = {}
+    if compress:
+        compressors = _compressors()
+        for name in files:
+            path = os.path.join(static_dir, name)
+            if name.endswith(COMPRESSIBLE) and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+                created = compress_file(path, compressors)
+                if created:
+                    encodings[name] = created
+
+    if fingerprint:
+        for name, digest in files.items():
+            source = os.path.join(static_dir, name)
+            target = os.path.join(static_dir, fingerprinted_name(name, digest))
+            _link_or_copy(source, target)
+            for encoding, suffix in ENCODINGS:
+                if encoding in encodings.get(name, []):
+                    _link_or_copy(source + suffix, target + suffix)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "fingerprinted": fingerprint,
+        "files": files,
+        "stats": stats,
+        "encodings": encodings,
+    }
+    path = manifest_path(static_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+    logger.info("Static manifest '%s' written (%d files).", path, len(files))
+    return manifest
+
+
+def static_dirs():
+    """ Returns static directories of foris and of the installed plugins
+
+    :returns: [(url prefix, path)]
+    :rtype: list
+    """
+    from foris import BASE_DIR
+
+    res = [("", os.path.join(BASE_DIR, "static"))]
+    try:
+        import foris_plugins
+    except ImportError:
+        return res
+
+    for finder, name, _ in pkgutil.iter_modules(foris_plugins.__path__):
+        path = os.path.join(getattr(finder, "path", ""), name, "static")
+        if os.path.isdir(path):
+            res.append(("plugins/%s/" % name, path))
+    return res
+
+
+def build_manifests(fingerprint=False, compress=False):
+    """ Writes manifests for all the static directories (see static_dirs())
+    """
+    for _, path in static_dirs():
+        build_manifest(path, fingerprint, compress)
@@ -0,0 +1,100 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2019 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import threading
+import time
+
+
+_local = threading.local()
+
+
+class RequestTimings(object):
+    """ Durations of the particular parts of a single request (see ServerTimingMiddleware)
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.entries = []  # list of (name, duration, description)
+        self._lock = threading.Lock()
+
+    def add(self, name, duration, description=None):
+        with self._lock:
+            self.entries.append((name, duration, description))
+
+    def records(self):
+        """ Returns recorded timings including the total duration of the request so far
+        """
+        with self._lock:
+            entries = list(self.entries)
+        entries.append(("total", time.time() - self.start_time, None))
+        return entries
+
+    def header(self):
+        """ Formats the timings as Server-Timing header value
+        """
+        res = []
+        for name, duration, description in self.records():
+            record = "%s;dur=%.1f" % (name, duration * 1000)
+            if description:
+                record += ';desc="%s"' % str(description).replace('"', "'")
+            res.append(record)
+        return ", ".join(res)
+
+
+def start_request():
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def finish_request():
+    _local.timings = None
+
+
+def current():
+    """ Returns timings of the request which is processed in the current thread
+
+    :rtype: RequestTimings or None
+    """
+    return getattr(_local, "timings", None)
+
+
+@contextlib.contextmanager
+def use(timings):
+    """ Records timings of the current thread to the timings of another thread's request
+        (e.g. worker threads which are processing a part of the request)
+    """
+    original = current()
+    _local.timings = timings
+    try:
+        yield
+    finally:
+        _local.timings = original
+
+
+def record(name, duration, description=None):
+    timings = current()
+    if timings is not None:
+        timings.add(name, duration, description)
+
+
+@contextlib.contextmanager
+def measure(name, description=None):
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        record(name, time.time() - start_time, description)
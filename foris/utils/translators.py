@@ -16,47 +16,421 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
-import gettext
+import collections.abc
+import contextlib
+import logging
+import mmap
 import os
+import struct
+import threading
 
+from gettext import GNUTranslations, NullTranslations, c2py, find as find_catalog
 from jinja2.ext import InternationalizationExtension
 
 from foris import BASE_DIR
-from foris.langs import translations
+from foris.langs import DEFAULT_LANGUAGE, translations as languages
 from foris.state import current_state
 
+logger = logging.getLogger("foris.utils.translators")
+
 # read locale directory
 locale_directory = os.path.join(BASE_DIR, "locale")
 
 
-class _LangDict(collections.OrderedDict):
-    def __missing__(self, key):
-        # return english translation if missing key
-        return super(_LangDict, self).__getitem__("en")
+class MmapCatalog(object):
+    """ Messages of a .mo file read directly from its memory-mapped content
 
+    The file is not read into memory and decoded into a dict first (as GNUTranslations do),
+    the messages are decoded only while they are iterated (see MergedTranslations which
+    merges the catalogs of a language into a single dict).
+    """
 
-translations = _LangDict(
-    (e, gettext.translation("messages", locale_directory, languages=[e], fallback=True))
-    for e in translations
-)
+    MAGICS = {0x950412DE: "<", 0xDE120495: ">"}
 
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-class SimpleDelayedTranslator(object):
-    def __init__(self, text):
-        self.text = text
+        try:
+            order = self.MAGICS[struct.unpack("<I", self._data[:4])[0]]
+        except (KeyError, struct.error):
+            raise ValueError("'%s' is not a .mo file" % path)
+        version, self._count, self._originals, self._translations = struct.unpack(
+            order + "4I", self._data[4:20]
+        )
+        if version >> 16 not in (0, 1):
+            raise ValueError("Unsupported version of .mo file '%s'" % path)
+        self._entry = struct.Struct(order + "2I")
+
+        self.charset = "utf-8"
+        self.plural = lambda n: int(n != 1)
+        self._parse_metadata()
+
+    def _original(self, idx):
+        length, offset = self._entry.unpack_from(self._data, self._originals + 8 * idx)
+        return self._data[offset : offset + length].split(b"\0", 1)[0]
+
+    def _translation(self, idx):
+        length, offset = self._entry.unpack_from(self._data, self._translations + 8 * idx)
+        return self._data[offset : offset + length]
+
+    def _parse_metadata(self):
+        # metadata are stored as the translation of an empty message (usually the first one)
+        for idx in range(self._count):
+            if not self._original(idx):
+                break
+        else:
+            return
+        for line in self._translation(idx).decode("ascii", "replace").splitlines():
+            name, _, value = line.partition(":")
+            name, value = name.strip().lower(), value.strip()
+            if name == "content-type" and "charset=" in value:
+                self.charset = value.split("charset=")[1].strip()
+            elif name == "plural-forms" and "plural=" in value:
+                self.plural = c2py(value.split("plural=")[1].rstrip(";"))
+
+    def messages(self):
+        """ Yields (message, translated forms) of all the messages in the catalog """
+        for idx in range(self._count):
+            key = self._original(idx)
+            if key:
+                translation = self._translation(idx).decode(self.charset)
+                yield key.decode(self.charset), translation.split("\0")
+
+
+def load_catalog(directory, lang):
+    """ Loads catalog 'messages' of the language from the locale directory
+
+    :returns: catalog which can be passed to MergedTranslations
+    :rtype: MmapCatalog or GNUTranslations or NullTranslations (catalog not found)
+    """
+    path = find_catalog("messages", directory, languages=[lang])
+    if not path:
+        return NullTranslations()
+    try:
+        return MmapCatalog(path)
+    except (OSError, ValueError) as e:
+        logger.debug("Unable to mmap '%s' (%s), reading it whole." % (path, e))
+    with open(path, "rb") as f:
+        return GNUTranslations(f)
+
+
+def catalog_messages(translation):
+    """ Yields (message, translated forms) of all the messages in the catalog
+
+    :param translation: catalog obtained via load_catalog()
+    """
+    if isinstance(translation, MmapCatalog):
+        for item in translation.messages():
+            yield item
+        return
+
+    forms = {}
+    for key, value in getattr(translation, "_catalog", {}).items():
+        if isinstance(key, tuple):  # plural form (message, index)
+            forms.setdefault(key[0], {})[key[1]] = value
+        elif key:
+            forms[key] = {0: value}
+    for message, values in forms.items():
+        yield message, [values[idx] for idx in sorted(values)]
+
+
+class MergedTranslations(NullTranslations):
+    """ Messages of several catalogs merged into a single dict
+
+    Catalogs are passed in the order of precedence (the first translation of a message
+    is used), i.e. in the order in which a chain of fallbacks would be searched.
+    Messages which are translated differently in the ignored catalogs are listed in
+    `conflicts` as (message, source used, source ignored).
+    """
+
+    def __init__(self, sources):
+        """
+        :param sources: catalogs [(source name, translation)]
+        :type sources: list
+        """
+        super(MergedTranslations, self).__init__()
+        self._catalog = {}
+        self.conflicts = []
+        self.plural = None
+
+        origins = {}
+        for name, translation in sources:
+            if self.plural is None and hasattr(translation, "plural"):
+                self.plural = translation.plural
+            for message, forms in catalog_messages(translation):
+                if not any(forms):
+                    continue  # not translated
+                present = self._catalog.get(message)
+                if present is None:
+                    self._catalog[message] = tuple(forms)
+                    origins[message] = name
+                elif present != tuple(forms):
+                    self.conflicts.append((message, origins[message], name))
+
+        if self.plural is None:
+            self.plural = lambda n: int(n != 1)
+
+    def gettext(self, message):
+        forms = self._catalog.get(message)
+        if forms is None:
+            if self._fallback:
+                return self._fallback.gettext(message)
+            return message
+        return forms[0]
+
+    def ngettext(self, msgid1, msgid2, n):
+        forms = self._catalog.get(msgid1)
+        if forms is None:
+            if self._fallback:
+                return self._fallback.ngettext(msgid1, msgid2, n)
+            return msgid1 if n == 1 else msgid2
+        idx = self.plural(n)
+        return forms[idx] if idx < len(forms) else forms[0]
+
+    def pgettext(self, context, message):
+        return self.gettext(context + "\x04" + message)
+
+    def npgettext(self, context, msgid1, msgid2, n):
+        return self.ngettext(context + "\x04" + msgid1, context + "\x04" + msgid2, n)
+
+
+class LazyTranslations(collections.abc.Mapping):
+    """ Translations of the installed languages which are loaded on the first use
+
+    Catalogs of foris and of the plugins are merged into a single catalog per language
+    (foris messages take precedence, then the plugins in the order they were loaded).
+    Only a few recently used languages are kept in memory (catalogs are loaded outside
+    of the lock so the requests for the loaded languages don't wait for it).
+    Unknown languages are translated as the default language.
+    """
+
+    MAX_LOADED = 3
+
+    def __init__(self, languages, directory):
+        self._languages = list(languages)
+        self._directories = [directory]
+        self._loaded = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.generation = 0  # changes when the catalogs change (see SimpleDelayedTranslator)
+
+    def add_locale_dir(self, directory):
+        """ Adds catalogs from another locale directory (e.g. of a plugin)
+
+        Their messages are used only when they are not translated in the catalogs added before.
+        """
+        with self._lock:
+            self._directories.append(directory)
+            # merged catalogs are rebuilt on the next use
+            self._loaded.clear()
+            self.generation += 1
+
+    @contextlib.contextmanager
+    def transient(self):
+        """ Catalogs loaded by the current thread within the block are not cached
+
+        Suitable for walking through all the languages (e.g. rendering of the assets
+        in background) which would evict the languages of the requests from the cache.
+        """
+        self._local.transient = {}
+        try:
+            yield
+        finally:
+            self._local.transient = None
+
+    def _load(self, lang):
+        logger.debug("Loading translations of '%s'." % lang)
+        translation = MergedTranslations(
+            [(directory, load_catalog(directory, lang)) for directory in list(self._directories)]
+        )
+        for message, used, ignored in translation.conflicts:
+            logger.debug(
+                "Translation of '%s' (%s) from '%s' is used instead of '%s'."
+                % (message, lang, used, ignored)
+            )
+        if translation.conflicts:
+            logger.info(
+                "%d conflicting messages in '%s' translations." % (len(translation.conflicts), lang)
+            )
+        return translation
+
+    def conflicts(self, lang):
+        """ Returns messages which are translated differently in multiple catalogs
+
+        :returns: [(message, locale dir used, locale dir ignored)]
+        :rtype: list
+        """
+        return list(self[lang].conflicts)
+
+    def __getitem__(self, lang):
+        if lang not in self._languages:
+            lang = DEFAULT_LANGUAGE
+
+        with self._lock:
+            translation = self._loaded.get(lang)
+            if translation is not None:
+                self._loaded.move_to_end(lang)
+                return translation
+            generation = self.generation
+
+        transient = getattr(self._local, "transient", None)
+        if transient is not None:
+            if lang not in transient:
+                transient[lang] = self._load(lang)
+            return transient[lang]
+
+        translation = self._load(lang)
+        with self._lock:
+            if generation != self.generation:
+                # catalogs changed while loading (don't cache the outdated translation)
+                return translation
+            # the language could have been loaded by another thread meanwhile
+            translation = self._loaded.setdefault(lang, translation)
+            self._loaded.move_to_end(lang)
+            while len(self._loaded) > self.MAX_LOADED:
+                self._loaded.popitem(last=False)
+            return translation
+
+    def __contains__(self, lang):
+        return lang in self._languages
+
+    def __iter__(self):
+        return iter(self._languages)
+
+    def __len__(self):
+        return len(self._languages)
+
+
+translations = LazyTranslations(languages, locale_directory)
+
+
+class DelayedString(object):
+    """ String which is rendered according to the current language when it is converted to str
+
+    The rendered value is cached per language. Formatting produces delayed strings as well
+    (nothing is rendered until the result is converted to str). `+` returns str in the current
+    language, use delayed_concat() to concatenate delayed strings.
+    """
+
+    __slots__ = ("_rendered",)
+
+    def __init__(self):
+        self._rendered = {}  # language -> (catalog generation, rendered text)
+
+    def _render(self, language):
+        raise NotImplementedError()
+
+    def render(self, language):
+        generation = translations.generation
+        cached = self._rendered.get(language)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        text = self._render(language)
+        self._rendered[language] = (generation, text)
+        return text
 
     def __str__(self):
-        return gettext(self.text)
+        return self.render(current_state.language)
 
     def __add__(self, other):
         return str(self) + other
 
+    def __radd__(self, other):
+        return other + str(self)
+
+    def __mod__(self, args):
+        return DelayedFormat(self, args)
+
+    def format(self, *args, **kwargs):
+        return DelayedFormat(self, args, kwargs)
+
+
+def _render_value(value, language):
+    if isinstance(value, DelayedString):
+        return value.render(language)
+    if isinstance(value, tuple):
+        return tuple(_render_value(e, language) for e in value)
+    if isinstance(value, dict):
+        return {k: _render_value(v, language) for k, v in value.items()}
+    return value
+
+
+class DelayedConcat(DelayedString):
+    __slots__ = ("parts",)
+
+    def __init__(self, parts):
+        super(DelayedConcat, self).__init__()
+        # flatten nested concatenations
+        flat = []
+        for part in parts:
+            if isinstance(part, DelayedConcat):
+                flat.extend(part.parts)
+            else:
+                flat.append(part)
+        self.parts = tuple(flat)
+
+    def _render(self, language):
+        return "".join(str(_render_value(e, language)) for e in self.parts)
+
+
+def delayed_concat(*parts):
+    """ Concatenates strings and delayed strings without rendering them
+
+    :rtype: DelayedString
+    """
+    return DelayedConcat(parts)
+
+
+class DelayedFormat(DelayedString):
+    """ Result of `delayed % args` (kwargs is None) or `delayed.format(*args, **kwargs)` """
+
+    __slots__ = ("template", "args", "kwargs")
+
+    def __init__(self, template, args, kwargs=None):
+        super(DelayedFormat, self).__init__()
+        self.template = template
+        self.args = args
+        self.kwargs = kwargs
+
+    def _render(self, language):
+        template = self.template.render(language)
+        if self.kwargs is None:
+            return template % _render_value(self.args, language)
+        return template.format(
+            *_render_value(tuple(self.args), language), **_render_value(self.kwargs, language)
+        )
+
+
+class SimpleDelayedTranslator(DelayedString):
+    """ Message which is translated when it is rendered (see gettext_dummy) """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        super(SimpleDelayedTranslator, self).__init__()
+        self.text = text
+
+    def _render(self, language):
+        return translations[language].gettext(self.text)
+
+
+_delayed_messages = {}  # message -> SimpleDelayedTranslator
+
+
+def gettext_dummy(message):
+    """ Returns a delayed translation of the message (the same instance for the same message)
+    """
+    try:
+        return _delayed_messages[message]
+    except KeyError:
+        return _delayed_messages.setdefault(message, SimpleDelayedTranslator(message))
+
 
 gettext = lambda x: translations[current_state.language].gettext(x)
 ngettext = lambda singular, plural, n: translations[current_state.language].ngettext(
     singular, plural, n
 )
-gettext_dummy = lambda x: SimpleDelayedTranslator(x)
 
 _ = gettext
 
@@ -4,6 +4,7 @@ import os
 import glob
 import re
 import copy
+import importlib.util
 
 from setuptools import setup
 from setuptools.command.build_py import build_py
@@ -47,6 +48,16 @@ def merge_po_files():
             write_po(f, foris_catalog, no_location=True)
 
 
+def build_static_manifest():
+    # load the module directly (foris.utils requires runtime dependencies)
+    spec = importlib.util.spec_from_file_location(
+        "static_manifest", os.path.join(BASE_DIR, "foris/utils/static_manifest.py")
+    )
+    static_manifest = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(static_manifest)
+    static_manifest.build_manifest(os.path.join(BASE_DIR, "foris/static"), compress=True)
+
+
 class BuildCmd(build_py):
     def run(self):
         # prepare messages.po
@@ -62,6 +73,9 @@ class BuildCmd(build_py):
         cmd.ensure_finalized()
         cmd.run()
 
+        # digests of static files (see foris.utils.static_manifest)
+        build_static_manifest()
+
         # run original build cmd
         build_py.run(self)
 
@@ -82,6 +96,7 @@ setup(
         "flup",
         "ubus @ git+https://gitlab.nic.cz/turris/python-ubus.git",
         "paho-mqtt",
+        'importlib_metadata; python_version<"3.8"',
     ],
     setup_requires=["babel", "jinja2"],
     provides=["foris"],
@@ -97,18 +112,24 @@ setup(
         "foris.utils",
         "foris.ubus",
         "foris.middleware",
+        "foris.sessions",
         "foris_plugins",
     ],
     package_data={
         "": [
             "LICENSE",
+            "static-manifest.json",
             "locale/**/LC_MESSAGES/*.mo",
             "templates/**",
             "templates/**/*",
             "static/css/*.css",
+            "static/css/*.gz",
+            "static/css/*.br",
             "static/fonts/*",
             "static/img/*",
             "static/js/*.js",
+            "static/js/*.gz",
+            "static/js/*.br",
             "static/js/contrib/*",
             "utils/*.pickle2",
         ]